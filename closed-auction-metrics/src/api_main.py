@@ -2,26 +2,44 @@
 
 import datetime
 import json
-from typing import Optional, Union, Dict
-from fastapi import FastAPI, Header, HTTPException, APIRouter
+from typing import Optional, Union, Dict, List, Tuple
+from fastapi import FastAPI, Header, HTTPException, APIRouter, Response
 from application.requests_responses import *
 import uvicorn
-from application.closed_auction_metrics_service import ClosedAuctionMetricsService
-from domain.auction_repository import AuctionRepository, InMemoryAuctionRepository
+from application.closed_auction_metrics_service import ClosedAuctionMetricsService, AUCTION_FIELDS, AGGREGATE_BUCKETS
+from application.auction_analytics import DEFAULT_RATIO_BINS, DEFAULT_LAST_MINUTE_US
+from domain.auction_repository import AuctionRepository, InMemoryAuctionRepository, RANKING_METRICS, ROLLUP_GRANULARITIES
 from domain.auction_repository_mongo import MongoDbAuctionRepository
+from domain.render_store import InMemoryRenderStore
+from domain.render_store_mongo import MongoDbRenderStore
+from application.render_cache import RenderCache, RENDER_WORKERS, CHART_MAX_POINTS
+from application.chart_prerenderer import ChartPrerenderer, PRERENDER_CHARTS
+from application.auction_consumer import store_auction_messages, store_auctions
 import asyncio
-import pika, sys, os
+import contextlib
+import pika, sys, os, time
+import functools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import aio_pika
+from starlette.concurrency import run_in_threadpool
 from multiprocessing import Process, Manager
 from multiprocessing.managers import BaseManager
 from infrastructure import utils
+from infrastructure.metrics import ThroughputMeter
 from domain.bid import Bid
 from domain.closed_auction import ClosedAuction
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 import pprint
 
 
 VERSION = 'v1'
 
+# a finalized auction never changes: responses about one may be cached (and revalidated by etag) for a long time
+AUCTION_CACHE_MAX_AGE_S = int(os.environ.get("CAM_AUCTION_CACHE_MAX_AGE_S", 365*24*3600))
+
 class RESTAPI:
 
     def __init__(self, c_a_m_service: ClosedAuctionMetricsService):
@@ -29,9 +47,19 @@ class RESTAPI:
         self.router = APIRouter()
         # self.router.add_api_route("/hello", self.hello, methods=["GET"])
         self.router.add_api_route("/", self.index, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/closedauctions/stream", self.stream_closed_auctions, response_class=StreamingResponse, methods=["GET"]) # before {item_id} so it is not shadowed
+        self.router.add_api_route(f"/api/{VERSION}"+"/closedauctions/top", self.get_top_closed_auctions, methods=["GET"]) # before {item_id} so it is not shadowed
         self.router.add_api_route(f"/api/{VERSION}"+"/closedauctions/{item_id}", self.get_closed_auction, methods=["GET"])
         self.router.add_api_route(f"/api/{VERSION}"+"/closedauctions/", self.get_closed_auctions, methods=["GET"])
         self.router.add_api_route(f"/api/{VERSION}"+"/closedauctions/{item_id}/visualization", self.get_closed_auction_visualization, response_class=HTMLResponse,methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/closedauctions/{item_id}/series", self.get_closed_auction_series, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/bidders/{bidder_user_id}/auctions", self.get_bidder_closed_auctions, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/sellers/{seller_user_id}/closedauctions", self.get_seller_closed_auctions, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/sellers/{seller_user_id}/stats", self.get_seller_closed_auction_stats, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/stats/closedauctions", self.get_closed_auction_stats, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/stats/closedauctions/rollups", self.get_closed_auction_rollups, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/stats/closedauctions/distributions", self.get_closed_auction_distributions, methods=["GET"])
+        self.router.add_api_route(f"/api/{VERSION}"+"/stats/rendercache", self.get_render_cache_stats, methods=["GET"])
         
     def index(self) -> dict:
         """Returns a default response when no endpoint is specified.
@@ -43,7 +71,7 @@ class RESTAPI:
         """
         return {"home": "route"}
 
-    def get_closed_auction(self, item_id: str, start: str=None, end: str=None, limit: str=None) -> Dict:
+    def get_closed_auction(self, item_id: str, response: Response, start: str=None, end: str=None, limit: str=None, include_bids: bool=True, fields: str=None, if_none_match: Optional[str]=Header(None)) -> Dict:
         """
         Returns a response containing all closed auctions between a specific time.
 
@@ -55,6 +83,12 @@ class RESTAPI:
             End time result filter (e.g. "4/26/2022 15:00:00.000000")
         limit : `str`
             Limits the number of reservation results returned 
+        include_bids : `bool`
+            If false, the "bids" list is left out (and never loaded from the database)
+        fields : `str`
+            Comma separated top-level fields to return (e.g. "item_id,end_time,winning_bid")
+        if_none_match : `str`
+            `If-None-Match` header; etags of a previously received response
 
         Returns
         -------
@@ -67,6 +101,10 @@ class RESTAPI:
         the closed auctions will be return in chronological increasing order by end_time.
         Query parameters are optional.
 
+        A found auction's response carries a strong `ETag` and an immutable `Cache-Control`.
+        If `If-None-Match` matches, the response is a 304 without a body, and the auction is
+        not loaded from the database (only its stored content hash is).
+
         Sample URLs
         No query parameters: http://127.0.0.1:51224/api/v1/closedauctions/100
         With query parameters: http://127.0.0.1:51224/api/v1/closedauctions/100?start=05/04/2022&end=05/05/2022&limit=2
@@ -115,9 +153,16 @@ class RESTAPI:
         if end is None: 
             end = utils.TIME_ZONE.localize(datetime.datetime(year=4000,month=1,day=1))
 
-        return self.c_a_m_service.get_auction_data(item_id=item_id,start=start,end=end,limit=limit)
+        etag = self.c_a_m_service.get_auction_data_etag(item_id, include_bids=include_bids, fields=_parse_fields(fields))
+        if etag and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=_immutable_cache_headers(etag))
 
-    def get_closed_auctions(self, start: str=None, end: str=None, limit: int=None) -> Dict:
+        data = self.c_a_m_service.get_auction_data(item_id=item_id,start=start,end=end,limit=limit,include_bids=include_bids,fields=_parse_fields(fields))
+        if etag and data: # never cache a miss; the auction may be stored later
+            response.headers.update(_immutable_cache_headers(etag))
+        return data
+
+    def get_closed_auctions(self, response: Response, start: str=None, end: str=None, limit: int=None, cursor: str=None, include_bids: bool=True, fields: str=None) -> Dict:
         """
         Returns a response containing all closed auctions between a specific time.
 
@@ -129,6 +174,14 @@ class RESTAPI:
             End time result filter (e.g. "4/26/2022 15:00:00.000000")
         limit : `str`
             Limits the number of reservation results returned 
+        cursor : `str`
+            Opaque continuation token taken from the `X-Next-Cursor` header of a
+            previous response; returns the page of auctions that ended just before it
+        include_bids : `bool`
+            If false, the "bids" lists are left out (and never loaded from the database);
+            much smaller and faster for dashboards that only need prices, times and winners
+        fields : `str`
+            Comma separated top-level fields to return (e.g. "item_id,end_time,winning_bid")
 
         Returns
         -------
@@ -141,9 +194,16 @@ class RESTAPI:
         the closed auctions will be return in chronological increasing order by end_time.
         Query parameters are optional.
 
+        Each response holds the most recently ended auctions in the window (up to limit).
+        When older auctions remain, the response carries an `X-Next-Cursor` header; pass it
+        back as `cursor` (with the same start/end/limit) to fetch the page before it. Every
+        page is an index seek, so walking a whole day costs the same per page.
+
         Sample URLs
         No query parameters: http://127.0.0.1:51224/api/v1/closedauctions/100
         With query parameters: http://127.0.0.1:51224/api/v1/closedauctions/100?start=05/04/2022&end=05/05/2022&limit=2
+        Next page: http://127.0.0.1:51224/api/v1/closedauctions/?limit=2&cursor=WyIyMDIyLTAzLTE4IDAwOjAwOjAwLjEzMDAwMiIsIjIwMCJd
+        Summaries: http://127.0.0.1:51224/api/v1/closedauctions/?include_bids=false
 
         Sample response body:
         {
@@ -211,27 +271,220 @@ class RESTAPI:
         """
 
 
-        if start is None: 
-            start_datetime = utils.TIME_ZONE.localize(datetime.datetime(year=1500,month=1,day=1))
-        else:
-            try:
-                print(start)
-                start_datetime = utils.toDatetimeFromStr(start)
-            except ValueError:
-                raise HTTPException(status_code=400, detail=f"start (time) has incorrect data format, should be {utils.TIME_PARSE_FORMAT}")
-            
-        if end is None: 
-            end_datetime = utils.TIME_ZONE.localize(datetime.datetime(year=4000,month=1,day=1))
-        else:
-            try:
-                print(end)
-                end_datetime = utils.toDatetimeFromStr(end)
-            except ValueError:
-                raise HTTPException(status_code=400, detail=f"end (time) incorrect data format, should be {utils.TIME_PARSE_FORMAT}")
+        start_datetime, end_datetime = _parse_time_window(start, end)
+
+        try:
+            page, next_cursor = self.c_a_m_service.get_auction_page(start=start_datetime,end=end_datetime,limit=limit,cursor=cursor,include_bids=include_bids,fields=_parse_fields(fields))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor is malformed; pass back the X-Next-Cursor value of a previous response")
+
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return page
+
+    def get_bidder_closed_auctions(self, bidder_user_id: str, response: Response, start: str=None, end: str=None, limit: int=None, cursor: str=None, include_bids: bool=True, fields: str=None) -> Dict:
+        """
+        Returns the closed auctions a user placed at least one bid on, and whether they won each.
+
+        Parameters
+        ----------
+        bidder_user_id : `str`
+            user id of the bidder
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000")
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        limit : `int`
+            Limits the number of auctions returned per page
+        cursor : `str`
+            Opaque continuation token taken from the `X-Next-Cursor` header of a previous response
+        include_bids : `bool`
+            If false, the "bids" lists are left out (and never loaded from the database)
+        fields : `str`
+            Comma separated top-level fields to return (e.g. "item_id,end_time,metrics")
+
+        Returns
+        -------
+        : `dict` [`str`, `dict`]
+            Closed auctions keyed by item_id, in chronological increasing order by end_time,
+            each with a "won" flag (true if the user is the auction's winner)
+
+        Notes
+        -----
+        Paged like /closedauctions/ (most recent page first; follow `X-Next-Cursor`). Served from
+        an index on the bidders of every auction, so a page costs an index seek plus the auctions
+        on it, however many auctions there are.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/bidders/asclark/auctions?limit=20&include_bids=false
+        """
+        start_datetime, end_datetime = _parse_time_window(start, end)
+
+        try:
+            page, next_cursor = self.c_a_m_service.get_bidder_auction_page(bidder_user_id, start=start_datetime,end=end_datetime,limit=limit,cursor=cursor,include_bids=include_bids,fields=_parse_fields(fields))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor is malformed; pass back the X-Next-Cursor value of a previous response")
+
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return page
+
+    def get_seller_closed_auctions(self, seller_user_id: str, response: Response, start: str=None, end: str=None, limit: int=None, cursor: str=None, include_bids: bool=True, fields: str=None) -> Dict:
+        """
+        Returns the closed auctions of a seller.
+
+        Parameters
+        ----------
+        seller_user_id : `str`
+            user id of the seller
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000")
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        limit : `int`
+            Limits the number of auctions returned per page
+        cursor : `str`
+            Opaque continuation token taken from the `X-Next-Cursor` header of a previous response
+        include_bids : `bool`
+            If false, the "bids" lists are left out (and never loaded from the database)
+        fields : `str`
+            Comma separated top-level fields to return (e.g. "item_id,end_time,metrics")
+
+        Returns
+        -------
+        : `dict` [`str`, `dict`]
+            Closed auctions keyed by item_id, in chronological increasing order by end_time
+
+        Notes
+        -----
+        Paged like /closedauctions/ (most recent page first; follow `X-Next-Cursor`). Served from
+        an index on (seller_user_id, end_time); auctions stored before sellers were recorded have
+        no seller and are not returned.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/sellers/asclark/closedauctions?limit=20&include_bids=false
+        """
+        start_datetime, end_datetime = _parse_time_window(start, end)
+
+        try:
+            page, next_cursor = self.c_a_m_service.get_seller_auction_page(seller_user_id, start=start_datetime,end=end_datetime,limit=limit,cursor=cursor,include_bids=include_bids,fields=_parse_fields(fields))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor is malformed; pass back the X-Next-Cursor value of a previous response")
+
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return page
+
+    def get_seller_closed_auction_stats(self, seller_user_id: str, start: str=None, end: str=None, bucket: str="day") -> List[Dict]:
+        """
+        Returns a seller's metrics (sell-through, average final price, ...) per time bucket.
+
+        Parameters
+        ----------
+        seller_user_id : `str`
+            user id of the seller
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000")
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        bucket : `str`
+            Bucket size by end time; one of "minute", "hour" or "day" (buckets are aligned to UTC)
+
+        Returns
+        -------
+        buckets : `list` [`dict`]
+            As /stats/closedauctions, over the seller's auctions only
+
+        Notes
+        -----
+        The database selects the seller's auctions through the (seller_user_id, end_time)
+        index and reduces them itself, so only the per-bucket totals reach the service.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/sellers/asclark/stats?start=2022-03-17%2000:00:00.000000&bucket=day
+        """
+        if bucket not in AGGREGATE_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"unknown bucket '{bucket}'; choose from {list(AGGREGATE_BUCKETS)}")
+        start_datetime, end_datetime = _parse_time_window(start, end)
+        return self.c_a_m_service.get_auction_aggregates(start=start_datetime, end=end_datetime, bucket=bucket, seller_user_id=seller_user_id)
+
+    def stream_closed_auctions(self, start: str=None, end: str=None, include_bids: bool=True, fields: str=None) -> StreamingResponse:
+        """
+        Streams every closed auction between a specific time as newline-delimited json.
+
+        Parameters
+        ----------
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000")
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        include_bids : `bool`
+            If false, the "bids" lists are left out (and never loaded from the database)
+        fields : `str`
+            Comma separated top-level fields to return (e.g. "item_id,end_time,winning_bid")
+
+        Returns
+        -------
+        : `StreamingResponse`
+            An `application/x-ndjson` body with one closed auction (same shape as the
+            values returned by /closedauctions/) per line.
+
+        Notes
+        -----
+        Intended for bulk pulls of wide time windows. Unlike /closedauctions/ there is no
+        limit; auctions are written in chronological increasing order by end_time as they
+        are read from the database, so memory use does not grow with the window.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/closedauctions/stream?start=2022-03-17%2000:00:00.000000&end=2022-03-18%2000:00:00.000000
+
+        Sample response body:
+        {"item_id":"200","start_price_in_cents":3400,"start_time":"2022-03-17 00:00:00.130002",...}
+        {"item_id":"201","start_price_in_cents":3400,"start_time":"2022-03-17 00:00:00.130002",...}
+        """
+
+        start_datetime, end_datetime = _parse_time_window(start, end)
+        auction_lines = self.c_a_m_service.stream_auction_data(start=start_datetime,end=end_datetime,include_bids=include_bids,fields=_parse_fields(fields))
+        return StreamingResponse(auction_lines, media_type="application/x-ndjson")
 
-        return self.c_a_m_service.get_auction_data(item_id=None,start=start_datetime,end=end_datetime,limit=limit)
+    def get_top_closed_auctions(self, by: str="final_price_in_cents", limit: int=None, include_bids: bool=True, fields: str=None) -> Dict:
+        """
+        Returns the closed auctions with the highest value of a derived metric.
+
+        Parameters
+        ----------
+        by : `str`
+            Metric to rank by; one of "final_price_in_cents", "final_to_start_price_ratio",
+            "num_bids" or "num_unique_bidders"
+        limit : `int`
+            Max number of auctions to return (defaults to 10 when stored in MongoDB)
+        include_bids : `bool`
+            If false, the "bids" lists are left out (and never loaded from the database)
+        fields : `str`
+            Comma separated top-level fields to return (e.g. "item_id,metrics")
+
+        Returns
+        -------
+        auctions : `dict` [`str`, `dict`]
+            Closed auctions keyed by item id, highest value first (ties by item id,
+            descending). Auctions without a value for the metric (e.g. the final price
+            of an unsold auction) are left out.
 
-    def get_closed_auction_visualization(self, item_id:str) -> HTMLResponse:
+        Notes
+        -----
+        The metrics are derived once, when an auction is saved, and stored (and indexed)
+        with it; see the "metrics" field of a closed auction.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/closedauctions/top?by=num_bids&limit=5&include_bids=false
+        """
+        if by not in RANKING_METRICS:
+            raise HTTPException(status_code=400, detail=f"unknown metric '{by}'; choose from {list(RANKING_METRICS)}")
+        if limit is not None and limit < 1:
+            raise HTTPException(status_code=400, detail="limit must be at least 1")
+        return self.c_a_m_service.get_ranked_auction_data(by, limit=limit, include_bids=include_bids, fields=_parse_fields(fields))
+
+    def get_closed_auction_visualization(self, item_id:str, if_none_match: Optional[str]=Header(None)) -> HTMLResponse:
         """
         Returns an html response showing the bid history for the particular item.
 
@@ -239,6 +492,8 @@ class RESTAPI:
         ----------
         item_id : `str`
             item id
+        if_none_match : `str`
+            `If-None-Match` header; etags of a previously received response
 
         Returns
         -------
@@ -247,14 +502,230 @@ class RESTAPI:
         
         Notes
         -----
+        Cached and revalidated like /closedauctions/{item_id}: a matching `If-None-Match`
+        gets a 304 without the auction being loaded or its chart looked up.
+        """
+        etag = self.c_a_m_service.get_auction_visualization_etag(item_id)
+        if etag and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=_immutable_cache_headers(etag))
+
+        html = self.c_a_m_service.get_auction_visualization_html(item_id=item_id)
+        if etag and html.status_code == 200:
+            html.headers.update(_immutable_cache_headers(etag))
+        return html
+
+    def get_closed_auction_series(self, item_id: str, response: Response, max_points: int=None, if_none_match: Optional[str]=Header(None)) -> Dict:
+        """
+        Returns the data behind the bid history chart, for clients that draw it themselves.
+
+        Parameters
+        ----------
+        item_id : `str`
+            item id
+        max_points : `int`
+            Bid histories longer than this are downsampled (largest-triangle-three-buckets,
+            always keeping the highest bid); at least 3. Defaults to the chart's point budget
+            (CAM_CHART_MAX_POINTS)
+        if_none_match : `str`
+            `If-None-Match` header; etags of a previously received response
+
+        Returns
+        -------
+        series : `dict`
+            bid times (epoch microseconds) and amounts (cents) as parallel arrays, drawn as a
+            step function held until the next bid ("step": "post"), plus the highest bid and
+            the auction's start, cancellation and end times
+
+        Notes
+        -----
+        Responds 404 if there is no closed auction for the item. Cached and revalidated like
+        /closedauctions/{item_id}.
         """
+        if max_points is not None and max_points < 3:
+            raise HTTPException(status_code=400, detail="max_points must be at least 3")
+        if max_points is None:
+            max_points = CHART_MAX_POINTS
 
-        return self.c_a_m_service.get_auction_visualization_html(item_id=item_id)
+        etag = self.c_a_m_service.get_auction_series_etag(item_id, max_points=max_points)
+        if etag and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=_immutable_cache_headers(etag))
 
+        series = self.c_a_m_service.get_auction_series(item_id, max_points=max_points)
+        if series is None:
+            raise HTTPException(status_code=404, detail=f"could not find closed auction for item_id={item_id}")
+        if etag:
+            response.headers.update(_immutable_cache_headers(etag))
+        return series
+
+    def get_closed_auction_stats(self, start: str=None, end: str=None, bucket: str="day") -> List[Dict]:
+        """
+        Returns marketplace metrics of the closed auctions that ended between a specific time, per time bucket.
+
+        Parameters
+        ----------
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000")
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        bucket : `str`
+            Bucket size by end time; one of "minute", "hour" or "day" (buckets are aligned to UTC)
+
+        Returns
+        -------
+        buckets : `list` [`dict`]
+            One entry per bucket with at least one auction, in chronological order:
+            bucket_start, num_auctions (volume), num_sold, num_cancelled, num_bids,
+            gmv_in_cents, avg_final_price_in_cents, median_final_price_in_cents,
+            sell_through_rate, cancellation_rate and avg_bids_per_auction
+
+        Notes
+        -----
+        Computed by the database from the metrics stored with each auction; no auction
+        is sent to the service. The database still reads every auction in the window, so
+        the cost of a response grows with it. The median is taken from a count of auctions
+        per final price, so the sort and the memory it needs grow only with the number of
+        distinct prices per bucket. For totals over long windows use /stats/closedauctions/rollups.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/stats/closedauctions?start=2022-03-17%2000:00:00.000000&end=2022-03-24%2000:00:00.000000&bucket=day
+        """
+        if bucket not in AGGREGATE_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"unknown bucket '{bucket}'; choose from {list(AGGREGATE_BUCKETS)}")
+        start_datetime, end_datetime = _parse_time_window(start, end)
+        return self.c_a_m_service.get_auction_aggregates(start=start_datetime, end=end_datetime, bucket=bucket)
+
+    def get_closed_auction_rollups(self, start: str=None, end: str=None, granularity: str="hour") -> List[Dict]:
+        """
+        Returns hourly or daily totals of the closed auctions that ended between a specific time.
+
+        Parameters
+        ----------
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000"); the bucket it falls in is included
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        granularity : `str`
+            "hour" or "day" (buckets are aligned to UTC)
+
+        Returns
+        -------
+        buckets : `list` [`dict`]
+            One entry per bucket with at least one auction, in chronological order:
+            bucket_start, num_auctions, num_sold, num_cancelled, num_bids, gmv_in_cents,
+            min/max_final_price_in_cents (only if something sold), avg_final_price_in_cents,
+            sell_through_rate, cancellation_rate and avg_bids_per_auction
+
+        Notes
+        -----
+        The totals are updated as auctions are saved, so a response costs one read per bucket
+        however many auctions the window holds; intended for dashboards that poll. Unlike
+        /stats/closedauctions there is no median, and buckets cannot be smaller than an hour.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/stats/closedauctions/rollups?start=2022-03-17%2000:00:00.000000&granularity=hour
+        """
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"unknown granularity '{granularity}'; choose from {list(ROLLUP_GRANULARITIES)}")
+        start_datetime, end_datetime = _parse_time_window(start, end)
+        return self.c_a_m_service.get_auction_rollups(start=start_datetime, end=end_datetime, granularity=granularity)
+
+    def get_closed_auction_distributions(self, start: str=None, end: str=None, bins: int=DEFAULT_RATIO_BINS, last_minute_s: float=DEFAULT_LAST_MINUTE_US/1e6) -> Dict:
+        """
+        Returns distributions across the closed auctions that ended between a specific time.
+
+        Parameters
+        ----------
+        start : `str`
+            Start time result filter (e.g. "2022-04-25 15:00:00.000000")
+        end : `str`
+            End time result filter (e.g. "2022-04-26 15:00:00.000000")
+        bins : `int`
+            Number of bins of the final/start price ratio histogram
+        last_minute_s : `float`
+            Bids received this many seconds (or fewer) before their auction ended count as last-minute bids
+
+        Returns
+        -------
+        distributions : `dict`
+            num_auctions, num_bids, last_minute_bid_share and the distributions (count, mean,
+            p50, p90, p99, max) of final_to_start_price_ratio (plus a histogram), of
+            time_to_first_bid_us, of bid_interarrival_us and of bids_per_bidder
+
+        Notes
+        -----
+        The window is loaded with a projection (bid times and bidders only) into arrays
+        and reduced in bulk. Cost grows with the number of bids in the window; prefer
+        /stats/closedauctions/rollups for dashboards that poll.
+
+        Sample URL
+        http://127.0.0.1:51224/api/v1/stats/closedauctions/distributions?start=2022-03-17%2000:00:00.000000&end=2022-03-24%2000:00:00.000000
+        """
+        if bins < 1:
+            raise HTTPException(status_code=400, detail="bins must be at least 1")
+        if last_minute_s < 0:
+            raise HTTPException(status_code=400, detail="last_minute_s must not be negative")
+        start_datetime, end_datetime = _parse_time_window(start, end)
+        return self.c_a_m_service.get_auction_distributions(start=start_datetime, end=end_datetime, ratio_bins=bins, last_minute_us=int(last_minute_s*1e6))
+
+    def get_render_cache_stats(self) -> Dict:
+        """
+        Returns hit/miss counters of the bid history chart cache.
+
+        Returns
+        -------
+        stats : `dict`
+            memory_hits, store_hits (persistent tier) and misses (renders), plus the
+            size of the in-process tier
+        """
+        return self.c_a_m_service.get_render_cache_stats()
+
+
+def _parse_time_window(start: Optional[str], end: Optional[str]) -> Tuple[datetime.datetime, datetime.datetime]:
+    """parses the start/end query parameters of a time window, defaulting to an unbounded window."""
+    if start is None: 
+        start_datetime = utils.TIME_ZONE.localize(datetime.datetime(year=1500,month=1,day=1))
+    else:
+        try:
+            start_datetime = utils.toDatetimeFromStr(start)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"start (time) has incorrect data format, should be {utils.TIME_PARSE_FORMAT}")
+        
+    if end is None: 
+        end_datetime = utils.TIME_ZONE.localize(datetime.datetime(year=4000,month=1,day=1))
+    else:
+        try:
+            end_datetime = utils.toDatetimeFromStr(end)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"end (time) incorrect data format, should be {utils.TIME_PARSE_FORMAT}")
+
+    return start_datetime, end_datetime
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """whether an If-None-Match header value matches etag (weak comparison, as the header requires)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+def _immutable_cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={AUCTION_CACHE_MAX_AGE_S}, immutable"}
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """parses the comma separated fields query parameter (None means all fields)."""
+    if fields is None:
+        return None
+    field_list = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in field_list if field not in AUCTION_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown fields {unknown}; choose from {list(AUCTION_FIELDS)}")
+    return field_list
 
 def start_receiving_rabbitmsgs(c_a_m_service : ClosedAuctionMetricsService):
     try:
-        receive_rabbitmq_msgs(c_a_m_service)
+        if CONSUMER_MODE == "pooled":
+            receive_rabbitmq_msgs_pooled(c_a_m_service)
+        else:
+            receive_rabbitmq_msgs_batched(c_a_m_service)
     except KeyboardInterrupt:
         print('Interrupted')
         try:
@@ -262,40 +733,307 @@ def start_receiving_rabbitmsgs(c_a_m_service : ClosedAuctionMetricsService):
         except SystemExit:
             os._exit(0)
 
-def receive_rabbitmq_msgs(c_a_m_service : ClosedAuctionMetricsService):
+RABBITMQ_HOST = "rabbitmq-server" # e.g. "localhost"
+AUCTION_END_EXCHANGE_NAME = "auction.end"
+AUCTION_END_QUEUE_NAME = "cam.consume-auctionend"
+# messages that can never be stored (malformed, or rejected by the database) are dead-lettered here rather than requeued
+AUCTION_END_DEAD_LETTER_EXCHANGE_NAME = "cam.auctionend.dead-letter"
+AUCTION_END_DEAD_LETTER_QUEUE_NAME = "cam.consume-auctionend.dead-letter"
+AUCTION_END_QUEUE_ARGUMENTS = {"x-dead-letter-exchange": AUCTION_END_DEAD_LETTER_EXCHANGE_NAME}
+
+# batching consumer settings (overridable through the environment)
+CONSUMER_BATCH_SIZE = int(os.environ.get("CAM_CONSUMER_BATCH_SIZE", 100)) # max messages per bulk write
+CONSUMER_BATCH_TIMEOUT_MS = int(os.environ.get("CAM_CONSUMER_BATCH_TIMEOUT_MS", 250)) # max wait to fill a batch
+CONSUMER_PREFETCH_COUNT = int(os.environ.get("CAM_CONSUMER_PREFETCH_COUNT", 2*CONSUMER_BATCH_SIZE)) # unacked messages in flight
+CONSUMER_RETRY_BACKOFF_S = 1.0 # pause before redelivering a batch whose write failed for a transient reason
+CONSUMER_RETRY_MAX_BACKOFF_S = 30.0 # the pooled consumer's writers retry in place, doubling the pause up to this
+
+def _declare_auction_end_queue(channel) -> str:
+    channel.exchange_declare(exchange=AUCTION_END_DEAD_LETTER_EXCHANGE_NAME, exchange_type='fanout', durable=True)
+    channel.queue_declare(queue=AUCTION_END_DEAD_LETTER_QUEUE_NAME, durable=True)
+    channel.queue_bind(exchange=AUCTION_END_DEAD_LETTER_EXCHANGE_NAME, queue=AUCTION_END_DEAD_LETTER_QUEUE_NAME)
+
+    channel.exchange_declare(exchange=AUCTION_END_EXCHANGE_NAME, exchange_type='fanout', durable=True)
+    result = channel.queue_declare(queue=AUCTION_END_QUEUE_NAME, durable=True, arguments=AUCTION_END_QUEUE_ARGUMENTS) #durable=True exclusive=False,
+    queue_name = result.method.queue
+
+    channel.queue_bind(exchange=AUCTION_END_EXCHANGE_NAME, queue=queue_name)
+    return queue_name
 
-    RABBITMQ_HOST = "rabbitmq-server" # e.g. "localhost"
-    EXCHANGE_NAME = "auction.end"
-    QUEUE_NAME = "cam.consume-auctionend"
+def receive_rabbitmq_msgs_batched(c_a_m_service : ClosedAuctionMetricsService, batch_size: int=CONSUMER_BATCH_SIZE, batch_timeout_ms: int=CONSUMER_BATCH_TIMEOUT_MS, prefetch_count: int=CONSUMER_PREFETCH_COUNT):
+    """
+    consumes auction.end messages in batches: up to batch_size messages (or whatever arrived
+    within batch_timeout_ms of the first one) are written with one bulk write, and only then
+    acknowledged with a single multiple-ack. a crash before the ack means rabbitmq redelivers
+    the batch (at-least-once); redelivered auctions are idempotent upserts. a failed write is
+    requeued only if it may succeed later (see store_auctions()); other messages are dead-lettered.
+    """
 
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
     channel = connection.channel()
 
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='fanout', durable=True)
-    result = channel.queue_declare(queue=QUEUE_NAME, durable=True) #durable=True exclusive=False,
-    queue_name = result.method.queue
+    queue_name = _declare_auction_end_queue(channel)
+    channel.basic_qos(prefetch_count=max(prefetch_count, batch_size)) # the broker must be able to deliver a full batch
 
-    channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name)
-    
-    print(' [*] Waiting for logs. To exit press CTRL+C')
+    print(f' [*] Waiting for auction data in batches of up to {batch_size} ({batch_timeout_ms}ms). To exit press CTRL+C')
+
+    batch_timeout_s = batch_timeout_ms/1000
+    batch : List[Tuple[int, bytes]] = [] # (delivery tag, body)
+    batch_deadline = 0.0
+    # yields (None, None, None) whenever no message arrives within the timeout
+    for method, properties, body in channel.consume(queue_name, inactivity_timeout=batch_timeout_s):
+        if method is not None:
+            if not batch:
+                batch_deadline = time.monotonic() + batch_timeout_s
+            batch.append((method.delivery_tag, body))
+        if batch and (len(batch) >= batch_size or method is None or time.monotonic() >= batch_deadline):
+            _store_batch(connection, channel, batch, c_a_m_service)
+            batch = []
+
+def _store_batch(connection, channel, batch: List[Tuple[int, bytes]], c_a_m_service : ClosedAuctionMetricsService):
+    outcome = store_auction_messages(c_a_m_service, batch)
+    if outcome.requeued:
+        connection.sleep(CONSUMER_RETRY_BACKOFF_S)
+
+    if len(outcome.acked) == len(batch):
+        channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+        print(f" [x] stored and acked batch of {len(batch)} messages")
+        return
+    for delivery_tag in outcome.acked:
+        channel.basic_ack(delivery_tag=delivery_tag)
+    for delivery_tag in outcome.requeued:
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+    for delivery_tag in outcome.dead_lettered:
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+    print(f" [x] batch of {len(batch)} messages: {len(outcome.acked)} stored, {len(outcome.requeued)} requeued, {len(outcome.dead_lettered)} dead-lettered")
+
+# pooled consumer settings (CAM_CONSUMER_MODE=pooled; only with CAM_RUN_MODE=processes, see _check_modes())
+CONSUMER_MODES = ("batched", "pooled")
+CONSUMER_MODE = os.environ.get("CAM_CONSUMER_MODE", "batched")
+CONSUMER_DECODE_WORKERS = int(os.environ.get("CAM_CONSUMER_DECODE_WORKERS", os.cpu_count() or 1)) # processes parsing messages
+CONSUMER_WRITE_WORKERS = int(os.environ.get("CAM_CONSUMER_WRITE_WORKERS", 4)) # threads writing to mongo; each owns a shard of item ids
+
+def _decode_auction_message(body: bytes) -> ClosedAuction:
+    # runs in a decode worker process
+    return ClosedAuctionMetricsService.parse_auction_data(json.loads(body))
+
+def receive_rabbitmq_msgs_pooled(c_a_m_service : ClosedAuctionMetricsService, decode_workers: int=CONSUMER_DECODE_WORKERS, write_workers: int=CONSUMER_WRITE_WORKERS, prefetch_count: int=CONSUMER_PREFETCH_COUNT):
+    """
+    consumes auction.end messages with a pool of workers:
+
+    - the pika thread hands each message body to a process pool (json parsing, timestamp
+      casting and ClosedAuction construction are cpu bound) and queues the pending result
+      in delivery order.
+    - a router thread collects the results in that same order and sends each auction to the
+      writer thread owning its item_id, so updates to one auction are written in delivery order.
+    - writer threads save whatever has queued up for them (up to CONSUMER_BATCH_SIZE) with one
+      bulk write, then ack those messages. a write that fails for a transient reason is retried
+      by the writer itself, with backoff, until it succeeds (requeueing would let a later update
+      of the same auction, in another batch, be written first); the shard waits behind it.
+      auctions that can never be stored are dead-lettered.
+
+    acks are handed back to the pika thread, since pika channels are not thread-safe. prefetch_count
+    bounds the number of messages in flight.
+    """
+    # the mongo client's monitor threads are already running; forkserver starts workers without forking them
+    decode_pool = ProcessPoolExecutor(max_workers=decode_workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
+    channel = connection.channel()
+
+    queue_name = _declare_auction_end_queue(channel)
+    channel.basic_qos(prefetch_count=prefetch_count)
+
+    meter = ThroughputMeter("auction.end consumer")
+    in_delivery_order : queue.Queue = queue.Queue() # (delivery tag, future of the decoded auction)
+    shards : List[queue.Queue] = [queue.Queue() for _ in range(write_workers)] # (delivery tag, auction)
+
+    def settle(delivery_tag: int, ack: bool, requeue: bool=False):
+        if ack:
+            connection.add_callback_threadsafe(functools.partial(channel.basic_ack, delivery_tag=delivery_tag))
+        else:
+            connection.add_callback_threadsafe(functools.partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=requeue))
+
+    def route():
+        while True:
+            delivery_tag, decoded = in_delivery_order.get()
+            try:
+                closed_auction : ClosedAuction = decoded.result()
+            except (KeyError, TypeError, ValueError) as e: # includes bodies that are not json
+                print(f" [!] dead-lettering message {delivery_tag}; malformed auction data: {e!r}")
+                settle(delivery_tag, False)
+                continue
+            except Exception as e:
+                print(f" [!] failed to decode message {delivery_tag} ({e!r}); requeueing")
+                settle(delivery_tag, False, requeue=True)
+                continue
+            shards[hash(closed_auction._item_id) % write_workers].put((delivery_tag, closed_auction))
+
+    def write(shard: queue.Queue):
+        while True:
+            batch = [shard.get()]
+            while len(batch) < CONSUMER_BATCH_SIZE:
+                try:
+                    batch.append(shard.get_nowait())
+                except queue.Empty:
+                    break
+            backoff_s = CONSUMER_RETRY_BACKOFF_S
+            outcome = store_auctions(c_a_m_service, batch)
+            while outcome.requeued: # retried here, not requeued, so this shard's writes stay in delivery order
+                time.sleep(backoff_s)
+                backoff_s = min(2*backoff_s, CONSUMER_RETRY_MAX_BACKOFF_S)
+                outcome = store_auctions(c_a_m_service, batch)
+            for delivery_tag in outcome.acked:
+                settle(delivery_tag, True)
+            for delivery_tag in outcome.dead_lettered:
+                settle(delivery_tag, False)
+            meter.record(len(outcome.acked))
+
+    threading.Thread(target=route, name="cam-consumer-router", daemon=True).start()
+    for i, shard in enumerate(shards):
+        threading.Thread(target=write, args=(shard,), name=f"cam-consumer-writer-{i}", daemon=True).start()
 
     def callback(ch, method, properties, body):
-        print(" [x] received new auction data.")
-        jsondata = json.loads(body)
-        print(json.dumps(jsondata, indent=2))
-        c_a_m_service.add_auction_data(jsondata)
+        in_delivery_order.put((method.delivery_tag, decode_pool.submit(_decode_auction_message, body)))
 
-    # def callback(ch, method, properties, body):
-    #     print(" [x] Received %r" % body.decode())
-    #     print(" [x] Done")
-    #     ch.basic_ack(delivery_tag=method.delivery_tag)
+    print(f' [*] Waiting for auction data ({decode_workers} decode processes, {write_workers} writer threads, prefetch {prefetch_count}). To exit press CTRL+C')
+    channel.basic_consume(queue=queue_name, on_message_callback=callback)
+    try:
+        channel.start_consuming()
+    finally:
+        decode_pool.shutdown(wait=False)
 
+CONSUMER_RECONNECT_DELAY_S = 5.0 # pause before reconnecting after the broker connection is lost
 
-    
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
-    # channel.basic_qos(prefetch_count=1)
-    # channel.basic_consume(queue='task_queue', on_message_callback=callback)
-    channel.start_consuming()
+async def _collect_batch(messages: asyncio.Queue, batch_size: int, batch_timeout_s: float) -> List[aio_pika.abc.AbstractIncomingMessage]:
+    """waits for one message, then for up to batch_size-1 more that arrive within batch_timeout_s."""
+    loop = asyncio.get_running_loop()
+    batch = [await messages.get()]
+    batch_deadline = loop.time() + batch_timeout_s
+    while len(batch) < batch_size:
+        remaining = batch_deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(messages.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+def _delivered_on_closed_channel(message: aio_pika.abc.AbstractIncomingMessage) -> bool:
+    """
+    whether message came from a channel that has since closed (connect_robust opens another
+    after a connection loss). the broker has already requeued such a message, and its delivery
+    tag means nothing on the new channel, so it must be neither stored nor settled here.
+    """
+    try:
+        return message.channel.is_closed
+    except aio_pika.exceptions.ChannelInvalidStateError: # newer aio-pika raises instead of returning the closed channel
+        return True
+
+def _drop_messages_from_closed_channels(messages: asyncio.Queue):
+    """removes the messages of closed channels from the local buffer; those of the open channel keep their order."""
+    buffered = []
+    while not messages.empty():
+        buffered.append(messages.get_nowait())
+    kept = [message for message in buffered if not _delivered_on_closed_channel(message)]
+    for message in kept:
+        messages.put_nowait(message)
+    if len(kept) < len(buffered):
+        print(f" [!] dropped {len(buffered) - len(kept)} buffered messages of the closed channel; the broker redelivers them")
+
+async def _store_batch_async(batch: List[aio_pika.abc.AbstractIncomingMessage], c_a_m_service : ClosedAuctionMetricsService):
+    live = [message for message in batch if not _delivered_on_closed_channel(message)]
+    if len(live) < len(batch):
+        print(f" [!] skipping {len(batch) - len(live)} messages of a closed channel; the broker redelivers them")
+    if not live:
+        return
+    batch = live # all from the one open channel, so their delivery tags are distinct
+
+    # pymongo is blocking; run the write on the same threadpool fastapi uses for the sync routes
+    outcome = await run_in_threadpool(store_auction_messages, c_a_m_service, [(message.delivery_tag, message.body) for message in batch])
+    if outcome.requeued:
+        await asyncio.sleep(CONSUMER_RETRY_BACKOFF_S)
+
+    if _delivered_on_closed_channel(batch[-1]): # the connection was lost during the write
+        print(f" [!] channel closed while storing a batch of {len(batch)} messages; the broker redelivers them (saves are upserts)")
+        return
+    if len(outcome.acked) == len(batch):
+        await batch[-1].ack(multiple=True)
+        print(f" [x] stored and acked batch of {len(batch)} messages")
+        return
+    messages = {message.delivery_tag: message for message in batch}
+    for delivery_tag in outcome.acked:
+        await messages[delivery_tag].ack()
+    for delivery_tag in outcome.requeued:
+        await messages[delivery_tag].nack(requeue=True)
+    for delivery_tag in outcome.dead_lettered:
+        await messages[delivery_tag].nack(requeue=False)
+    print(f" [x] batch of {len(batch)} messages: {len(outcome.acked)} stored, {len(outcome.requeued)} requeued, {len(outcome.dead_lettered)} dead-lettered")
+
+async def consume_rabbitmq_msgs_async(c_a_m_service : ClosedAuctionMetricsService, batch_size: int=CONSUMER_BATCH_SIZE, batch_timeout_ms: int=CONSUMER_BATCH_TIMEOUT_MS, prefetch_count: int=CONSUMER_PREFETCH_COUNT):
+    """
+    asyncio version of receive_rabbitmq_msgs_batched() (same batching and ack semantics),
+    meant to run as a task on the api's event loop so the consumer and the request handlers
+    share one ClosedAuctionMetricsService (and so one mongo connection pool).
+    """
+    connection = await aio_pika.connect_robust(host=RABBITMQ_HOST)
+    async with connection:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=max(prefetch_count, batch_size)) # the broker must be able to deliver a full batch
+        dead_letter_exchange = await channel.declare_exchange(AUCTION_END_DEAD_LETTER_EXCHANGE_NAME, aio_pika.ExchangeType.FANOUT, durable=True)
+        dead_letter_queue = await channel.declare_queue(AUCTION_END_DEAD_LETTER_QUEUE_NAME, durable=True)
+        await dead_letter_queue.bind(dead_letter_exchange)
+        exchange = await channel.declare_exchange(AUCTION_END_EXCHANGE_NAME, aio_pika.ExchangeType.FANOUT, durable=True)
+        queue = await channel.declare_queue(AUCTION_END_QUEUE_NAME, durable=True, arguments=AUCTION_END_QUEUE_ARGUMENTS)
+        await queue.bind(exchange)
+
+        messages : asyncio.Queue = asyncio.Queue()
+        # connect_robust reopens the channel (and re-consumes) after a connection loss; what is
+        # still buffered from the old channel was requeued by the broker, so drop it
+        channel.reopen_callbacks.add(lambda _channel, *_: _drop_messages_from_closed_channels(messages))
+        await queue.consume(messages.put)
+
+        print(f' [*] Waiting for auction data in batches of up to {batch_size} ({batch_timeout_ms}ms).')
+        while True:
+            batch = await _collect_batch(messages, batch_size, batch_timeout_ms/1000)
+            await _store_batch_async(batch, c_a_m_service)
+
+async def run_rabbitmq_consumer(c_a_m_service : ClosedAuctionMetricsService):
+    """keeps consume_rabbitmq_msgs_async() running; reconnects if the broker is down or goes away."""
+    while True:
+        try:
+            await consume_rabbitmq_msgs_async(c_a_m_service)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f" [!] rabbitmq consumer stopped ({e!r}); reconnecting in {CONSUMER_RECONNECT_DELAY_S}s")
+            await asyncio.sleep(CONSUMER_RECONNECT_DELAY_S)
+
+def attachRabbitMQConsumer(app: FastAPI, c_a_m_service : ClosedAuctionMetricsService):
+    """runs the rabbitmq consumer as a background task for as long as the app is up (its lifespan)."""
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        consumer = asyncio.create_task(run_rabbitmq_consumer(c_a_m_service))
+        try:
+            yield
+        finally:
+            consumer.cancel()
+            try:
+                await consumer
+            except asyncio.CancelledError:
+                pass
+
+    # FastAPI(lifespan=...) needs fastapi 0.93; the router's lifespan context is what it sets
+    app.router.lifespan_context = lifespan
+
+def serveInOneEventLoop(app: FastAPI, c_a_m_service : ClosedAuctionMetricsService, port: int, log_level: str = "info"):
+    """serves the rest api and consumes rabbitmq messages in this process, on one event loop. blocks."""
+    api = RESTAPI(c_a_m_service)
+    app.include_router(api.router)
+    attachRabbitMQConsumer(app, c_a_m_service)
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level=log_level)
 
 def startupRESTAPI(app: FastAPI, port:int, log_level:str = "info"):
     # uvicorn.run("api_main:app", port=51224, log_level=log_level)
@@ -310,7 +1048,27 @@ def startupRESTAPI(app: FastAPI, port:int, log_level:str = "info"):
 
 LOCAL_PORT = 51224 # port for this service (And its restful api)
 
+# "asyncio": api and rabbitmq consumer share one process and event loop (one service, one mongo client)
+# "processes": api in a child process, blocking pika consumer in the parent (one service each)
+RUN_MODES = ("asyncio", "processes")
+RUN_MODE = os.environ.get("CAM_RUN_MODE", "asyncio")
+
+def _check_modes(run_mode: str, consumer_mode: str):
+    """
+    raises ValueError for an unknown CAM_RUN_MODE or CAM_CONSUMER_MODE, or for a combination
+    that would be ignored: the asyncio run mode always consumes with the batched aio-pika
+    consumer, so the pooled consumer (blocking pika, with its own threads and processes)
+    needs the processes run mode.
+    """
+    if run_mode not in RUN_MODES:
+        raise ValueError(f"unknown CAM_RUN_MODE '{run_mode}'; choose from {list(RUN_MODES)}")
+    if consumer_mode not in CONSUMER_MODES:
+        raise ValueError(f"unknown CAM_CONSUMER_MODE '{consumer_mode}'; choose from {list(CONSUMER_MODES)}")
+    if consumer_mode == "pooled" and run_mode != "processes":
+        raise ValueError(f"CAM_CONSUMER_MODE=pooled needs CAM_RUN_MODE=processes; CAM_RUN_MODE={run_mode} consumes in batches on the api's event loop")
+
 def main():
+    _check_modes(RUN_MODE, CONSUMER_MODE)
 
     app = FastAPI()
 
@@ -340,6 +1098,12 @@ def main():
         auction_repo.save_auction(auction1)
         auction_repo.save_auction(auction2)
         auction_repo.save_auction(auction3)
+
+        if RUN_MODE == "asyncio":
+            render_cache = RenderCache(InMemoryRenderStore(), render_workers=RENDER_WORKERS)
+            prerenderer = ChartPrerenderer(render_cache) if PRERENDER_CHARTS else None
+            serveInOneEventLoop(app, ClosedAuctionMetricsService(auction_repo, render_cache, prerenderer), LOCAL_PORT)
+            return
     
         # app.closed_auction_metrics_service = closed_auction_metrics_service.ClosedAuctionMetricsService(auction_repo)
         # c_a_m_service = ClosedAuctionMetricsService(auction_repo)
@@ -359,6 +1123,14 @@ def main():
     else: # use sql repos
         # auction_repo: AuctionRepository = InMemoryAuctionRepository()
         CAM_MONGO_CONTAINER_HOSTNAME = "cam-mongo-server"
+
+        if RUN_MODE == "asyncio":
+            auction_repo: AuctionRepository = MongoDbAuctionRepository(CAM_MONGO_CONTAINER_HOSTNAME)
+            render_cache = RenderCache(MongoDbRenderStore(auction_repo.my_db), render_workers=RENDER_WORKERS)
+            prerenderer = ChartPrerenderer(render_cache) if PRERENDER_CHARTS else None
+            serveInOneEventLoop(app, ClosedAuctionMetricsService(auction_repo, render_cache, prerenderer), LOCAL_PORT)
+            return
+
         auction_repo1: AuctionRepository = MongoDbAuctionRepository(CAM_MONGO_CONTAINER_HOSTNAME)
         auction_repo2: AuctionRepository = MongoDbAuctionRepository(CAM_MONGO_CONTAINER_HOSTNAME)
 
@@ -384,8 +1156,10 @@ def main():
         # auction_repo2.save_auction(auction2)
         # auction_repo2.save_auction(auction3)
 
-        c_a_m_service1 = ClosedAuctionMetricsService(auction_repo1)
-        c_a_m_service2 = ClosedAuctionMetricsService(auction_repo2)
+        c_a_m_service1 = ClosedAuctionMetricsService(auction_repo1, RenderCache(MongoDbRenderStore(auction_repo1.my_db), render_workers=RENDER_WORKERS))
+        # the consumer's renders reach the api through the shared rendered_charts collection
+        render_cache2 = RenderCache(MongoDbRenderStore(auction_repo2.my_db))
+        c_a_m_service2 = ClosedAuctionMetricsService(auction_repo2, render_cache2, ChartPrerenderer(render_cache2) if PRERENDER_CHARTS else None)
 
         api = RESTAPI(c_a_m_service1)
         app.include_router(api.router)
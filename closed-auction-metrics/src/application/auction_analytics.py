@@ -0,0 +1,54 @@
+from typing import Dict
+
+import numpy as np
+
+from domain.auction_window import AuctionWindowColumns
+
+DEFAULT_RATIO_BINS = 20 # bins of the final/start price ratio histogram
+DEFAULT_LAST_MINUTE_US = 60_000_000 # bids received this close to an auction's end count as last-minute bids
+
+def window_analytics(window: AuctionWindowColumns, ratio_bins: int=DEFAULT_RATIO_BINS, last_minute_us: int=DEFAULT_LAST_MINUTE_US) -> Dict:
+    """
+    distributions across every auction (and bid) of a window: final/start price ratio
+    (with a histogram), time to first bid, bid inter-arrival time, the share of bids that
+    arrive in the last minute, and bids per bidder. each is a handful of numpy operations
+    over the window's arrays; there is no python loop over auctions or bids.
+    """
+    bid_auctions = window.bid_auction_indices()
+    times = window._bid_times_received_us
+
+    # final/start price ratio, over sold auctions (with a start price)
+    sold = ~np.isnan(window._final_prices_in_cents) & (window._start_prices_in_cents > 0)
+    ratios = window._final_prices_in_cents[sold] / window._start_prices_in_cents[sold]
+    counts, edges = np.histogram(ratios, bins=ratio_bins) if len(ratios) else (np.empty(0, dtype=np.int64), np.empty(0))
+
+    # time to first bid: the minimum of each auction's (non-empty) run of bids
+    has_bids = np.diff(window._bid_offsets) > 0
+    first_bid_times = np.minimum.reduceat(times, window._bid_offsets[:-1][has_bids]) if len(times) else np.empty(0, dtype=np.int64)
+    time_to_first_bid = first_bid_times - window._start_times_us[has_bids]
+
+    # inter-arrival: consecutive bids in time order, within the same auction
+    order = np.lexsort((times, bid_auctions))
+    sorted_times, sorted_auctions = times[order], bid_auctions[order]
+    interarrival = np.diff(sorted_times)[sorted_auctions[1:] == sorted_auctions[:-1]]
+
+    last_minute = times >= window._end_times_us[bid_auctions] - last_minute_us
+
+    bids_per_bidder = np.bincount(window._bid_bidder_codes, minlength=len(window._bidder_user_ids))
+
+    return {
+        'num_auctions': len(window),
+        'num_bids': window.num_bids(),
+        'final_to_start_price_ratio': dict(_distribution(ratios), histogram={'counts': counts.tolist(), 'edges': edges.tolist()}),
+        'time_to_first_bid_us': _distribution(time_to_first_bid),
+        'bid_interarrival_us': _distribution(interarrival),
+        'last_minute_bid_share': float(last_minute.mean()) if len(last_minute) else None,
+        'bids_per_bidder': _distribution(bids_per_bidder),
+    }
+
+def _distribution(values: np.ndarray) -> Dict:
+    """count, mean and percentiles of values (None for all but the count if there are none)."""
+    if not len(values):
+        return {'count': 0, 'mean': None, 'p50': None, 'p90': None, 'p99': None, 'max': None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {'count': int(len(values)), 'mean': float(values.mean()), 'p50': p50, 'p90': p90, 'p99': p99, 'max': values.max().item()}
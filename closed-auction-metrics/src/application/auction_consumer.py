@@ -0,0 +1,51 @@
+import json
+from typing import List, NamedTuple, Tuple
+
+from application.closed_auction_metrics_service import ClosedAuctionMetricsService
+from domain.auction_repository import AuctionWriteError, TransientWriteError
+from domain.closed_auction import ClosedAuction
+
+class BatchOutcome(NamedTuple):
+    """
+    what to do with each message (delivery tag) of a batch of auction.end messages, whatever
+    rabbitmq client consumed them: ack it (stored), requeue it (the write may succeed later)
+    or dead-letter it (it can never be stored, so redelivering it would only block the queue).
+    """
+    acked: List[int]
+    requeued: List[int]
+    dead_lettered: List[int]
+
+def store_auction_messages(c_a_m_service: ClosedAuctionMetricsService, batch: List[Tuple[int, bytes]]) -> BatchOutcome:
+    """decodes a batch of (delivery tag, body) messages and stores them with store_auctions(); malformed messages are dead-lettered."""
+    tagged_auctions : List[Tuple[int, ClosedAuction]] = []
+    malformed : List[int] = []
+    for delivery_tag, body in batch:
+        try:
+            tagged_auctions.append((delivery_tag, ClosedAuctionMetricsService.parse_auction_data(json.loads(body))))
+        except (KeyError, TypeError, ValueError) as e: # includes bodies that are not json
+            print(f" [!] dead-lettering message {delivery_tag}; malformed auction data: {e!r}")
+            malformed.append(delivery_tag)
+    outcome = store_auctions(c_a_m_service, tagged_auctions)
+    return outcome._replace(dead_lettered=outcome.dead_lettered + malformed)
+
+def store_auctions(c_a_m_service: ClosedAuctionMetricsService, tagged_auctions: List[Tuple[int, ClosedAuction]]) -> BatchOutcome:
+    """
+    saves decoded auctions (each with the delivery tag of its message) with one write. only a
+    TransientWriteError requeues the batch. if the repository rejected some auctions for good
+    (AuctionWriteError), their messages are dead-lettered and the rest, already stored, acked.
+    any other error dead-letters the whole batch, since it would recur on every redelivery.
+    """
+    delivery_tags = [delivery_tag for delivery_tag, _ in tagged_auctions]
+    try:
+        c_a_m_service.save_closed_auctions([closed_auction for _, closed_auction in tagged_auctions])
+    except TransientWriteError as e:
+        print(f" [!] failed to store {len(tagged_auctions)} auctions ({e!r}); will retry")
+        return BatchOutcome([], delivery_tags, [])
+    except AuctionWriteError as e:
+        print(f" [!] {e}; dead-lettering their messages")
+        rejected = [delivery_tag for delivery_tag, closed_auction in tagged_auctions if closed_auction._item_id in e.failed_item_ids]
+        return BatchOutcome([delivery_tag for delivery_tag in delivery_tags if delivery_tag not in rejected], [], rejected)
+    except Exception as e:
+        print(f" [!] failed to store {len(tagged_auctions)} auctions ({e!r}); dead-lettering")
+        return BatchOutcome([], [], delivery_tags)
+    return BatchOutcome(delivery_tags, [], [])
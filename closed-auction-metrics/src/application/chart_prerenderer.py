@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+from domain.closed_auction import ClosedAuction
+from application.render_cache import RenderCache, render_bid_history_png
+
+PRERENDER_CHARTS = os.environ.get("CAM_PRERENDER_CHARTS", "0") == "1" # render charts when auctions are saved (off by default)
+PRERENDER_WORKERS = int(os.environ.get("CAM_PRERENDER_WORKERS", 2)) # render processes
+PRERENDER_MAX_PENDING = int(os.environ.get("CAM_PRERENDER_MAX_PENDING", 200)) # queued + running renders
+
+class ChartPrerenderer:
+    """
+    renders bid history charts in a bounded process pool as auctions are saved, and puts
+    them in a RenderCache (and so its persistent store), so the first viewer of a chart
+    does not pay for the render. submit() never blocks and never raises: when max_pending
+    renders are already in flight, or the pool cannot take them, further auctions are
+    skipped and rendered on first view instead. a pool broken by a dead worker is replaced.
+    """
+
+    def __init__(self, render_cache: RenderCache, max_workers: int=PRERENDER_WORKERS, max_pending: int=PRERENDER_MAX_PENDING) -> None:
+        self._render_cache = render_cache
+        self._max_workers = max_workers
+        self._pool_lock = threading.Lock()
+        self._pool = self._new_pool()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.skipped = 0
+        self.failed = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # auctions are saved from consumer threads; forkserver starts workers without forking them (like RenderCache's pool)
+        return ProcessPoolExecutor(max_workers=self._max_workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """replaces the pool after a worker died (which breaks it for good), unless another thread already has."""
+        with self._pool_lock:
+            if self._pool is broken:
+                print("[ChartPrerenderer] a render worker died; starting a new pool")
+                broken.shutdown(wait=False)
+                self._pool = self._new_pool()
+
+    def submit(self, auctions: List[ClosedAuction]):
+        # called right after the auctions were stored; a failure here must not look like a failed write
+        for auction in auctions:
+            if not self._slots.acquire(blocking=False):
+                self.skipped += 1
+                continue
+            pool = self._pool
+            try:
+                content_hash = auction.content_hash()
+                future = pool.submit(render_bid_history_png, auction)
+            except Exception as e:
+                self._slots.release()
+                self.failed += 1
+                print(f"[ChartPrerenderer] could not queue chart for item_id={auction._item_id}: {e!r}")
+                if isinstance(e, BrokenProcessPool):
+                    self._replace_pool(pool)
+                continue
+            future.add_done_callback(lambda f, item_id=auction._item_id, content_hash=content_hash, pool=pool: self._store(f, item_id, content_hash, pool))
+
+    def _store(self, future: Future, item_id: str, content_hash: str, pool: ProcessPoolExecutor):
+        try:
+            self._render_cache.put(item_id, content_hash, future.result())
+        except Exception as e:
+            self.failed += 1
+            print(f"[ChartPrerenderer] could not pre-render chart for item_id={item_id}: {e!r}")
+            if isinstance(e, BrokenProcessPool):
+                self._replace_pool(pool)
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait: bool=False):
+        with self._pool_lock:
+            self._pool.shutdown(wait=wait)
@@ -1,15 +1,33 @@
-from typing import Dict, List, Optional
-from domain.auction_repository import AuctionRepository, InMemoryAuctionRepository
+from typing import Dict, Iterator, List, Optional, Tuple
+from domain.auction_repository import AuctionRepository, InMemoryAuctionRepository, DEFAULT_AUCTIONS_LIMIT
 from infrastructure import utils
 from domain.bid import Bid
-from domain.closed_auction import ClosedAuction
+from domain.closed_auction import ClosedAuction, bid_history_png_as_html
+from application.render_cache import RenderCache, CHART_MAX_POINTS, CHART_VERSION
+from application.chart_prerenderer import ChartPrerenderer
+from application.auction_analytics import window_analytics, DEFAULT_RATIO_BINS, DEFAULT_LAST_MINUTE_US
 import datetime
+import hashlib
+import json
 from fastapi.responses import HTMLResponse
 
+# top-level fields of a closed auction in responses (see ClosedAuction.convert_to_dict())
+AUCTION_FIELDS = ("item_id", "seller_user_id", "start_price_in_cents", "start_time", "end_time", "cancellation_time", "finalized_time", "bids", "winning_bid", "metrics")
+
+# bucket sizes of get_auction_aggregates(), in microseconds of end time (aligned to the unix epoch, i.e. UTC)
+AGGREGATE_BUCKETS = {"minute": 60_000_000, "hour": 3_600_000_000, "day": 86_400_000_000}
+
+# part of every etag; bump when the shape of auction responses changes (e.g. a field is added to
+# ClosedAuction.convert_to_dict()), so clients holding an older body do not get a 304 for it
+RESPONSE_VERSION = 1
+
 class ClosedAuctionMetricsService():
 
-    def __init__(self,auction_repository : AuctionRepository) -> None:
+    def __init__(self,auction_repository : AuctionRepository, render_cache: Optional[RenderCache]=None, prerenderer: Optional[ChartPrerenderer]=None) -> None:
+        """prerenderer, if given, renders the charts of newly saved auctions in the background."""
         self._auction_repo = auction_repository
+        self._render_cache = render_cache if render_cache else RenderCache()
+        self._prerenderer = prerenderer
 
     def add_auction_data(self, data : Dict):
         print("[ClosedAuctionMetricsService] adding new auction data...")
@@ -57,17 +75,14 @@ class ClosedAuctionMetricsService():
         #     }
         # }
         
-        refined_data = self._cast_str_times_to_datetimes(data) # creates a new dict
-        # print()
-        # print(refined_data)
-        
-        closed_auction = self._create_closed_auction_from_data(refined_data) 
-        # print()
+        closed_auction = self.parse_auction_data(data)
         print("[ClosedAuctionMetricsService] created ClosedAuction object from refined data")
         print(closed_auction)
 
         print("[ClosedAuctionMetricsService] saving ClosedAuction object...")
         self._auction_repo.save_auction(closed_auction)
+        if self._prerenderer:
+            self._prerenderer.submit([closed_auction])
 
         # {
         #     'Item': {
@@ -90,31 +105,214 @@ class ClosedAuctionMetricsService():
         # {'Item': {'item_id': '20', 'seller_user_id': 'asclark109', 'start_time': '2022-11-23 01:41:13.629971', 'end_time': '2022-11-23 01:42:13.629971', 'start_price_in_cents': 2000}, 'Bids': [], 'Cancellation': {'time_received': '2022-11-23 01:41:18.633116'}, 'SentStartSoonAlert': True, 'SentEndSoonAlert': True, 'Finalization': {'time_received': '2022-11-23 01:41:23.630086'}}
         # {'Item': {'item_id': '20', 'seller_user_id': 'asclark109', 'start_time': '2022-11-23 01:38:13.664840', 'end_time': '2022-11-23 01:39:13.664840', 'start_price_in_cents': 2000}, 'Bids': [], 'Cancellation': {'time_received': '2022-11-23 01:38:18.669475'}, 'SentStartSoonAlert': False, 'SentEndSoonAlert': False, 'Finalization': None}
 
-    def get_auction_data(self, item_id: Optional[str], start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, limit: int=None) -> Dict:
+    def add_auctions_data(self, datas: List[Dict]) -> int:
+        """
+        saves a batch of auction.end messages with a single repository write. messages that
+        cannot be turned into a ClosedAuction are reported and skipped (redelivering them
+        would not help). if the same item appears more than once, the last copy wins.
+        raises if the write fails, so the caller can redeliver the whole batch. returns the
+        number of auctions saved.
+        """
+        closed_auctions : List[ClosedAuction] = []
+        for data in datas:
+            try:
+                closed_auctions.append(self.parse_auction_data(data))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"[ClosedAuctionMetricsService] skipping malformed auction data: {e!r}")
+
+        return self.save_closed_auctions(closed_auctions)
+
+    def save_closed_auctions(self, closed_auctions: List[ClosedAuction]) -> int:
+        """
+        saves already parsed auctions with a single repository write. if the same item appears
+        more than once, the last copy wins. returns the number of auctions saved.
+        """
+        latest : Dict[str, ClosedAuction] = dict()
+        for closed_auction in closed_auctions:
+            latest[closed_auction._item_id] = closed_auction
+
+        print(f"[ClosedAuctionMetricsService] saving batch of {len(latest)} ClosedAuction objects...")
+        self._auction_repo.save_auctions(list(latest.values()))
+        if self._prerenderer:
+            self._prerenderer.submit(list(latest.values()))
+        return len(latest)
+
+    @staticmethod
+    def parse_auction_data(data: Dict) -> ClosedAuction:
+        """
+        turns an auction.end message (see add_auction_data()) into a ClosedAuction. needs no
+        repository, so it can run in a worker process.
+        """
+        refined_data = ClosedAuctionMetricsService._cast_str_times_to_datetimes(data) # creates a new dict
+        return ClosedAuctionMetricsService._create_closed_auction_from_data(refined_data)
+
+    def get_auction_data(self, item_id: Optional[str], start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, limit: int=None, include_bids: bool=True, fields: Optional[List[str]]=None) -> Dict:
+        """
+        include_bids=False (or a fields list without "bids") returns summaries; the bid
+        history is then never loaded from the repository. fields restricts each auction
+        to the given top-level fields (see AUCTION_FIELDS).
+        """
         print("[ClosedAuctionMetricsService] getting auction data...")
 
+        include_bids = _needs_bids(include_bids, fields)
         if item_id:
-            auction = self._auction_repo.get_auction(item_id)
+            auction = self._auction_repo.get_auction(item_id, include_bids=include_bids)
             if auction:
-                return {auction._item_id : auction.convert_to_dict()}
+                return {auction._item_id : _select_fields(auction.convert_to_dict(), fields)}
             else :
                 return dict()
         else:
-            auctions = self._auction_repo.get_auctions(leftBound = start, rightBound = end, limit = limit) # returns auctions that were over between these times
-            return {auction._item_id : auction.convert_to_dict() for auction in auctions}
+            auctions = self._auction_repo.get_auctions(leftBound = start, rightBound = end, limit = limit, include_bids = include_bids) # returns auctions that were over between these times
+            return {auction._item_id : _select_fields(auction.convert_to_dict(), fields) for auction in auctions}
+
+    def get_auction_page(self, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, limit: int=None, cursor: Optional[str]=None, include_bids: bool=True, fields: Optional[List[str]]=None) -> Tuple[Dict, Optional[str]]:
+        """
+        returns one page of closed auctions (keyed by item_id, ascending by end time) that
+        ended between start and end (up to limit, DEFAULT_AUCTIONS_LIMIT if not given), plus an
+        opaque cursor for the page that ended before it (None once the window is exhausted).
+        raises ValueError if cursor is malformed.
+        include_bids/fields select summaries as in get_auction_data().
+        """
+        print("[ClosedAuctionMetricsService] getting page of auction data...")
+
+        before = utils.decodePageCursor(cursor) if cursor else None
+        limit = _page_limit(limit)
+        auctions = self._auction_repo.get_auctions(leftBound = start, rightBound = end, limit = limit, before = before, include_bids = _needs_bids(include_bids, fields))
+        page = {auction._item_id : _select_fields(auction.convert_to_dict(), fields) for auction in auctions}
+        return page, _next_page_cursor(auctions, limit)
+
+    def get_bidder_auction_page(self, bidder_user_id: str, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, limit: int=None, cursor: Optional[str]=None, include_bids: bool=True, fields: Optional[List[str]]=None) -> Tuple[Dict, Optional[str]]:
+        """
+        like get_auction_page(), over the auctions the user bid on. every auction also says
+        whether the user won it ("won"), from the stored winner, so summaries can answer that
+        without their bids.
+        """
+        print(f"[ClosedAuctionMetricsService] getting page of auctions bid on by {bidder_user_id}...")
+
+        before = utils.decodePageCursor(cursor) if cursor else None
+        limit = _page_limit(limit)
+        auctions = self._auction_repo.get_auctions_by_bidder(bidder_user_id, leftBound = start, rightBound = end, limit = limit, before = before, include_bids = _needs_bids(include_bids, fields))
+        page = dict()
+        for auction in auctions:
+            metrics = auction.metrics()
+            page[auction._item_id] = _select_fields(auction.convert_to_dict(), fields)
+            page[auction._item_id]["won"] = metrics is not None and metrics._winner_user_id == bidder_user_id
+        return page, _next_page_cursor(auctions, limit)
+
+    def get_seller_auction_page(self, seller_user_id: str, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, limit: int=None, cursor: Optional[str]=None, include_bids: bool=True, fields: Optional[List[str]]=None) -> Tuple[Dict, Optional[str]]:
+        """
+        like get_auction_page(), over the auctions of the given seller.
+        """
+        print(f"[ClosedAuctionMetricsService] getting page of auctions sold by {seller_user_id}...")
+
+        before = utils.decodePageCursor(cursor) if cursor else None
+        limit = _page_limit(limit)
+        auctions = self._auction_repo.get_auctions_by_seller(seller_user_id, leftBound = start, rightBound = end, limit = limit, before = before, include_bids = _needs_bids(include_bids, fields))
+        page = {auction._item_id: _select_fields(auction.convert_to_dict(), fields) for auction in auctions}
+        return page, _next_page_cursor(auctions, limit)
+
+    def stream_auction_data(self, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, include_bids: bool=True, fields: Optional[List[str]]=None) -> Iterator[str]:
+        """
+        yields one json line (NDJSON) per closed auction that ended between start and end,
+        in ascending order by end time. only one auction is materialized at a time.
+        include_bids/fields select summaries as in get_auction_data().
+        """
+        print("[ClosedAuctionMetricsService] streaming auction data...")
+        for auction in self._auction_repo.iter_auctions(leftBound = start, rightBound = end, include_bids = _needs_bids(include_bids, fields)):
+            yield json.dumps(_select_fields(auction.convert_to_dict(), fields), separators=(",", ":")) + "\n"
+
+    def get_ranked_auction_data(self, metric: str, limit: int=None, include_bids: bool=True, fields: Optional[List[str]]=None) -> Dict:
+        """
+        the auctions with the highest value of a derived metric (see RANKING_METRICS), highest
+        first, keyed by item_id. served from the stored metrics; no bid history is walked.
+        """
+        print(f"[ClosedAuctionMetricsService] getting auctions ranked by {metric}...")
+        auctions = self._auction_repo.get_auctions_ranked_by(metric, limit = limit, include_bids = _needs_bids(include_bids, fields))
+        return {auction._item_id : _select_fields(auction.convert_to_dict(), fields) for auction in auctions}
+
+    def get_auction_aggregates(self, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, bucket: str="day", seller_user_id: Optional[str]=None) -> List[Dict]:
+        """
+        marketplace metrics of the auctions that ended in the time window, per bucket (see
+        AGGREGATE_BUCKETS): volume, sold and cancelled counts, gmv, average and median final
+        price, sell-through and cancellation rates, and bids per auction. the repository
+        reduces the window (see AuctionRepository.aggregate_auctions()); only the per-bucket
+        totals reach this service. with seller_user_id, only that seller's auctions count.
+        """
+        print(f"[ClosedAuctionMetricsService] aggregating auction data per {bucket}...")
+        aggregates = self._auction_repo.aggregate_auctions(leftBound = start, rightBound = end, bucket_us = AGGREGATE_BUCKETS[bucket], seller_user_id = seller_user_id)
+        return [_add_bucket_rates(aggregate) for aggregate in aggregates]
+
+    def get_auction_rollups(self, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, granularity: str="hour") -> List[Dict]:
+        """
+        the hourly or daily rollups (see ROLLUP_GRANULARITIES) overlapping the time window:
+        like get_auction_aggregates(), with min/max instead of median final price, but read
+        from totals maintained at ingest, so a read costs O(buckets) rather than O(auctions).
+        """
+        print(f"[ClosedAuctionMetricsService] getting {granularity} rollups...")
+        rollups = self._auction_repo.get_rollups(granularity, leftBound = start, rightBound = end)
+        return [_add_bucket_rates(rollup) for rollup in rollups]
+
+    def get_auction_distributions(self, start: Optional[datetime.datetime]=None, end: Optional[datetime.datetime]=None, ratio_bins: int=DEFAULT_RATIO_BINS, last_minute_us: int=DEFAULT_LAST_MINUTE_US) -> Dict:
+        """
+        distributions across the auctions that ended in the time window (see window_analytics()).
+        the window is loaded in columnar form, never as ClosedAuction objects.
+        """
+        print("[ClosedAuctionMetricsService] computing auction distributions...")
+        window = self._auction_repo.get_auction_window_columns(leftBound = start, rightBound = end)
+        return window_analytics(window, ratio_bins=ratio_bins, last_minute_us=last_minute_us)
 
     def get_auction_visualization_html(self,item_id: str) -> HTMLResponse:
+        # a cached chart is found by the stored content hash alone; the auction (and its bids)
+        # is only loaded to render a miss, or for documents stored without a hash
+        content_hash = self._auction_repo.get_auction_content_hash(item_id)
+        png = self._render_cache.get(item_id, content_hash) if content_hash else None
+        if png is None:
+            auction = self._auction_repo.get_auction(item_id)
+            if not auction:
+                return HTMLResponse(content= f"could not find closed auction for item_id={item_id}", status_code=200)
+            try:
+                png = self._render_cache.render(auction) if content_hash else self._render_cache.get_or_render(auction)
+            except Exception as e:
+                print(f"[ClosedAuctionMetricsService] failed to render bid history for item_id={item_id}: {e!r}")
+                msg = "encountered error generating graphics; " +\
+                "see ClosedAuction.generate_bid_history_as_html() in closed-auctions-service"
+                return HTMLResponse(content= msg, status_code=400)
+        return HTMLResponse(content= bid_history_png_as_html(png), status_code=200)
+
+    def get_auction_series(self, item_id: str, max_points: int=CHART_MAX_POINTS) -> Optional[Dict]:
+        """the bid history chart's data (see ClosedAuction.bid_history_series()), or None if there is no such auction."""
         auction = self._auction_repo.get_auction(item_id)
-        if auction:
-            html, withErrors = auction.generate_bid_history_as_html()
-            if withErrors:
-                return HTMLResponse(content= html, status_code=400)
-            else:
-                return HTMLResponse(content= html, status_code=200)
-        else:
-            return HTMLResponse(content= f"could not find closed auction for item_id={item_id}", status_code=200)
+        return auction.bid_history_series(max_points=max_points) if auction else None
+
+    def get_auction_data_etag(self, item_id: str, include_bids: bool=True, fields: Optional[List[str]]=None) -> Optional[str]:
+        """
+        the etag of get_auction_data(item_id, ...), from the auction's stored content hash; the
+        auction itself is not loaded. None if there is no such auction (or it has no stored hash).
+        """
+        fields_key = ",".join(fields) if fields is not None else "*"
+        return self._auction_etag(item_id, f"json:bids={_needs_bids(include_bids, fields)}:fields={fields_key}")
+
+    def get_auction_visualization_etag(self, item_id: str) -> Optional[str]:
+        """like get_auction_data_etag(), for get_auction_visualization_html()."""
+        return self._auction_etag(item_id, f"visualization:v{CHART_VERSION}:p{CHART_MAX_POINTS}")
 
-    def _cast_str_times_to_datetimes(self, rawdata: Dict) -> Dict:
+    def get_auction_series_etag(self, item_id: str, max_points: int=CHART_MAX_POINTS) -> Optional[str]:
+        """like get_auction_data_etag(), for get_auction_series()."""
+        return self._auction_etag(item_id, f"series:p{max_points}")
+
+    def _auction_etag(self, item_id: str, representation: str) -> Optional[str]:
+        content_hash = self._auction_repo.get_auction_content_hash(item_id)
+        if content_hash is None:
+            return None
+        # a finalized auction never changes, so its hash (with what was asked of it) is a strong validator
+        tag = hashlib.sha256(f"{content_hash}:{RESPONSE_VERSION}:{representation}".encode("utf-8")).hexdigest()
+        return f'"{tag[:32]}"'
+
+    def get_render_cache_stats(self) -> Dict:
+        return self._render_cache.stats()
+
+    @staticmethod
+    def _cast_str_times_to_datetimes(rawdata: Dict) -> Dict:
         # ex_data = {
         #     'Item': {
         #             'item_id': '20',
@@ -171,8 +369,9 @@ class ClosedAuctionMetricsService():
         data["Item"]["dt_start_time"] = utils.toDatetimeFromStr(data["Item"]["start_time"])
         data["Item"]["dt_end_time"] = utils.toDatetimeFromStr(data["Item"]["end_time"])
 
-        for bid in data["Bids"]:
-            bid["dt_time_received"] = utils.toDatetimeFromStr(bid["time_received"])
+        bid_times = utils.toDatetimesFromStrs([bid["time_received"] for bid in data["Bids"]])
+        for bid, dt_time_received in zip(data["Bids"], bid_times):
+            bid["dt_time_received"] = dt_time_received
 
         if data["Cancellation"]:
             data["Cancellation"]["dt_time_received"] = utils.toDatetimeFromStr(data["Cancellation"]["time_received"])
@@ -185,7 +384,8 @@ class ClosedAuctionMetricsService():
 
         return data
 
-    def _create_closed_auction_from_data(self,refined_data: Dict) -> ClosedAuction:
+    @staticmethod
+    def _create_closed_auction_from_data(refined_data: Dict) -> ClosedAuction:
         # ALL STRING TIME REPRS ARE NOW DATETIMES
 
         # ex_data2 = {
@@ -227,6 +427,7 @@ class ClosedAuctionMetricsService():
             bids.append(Bid(bid["bid_id"],bid["item_id"],bid["bidder_user_id"],bid["amount_in_cents"],bid["dt_time_received"],bid["active"]))
 
         item_id : str = refined_data["Item"]["item_id"]
+        seller_user_id : Optional[str] = refined_data["Item"].get("seller_user_id")
         start_price_in_cents : int = refined_data["Item"]["start_price_in_cents"]
         start_time : datetime.datetime = refined_data["Item"]["dt_start_time"]
         end_time  : datetime.datetime = refined_data["Item"]["dt_end_time"]
@@ -238,5 +439,35 @@ class ClosedAuctionMetricsService():
             bid_data = refined_data["WinningBid"]
             winning_bid = Bid(bid_data["bid_id"],bid_data["item_id"],bid_data["bidder_user_id"],bid_data["amount_in_cents"],bid_data["dt_time_received"],bid_data["active"])
 
-        new_closed_auction = ClosedAuction(item_id,start_price_in_cents,start_time,end_time,cancellation_time,finalized_time,bids,winning_bid)
+        new_closed_auction = ClosedAuction(item_id,start_price_in_cents,start_time,end_time,cancellation_time,finalized_time,bids,winning_bid,seller_user_id=seller_user_id)
         return new_closed_auction
+
+def _page_limit(limit: Optional[int]) -> int:
+    """the number of auctions a page holds; resolved here, once, so the repository and _next_page_cursor() agree on it."""
+    return limit or DEFAULT_AUCTIONS_LIMIT
+
+def _next_page_cursor(auctions: List[ClosedAuction], limit: int) -> Optional[str]:
+    """the cursor of the page before a page of (up to limit) auctions, ascending by end time, or None if it is the last."""
+    # a short page means there is nothing older left in the window
+    if len(auctions) < limit:
+        return None
+    oldest = auctions[0]
+    return utils.encodePageCursor(oldest.get_end_time(), oldest._item_id)
+
+def _add_bucket_rates(bucket: Dict) -> Dict:
+    """adds the bucket's start time and the rates/averages derived from its counts."""
+    num_auctions, num_sold = bucket["num_auctions"], bucket["num_sold"]
+    bucket["bucket_start"] = utils.toSQLTimestamp6Repr(utils.toDatetimeFromEpochMicros(bucket["bucket_start_us"]))
+    bucket["avg_final_price_in_cents"] = bucket["gmv_in_cents"]/num_sold if num_sold else None
+    bucket["sell_through_rate"] = num_sold/num_auctions
+    bucket["cancellation_rate"] = bucket["num_cancelled"]/num_auctions
+    bucket["avg_bids_per_auction"] = bucket["num_bids"]/num_auctions
+    return bucket
+
+def _needs_bids(include_bids: bool, fields: Optional[List[str]]) -> bool:
+    return include_bids and (fields is None or "bids" in fields)
+
+def _select_fields(auction_data: Dict, fields: Optional[List[str]]) -> Dict:
+    if fields is None:
+        return auction_data
+    return {field: auction_data[field] for field in fields if field in auction_data}
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+from domain.closed_auction import ClosedAuction, DEFAULT_CHART_MAX_POINTS
+from domain.render_store import RenderStore
+from infrastructure.lru import BytesLRUCache
+
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("CAM_RENDER_CACHE_MAX_BYTES", 64*1024*1024)) # in-process tier
+RENDER_WORKERS = int(os.environ.get("CAM_RENDER_WORKERS", 2)) # processes rendering charts on a cache miss
+CHART_VERSION = 2 # bump when the chart's look changes, so renders made by older code are not served
+CHART_MAX_POINTS = int(os.environ.get("CAM_CHART_MAX_POINTS", DEFAULT_CHART_MAX_POINTS)) # bids drawn per chart (lttb downsampling beyond)
+
+def render_bid_history_png(auction: ClosedAuction) -> bytes:
+    # module level, so it can run in a render worker process
+    return auction.render_bid_history_png(max_points=CHART_MAX_POINTS)
+
+class RenderCache:
+    """
+    two-tier cache of bid history charts (png bytes). a finalized auction never changes, so a
+    chart is keyed by the auction's item_id and content hash (plus CHART_VERSION and the point
+    budget) and never
+    needs invalidating. lookups try a byte-bounded in-process lru first, then the persistent
+    store (which survives restarts), and only render on a miss in both.
+
+    with render_workers > 0, renders on a miss run in a pool of that many processes, so a slow
+    chart holds up only the request waiting for it, not the gil of the api process. the pool
+    is started on the first miss, in whichever process serves it, and replaced if a worker dies.
+    """
+
+    def __init__(self, store: Optional[RenderStore]=None, max_bytes: int=RENDER_CACHE_MAX_BYTES, render_workers: int=0) -> None:
+        self._memory : BytesLRUCache[str] = BytesLRUCache(max_bytes)
+        self._store = store
+        self._render_workers = render_workers
+        self._render_pool : Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._store_hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def render_key(item_id: str, content_hash: str) -> str:
+        return f"{item_id}:{content_hash}:v{CHART_VERSION}:p{CHART_MAX_POINTS}"
+
+    def get(self, item_id: str, content_hash: str) -> Optional[bytes]:
+        key = self.render_key(item_id, content_hash)
+        png = self._memory.get(key)
+        if png is not None:
+            self._count("_memory_hits")
+            return png
+        if self._store:
+            png = self._store.get_render(key)
+            if png is not None:
+                self._count("_store_hits")
+                self._memory.put(key, png)
+                return png
+        self._count("_misses")
+        return None
+
+    def put(self, item_id: str, content_hash: str, png: bytes):
+        key = self.render_key(item_id, content_hash)
+        self._memory.put(key, png)
+        if self._store:
+            self._store.save_render(key, item_id, png)
+
+    def get_or_render(self, auction: ClosedAuction) -> bytes:
+        """returns the auction's chart, rendering (and caching) it on a miss. render errors propagate."""
+        png = self.get(auction._item_id, auction.content_hash())
+        return png if png is not None else self.render(auction)
+
+    def render(self, auction: ClosedAuction) -> bytes:
+        """renders the auction's chart and caches it, without looking it up first. render errors propagate."""
+        if self._render_workers > 0:
+            pool = self._get_render_pool()
+            try:
+                png = pool.submit(render_bid_history_png, auction).result()
+            except BrokenProcessPool:
+                # a worker died (e.g. killed for memory), which breaks the pool for good; start another and retry once
+                self._discard_render_pool(pool)
+                png = self._get_render_pool().submit(render_bid_history_png, auction).result()
+        else:
+            png = render_bid_history_png(auction)
+        self.put(auction._item_id, auction.content_hash(), png)
+        return png
+
+    def _get_render_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._render_pool is None:
+                # the api serves requests from threads; forkserver starts workers without forking them
+                self._render_pool = ProcessPoolExecutor(max_workers=self._render_workers, mp_context=multiprocessing.get_context("forkserver"))
+            return self._render_pool
+
+    def _discard_render_pool(self, broken: ProcessPoolExecutor):
+        """drops a broken pool, so the next miss starts a new one (unless another request already has)."""
+        with self._lock:
+            if self._render_pool is broken:
+                print("[RenderCache] a render worker died; starting a new pool")
+                broken.shutdown(wait=False)
+                self._render_pool = None
+
+    def shutdown(self, wait: bool=False):
+        with self._lock:
+            if self._render_pool is not None:
+                self._render_pool.shutdown(wait=wait)
+                self._render_pool = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = {"memory_hits": self._memory_hits, "store_hits": self._store_hits, "misses": self._misses}
+        memory = self._memory.stats()
+        return {**counters, "memory": {key: memory[key] for key in ("entries", "bytes", "max_bytes", "evictions")}}
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
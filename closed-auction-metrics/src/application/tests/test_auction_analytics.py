@@ -0,0 +1,50 @@
+import pytest
+import datetime
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.bid_columns import BidColumns
+from domain.closed_auction import ClosedAuction
+from domain.auction_window import AuctionWindowColumns
+from application.auction_analytics import window_analytics
+
+class TestWindowAnalytics:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        def bid(i, item_id, bidder, amount, seconds):
+            return Bid(str(i), str(item_id), bidder, amount, cls.start + datetime.timedelta(seconds=seconds), True)
+        duration = datetime.timedelta(minutes=10) # auctions end 600s after they start
+        cls.auctions = [
+            # bids out of time order; the last one 30s before the end
+            ClosedAuction.generate_auction([bid(1, 1, "a", 3500, 20), bid(2, 1, "b", 3600, 10), bid(3, 1, "a", 6800, 570)], 1, cls.start, duration, None),
+            ClosedAuction.generate_auction(BidColumns.from_bids([bid(4, 2, "b", 5100, 100)]), 2, cls.start, duration, None),
+            ClosedAuction.generate_auction([], 3, cls.start, duration, None), # unsold
+        ]
+
+    def test_window_columns(cls):
+        window = AuctionWindowColumns.from_auctions(cls.auctions)
+        assert len(window) == 3 and window.num_bids() == 4
+        assert window.bid_auction_indices().tolist() == [0, 0, 0, 1]
+        # the same window, from stored documents
+        from_documents = AuctionWindowColumns.from_epoch_micros_documents(auction.convert_to_dict_w_epoch_micros() for auction in cls.auctions)
+        for slot in AuctionWindowColumns.__slots__:
+            assert str(getattr(from_documents, slot)) == str(getattr(window, slot))
+
+    def test_distributions(cls):
+        analytics = window_analytics(AuctionWindowColumns.from_auctions(cls.auctions), ratio_bins=2)
+        assert analytics['num_auctions'] == 3 and analytics['num_bids'] == 4
+        ratios = analytics['final_to_start_price_ratio']
+        assert ratios['count'] == 2 and ratios['max'] == 2.0 # 6800/3400
+        assert ratios['histogram']['counts'] == [1, 1]
+        assert analytics['time_to_first_bid_us']['count'] == 2 and analytics['time_to_first_bid_us']['max'] == 100_000_000
+        assert analytics['time_to_first_bid_us']['p50'] == 55_000_000 # 10s and 100s
+        assert analytics['bid_interarrival_us']['count'] == 2 and analytics['bid_interarrival_us']['max'] == 550_000_000 # 10s->20s->570s
+        assert analytics['last_minute_bid_share'] == 0.25
+        assert analytics['bids_per_bidder']['max'] == 2 and analytics['bids_per_bidder']['count'] == 2
+
+    def test_empty_window(cls):
+        analytics = window_analytics(AuctionWindowColumns.from_auctions([]))
+        assert analytics['num_bids'] == 0 and analytics['last_minute_bid_share'] is None
+        assert analytics['time_to_first_bid_us']['count'] == 0 and analytics['final_to_start_price_ratio']['histogram']['counts'] == []
@@ -0,0 +1,57 @@
+import pytest
+import json
+from typing import List
+
+from domain.closed_auction import ClosedAuction
+from domain.auction_repository import InMemoryAuctionRepository, AuctionWriteError, TransientWriteError
+from application.closed_auction_metrics_service import ClosedAuctionMetricsService
+from application.auction_consumer import store_auction_messages
+
+def auction_message(item_id: str) -> bytes:
+    return json.dumps({
+        "Item": {"item_id": item_id, "seller_user_id": "asclark109", "start_time": "2022-11-23 02:00:18.060466", "end_time": "2022-11-23 02:10:18.060466", "start_price_in_cents": 2000},
+        "Bids": [{"bid_id": "1", "item_id": item_id, "bidder_user_id": "katharine2", "time_received": "2022-11-23 02:05:00.000000", "amount_in_cents": 2500, "active": True}],
+        "Cancellation": None,
+        "Finalization": {"time_received": "2022-11-23 02:10:28.061013"},
+        "WinningBid": None,
+    }).encode("utf-8")
+
+class FailingAuctionRepository(InMemoryAuctionRepository):
+    """stores every auction but those in reject (like an unordered bulk write), then raises error, if given."""
+
+    def __init__(self, error: Exception=None, reject: List[str]=()) -> None:
+        super().__init__()
+        self._error = error
+        self._reject = reject
+
+    def save_auctions(self, auctions: List[ClosedAuction]):
+        super().save_auctions([auction for auction in auctions if auction._item_id not in self._reject])
+        if self._error:
+            raise self._error
+
+class TestStoreAuctionMessages:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.batch = [(1, auction_message("20")), (2, auction_message("21")), (3, b"not json"), (4, auction_message("22"))]
+
+    def test_stored(cls):
+        repo = FailingAuctionRepository()
+        outcome = store_auction_messages(ClosedAuctionMetricsService(repo), cls.batch)
+        assert (outcome.acked, outcome.requeued, outcome.dead_lettered) == ([1, 2, 4], [], [3])
+        assert repo.get_auction("21") is not None
+
+    def test_transient_error_requeues(cls):
+        outcome = store_auction_messages(ClosedAuctionMetricsService(FailingAuctionRepository(TransientWriteError("not primary"))), cls.batch)
+        assert (outcome.acked, outcome.requeued, outcome.dead_lettered) == ([], [1, 2, 4], [3])
+
+    def test_rejected_auctions_are_dead_lettered(cls):
+        # e.g. a duplicate key on one document; the others were written and are acked, not redelivered
+        repo = FailingAuctionRepository(AuctionWriteError(["21"], "E11000 duplicate key error"), reject=["21"])
+        outcome = store_auction_messages(ClosedAuctionMetricsService(repo), cls.batch)
+        assert (outcome.acked, outcome.requeued, outcome.dead_lettered) == ([1, 4], [], [2, 3])
+        assert repo.get_auction("20") is not None and repo.get_auction("21") is None
+
+    def test_unknown_error_is_not_retried(cls):
+        outcome = store_auction_messages(ClosedAuctionMetricsService(FailingAuctionRepository(RuntimeError("bug"))), cls.batch)
+        assert (outcome.acked, outcome.requeued, outcome.dead_lettered) == ([], [], [1, 2, 4, 3])
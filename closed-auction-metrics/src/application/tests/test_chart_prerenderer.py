@@ -0,0 +1,54 @@
+import pytest
+import datetime
+import time
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from application.render_cache import RenderCache
+from application.chart_prerenderer import ChartPrerenderer
+
+def wait_for(condition, timeout_s: float=30) -> bool:
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+class TestChartPrerenderer:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+
+    def auction(cls, item_id: int) -> ClosedAuction:
+        return ClosedAuction.generate_auction([Bid.generate_basic_bid(i,item_id) for i in range(3)],item_id,cls.start,datetime.timedelta(minutes=5),None)
+
+    def rendered(cls, render_cache: RenderCache, auction: ClosedAuction) -> bool:
+        return render_cache.get(auction._item_id, auction.content_hash()) is not None
+
+    def test_dead_worker_does_not_reach_the_caller(cls):
+        render_cache = RenderCache()
+        prerenderer = ChartPrerenderer(render_cache, max_workers=1, max_pending=1)
+        try:
+            first = cls.auction(1)
+            prerenderer.submit([first])
+            assert wait_for(lambda: cls.rendered(render_cache, first))
+
+            # e.g. the oom killer, or a crash inside Agg; the executor is broken for good
+            broken = prerenderer._pool
+            for process in list(broken._processes.values()):
+                process.kill()
+            assert wait_for(lambda: broken._broken)
+
+            prerenderer.submit([cls.auction(2)]) # must not raise into save_closed_auctions()
+            assert prerenderer.failed == 1
+            assert prerenderer._pool is not broken
+
+            third = cls.auction(3)
+            prerenderer.submit([third]) # the slot was given back, and the new pool renders
+            assert wait_for(lambda: cls.rendered(render_cache, third))
+            assert prerenderer.skipped == 0
+        finally:
+            prerenderer.shutdown(wait=True)
@@ -0,0 +1,74 @@
+from typing import List
+import pytest
+import datetime
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from domain.auction_repository import InMemoryAuctionRepository, DEFAULT_AUCTIONS_LIMIT
+from application.closed_auction_metrics_service import ClosedAuctionMetricsService
+from application.render_cache import RenderCache
+
+class TestAuctionPages:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        cls.end = cls.start + datetime.timedelta(days=1)
+        repo = InMemoryAuctionRepository()
+        # a little over two default pages, all bid on by the same bidder
+        for i in range(2*DEFAULT_AUCTIONS_LIMIT + 3):
+            repo.save_auction(ClosedAuction.generate_auction([Bid.generate_basic_bid(i,1000+i)],1000+i,cls.start,datetime.timedelta(minutes=i),None))
+        cls.service = ClosedAuctionMetricsService(repo)
+
+    def pages(cls, get_page, **kwargs) -> List[List[str]]:
+        """follows the cursors of get_page from the most recent page until it returns none."""
+        pages, cursor = [], None
+        while True:
+            page, cursor = get_page(start=cls.start, end=cls.end, cursor=cursor, **kwargs)
+            pages.append(list(page))
+            if cursor is None:
+                return pages
+
+    def test_no_limit_pages_by_the_default_limit(cls):
+        pages = cls.pages(cls.service.get_auction_page)
+        assert [len(page) for page in pages] == [DEFAULT_AUCTIONS_LIMIT, DEFAULT_AUCTIONS_LIMIT, 3]
+
+    def test_short_page_has_no_cursor(cls):
+        pages = cls.pages(cls.service.get_bidder_auction_page, bidder_user_id="asclark", limit=5)
+        assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+        assert len({item_id for page in pages for item_id in page}) == 2*DEFAULT_AUCTIONS_LIMIT + 3
+
+class CountingAuctionRepository(InMemoryAuctionRepository):
+    """counts the full auction loads (get_auction)."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.loads = 0
+
+    def get_auction(self, item_id: str, include_bids: bool=True) -> ClosedAuction:
+        self.loads += 1
+        return super().get_auction(item_id, include_bids)
+
+class TestAuctionVisualization:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+
+    def test_cached_chart_does_not_load_the_auction(cls):
+        repo = CountingAuctionRepository()
+        repo.save_auction(ClosedAuction.generate_auction([Bid.generate_basic_bid(i,7) for i in range(3)],7,cls.start,datetime.timedelta(minutes=5),None))
+        render_cache = RenderCache()
+        service = ClosedAuctionMetricsService(repo, render_cache)
+
+        first = service.get_auction_visualization_html("7")
+        assert repo.loads == 1 # rendered on a miss
+        second = service.get_auction_visualization_html("7")
+        assert repo.loads == 1
+        assert first.body == second.body
+        assert render_cache.stats()["misses"] == 1
+
+    def test_unknown_auction(cls):
+        response = ClosedAuctionMetricsService(CountingAuctionRepository()).get_auction_visualization_html("404")
+        assert b"could not find closed auction" in response.body
@@ -0,0 +1,38 @@
+import pytest
+import datetime
+import time
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from application.render_cache import RenderCache
+
+class TestRenderCache:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+
+    def auction(cls, item_id: int) -> ClosedAuction:
+        return ClosedAuction.generate_auction([Bid.generate_basic_bid(i,item_id) for i in range(3)],item_id,cls.start,datetime.timedelta(minutes=5),None)
+
+    def test_render_survives_a_dead_worker(cls):
+        render_cache = RenderCache(render_workers=1)
+        try:
+            assert render_cache.render(cls.auction(1)).startswith(b"\x89PNG")
+
+            # e.g. the oom killer, or a crash inside Agg; the executor is broken for good
+            broken = render_cache._render_pool
+            for process in list(broken._processes.values()):
+                process.kill()
+            deadline = time.monotonic() + 30
+            while not broken._broken and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert broken._broken
+
+            second = cls.auction(2)
+            assert render_cache.get_or_render(second).startswith(b"\x89PNG")
+            assert render_cache._render_pool is not broken
+            assert render_cache.get(second._item_id, second.content_hash()) is not None
+        finally:
+            render_cache.shutdown(wait=True)
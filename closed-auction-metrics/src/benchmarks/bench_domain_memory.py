@@ -0,0 +1,118 @@
+"""Micro-benchmark: memory and construction cost of the domain objects vs. plain (__dict__) classes.
+
+Builds synthetic auctions with a realistic spread of bid counts (most auctions get a handful of
+bids, a few get hundreds) and reports, for Bid and ClosedAuction with __slots__ (and with the bids
+in columnar form, see BidColumns) against plain-class equivalents of the original layout:
+bytes per bid, bytes per auction (including its bids) and construction throughput.
+
+The point of __slots__ here is memory. Construction throughput of the plain and slotted classes is
+within run-to-run noise (either can come out ahead by 10-30% between runs), so don't read a speed-up
+into that column.
+
+Run from closed-auction-metrics/src:
+
+    python3 -m benchmarks.bench_domain_memory
+"""
+
+import datetime
+import gc
+import random
+import timeit
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from infrastructure import utils
+from domain.bid import Bid
+from domain.bid_columns import BidColumns
+from domain.closed_auction import ClosedAuction
+
+N_AUCTIONS = 2_000
+REPEATS = 3
+
+class LegacyBid():
+    """Bid as it was: a plain class with a per-instance __dict__"""
+
+    def __init__(self, bid_id, item_id, bidder_user_id, amount_in_cents, time_received, active) -> None:
+        self._bid_id = bid_id
+        self._item_id = item_id
+        self._bidder_user_id = bidder_user_id
+        self._amount_in_cents = amount_in_cents
+        self._time_received = time_received
+        self._active = active
+
+class LegacyClosedAuction(object):
+    """ClosedAuction as it was: a plain class with a per-instance __dict__"""
+
+    def __init__(self, item_id, start_price_in_cents, start_time, end_time, cancellation_time, finalized_time, bids, winning_bid) -> None:
+        self._item_id = item_id
+        self._start_price_in_cents = start_price_in_cents
+        self._start_time = start_time
+        self._end_time = end_time
+        self._cancellation_time = cancellation_time
+        self._finalized_time = finalized_time
+        self._bids = bids
+        self._winning_bid = winning_bid
+
+BidRow = Tuple[str, str, str, int, int, bool] # like a stored bid document: times as epoch microseconds
+AuctionRow = Tuple[str, int, int, int, int, List[BidRow]]
+
+def generate_rows(n: int) -> List[AuctionRow]:
+    rng = random.Random(51205)
+    start = utils.toEpochMicros(utils.TIME_ZONE.localize(datetime.datetime(year=2022, month=11, day=23)))
+    rows = []
+    for i in range(n):
+        item_id = str(i)
+        n_bids = min(int(rng.lognormvariate(2.0, 1.2)), 2_000)
+        start_us = start + rng.randrange(10**12)
+        bids = [(str(i*10_000 + j), item_id, f"user{rng.randrange(500)}", 3400 + 25*j, start_us + 1_000_000*j, rng.random() > 0.1) for j in range(n_bids)]
+        rows.append((item_id, 3400, start_us, start_us + 3_600_000_000, start_us + 3_660_000_000, bids))
+    return rows
+
+def build_legacy(rows: List[AuctionRow]) -> list:
+    from_us = utils.toDatetimeFromEpochMicros
+    return [LegacyClosedAuction(item_id, price, from_us(start_us), from_us(end_us), None, from_us(final_us),
+                                [LegacyBid(b[0], b[1], b[2], b[3], from_us(b[4]), b[5]) for b in bids], None)
+            for item_id, price, start_us, end_us, final_us, bids in rows]
+
+def build_slotted(rows: List[AuctionRow]) -> list:
+    from_us = utils.toDatetimeFromEpochMicros
+    return [ClosedAuction(item_id, price, from_us(start_us), from_us(end_us), None, from_us(final_us),
+                          [Bid(b[0], b[1], b[2], b[3], from_us(b[4]), b[5]) for b in bids], None)
+            for item_id, price, start_us, end_us, final_us, bids in rows]
+
+def build_columnar(rows: List[AuctionRow]) -> list:
+    # from bid dicts, the way MongoDbAuctionRepository decodes stored bids
+    from_us = utils.toDatetimeFromEpochMicros
+    keys = ("bid_id", "item_id", "bidder_user_id", "amount_in_cents", "time_received_us", "active")
+    return [ClosedAuction(item_id, price, from_us(start_us), from_us(end_us), None, from_us(final_us),
+                          BidColumns.from_epoch_micros_dicts([dict(zip(keys, b)) for b in bids]), None)
+            for item_id, price, start_us, end_us, final_us, bids in rows]
+
+def measure(build: Callable[[List[AuctionRow]], list], rows: List[AuctionRow]) -> Tuple[int, float]:
+    """(bytes allocated and still held by the built auctions, best build time in seconds)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    auctions = build(rows)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del auctions
+
+    gc.collect()
+    return held, min(timeit.repeat(lambda: build(rows), number=1, repeat=REPEATS))
+
+def main():
+    rows = generate_rows(N_AUCTIONS)
+    n_bids = sum(len(row[5]) for row in rows)
+    print(f"{N_AUCTIONS} auctions, {n_bids} bids (mean {n_bids/N_AUCTIONS:.1f}, max {max(len(row[5]) for row in rows)} per auction)")
+    print(f"{'layout':<28} {'bytes/auction':>14} {'bytes/bid':>10} {'auctions/s':>11} {'bids/s':>11}")
+
+    # bytes per bid: the difference to the same auctions built without their bids
+    bid_rows = [row[:5] + ([],) for row in rows]
+    for label, build in (("plain classes (before)", build_legacy), ("__slots__", build_slotted), ("__slots__ + BidColumns", build_columnar)):
+        held, seconds = measure(build, rows)
+        held_without_bids, _ = measure(build, bid_rows)
+        print(f"{label:<28} {held/N_AUCTIONS:>14.0f} {(held - held_without_bids)/n_bids:>10.1f} {N_AUCTIONS/seconds:>11.0f} {n_bids/seconds:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Soak benchmark: resident memory while rendering bid history charts over and over.
+
+Renders the same auction N times in this process and prints the RSS every N/10 renders. With the
+Figure/Agg renderer (ClosedAuction.render_bid_history_png) the RSS should level off after the
+first few renders; --legacy renders the way the service used to (pyplot.subplots(), never closed),
+which grows with every render. Over the default 10,000 renders (about half an hour) the Figure/Agg
+RSS stays within a few MB of where it is after the first thousand; the legacy path is best run with
+far fewer renders, since it grows by about 1.5MB each.
+
+Run from closed-auction-metrics/src:
+
+    python3 -m benchmarks.bench_render_soak
+    python3 -m benchmarks.bench_render_soak --renders 2000 --legacy
+"""
+
+import argparse
+import datetime
+import os
+import resource
+import time
+from io import BytesIO
+
+from infrastructure import utils
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+
+N_RENDERS = 10_000
+N_BIDS = 50
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError: # not linux; fall back to the peak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+def generate_auction() -> ClosedAuction:
+    start = utils.TIME_ZONE.localize(datetime.datetime(year=2022, month=11, day=23))
+    bids = [Bid(str(i), "1", f"user{i%7}", 3400 + 25*i, start + datetime.timedelta(seconds=30*i), True) for i in range(N_BIDS)]
+    return ClosedAuction.generate_auction(bids, 1, start, datetime.timedelta(minutes=30), None)
+
+def legacy_render_png(auction: ClosedAuction) -> bytes:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    times = [bid._time_received for bid in auction._bids]
+    amounts = [bid._amount_in_cents/100 for bid in auction._bids]
+    fig, ax = plt.subplots() # registered with pyplot, and never closed
+    ax.step(times, amounts, where='post', label='post')
+    ax.plot(times, amounts, 'o--', color='grey', alpha=0.3)
+    tmpfile = BytesIO()
+    fig.savefig(tmpfile, format='png', bbox_inches="tight")
+    return tmpfile.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="rss while rendering bid history charts")
+    parser.add_argument("--renders", type=int, default=N_RENDERS)
+    parser.add_argument("--legacy", action="store_true", help="render with pyplot, the way the service used to")
+    args = parser.parse_args()
+
+    auction = generate_auction()
+    render = (lambda: legacy_render_png(auction)) if args.legacy else auction.render_bid_history_png
+    report_every = max(args.renders // 10, 1)
+
+    render() # warm up (font cache, backend import)
+    baseline = current_rss_mb()
+    print(f"{'legacy pyplot' if args.legacy else 'Figure/Agg'} renderer, {args.renders} renders of a {N_BIDS}-bid auction")
+    print(f"{'renders':>8} {'rss MB':>8} {'growth MB':>10} {'ms/render':>10}")
+    started = time.perf_counter()
+    for i in range(1, args.renders + 1):
+        render()
+        if i % report_every == 0:
+            rss = current_rss_mb()
+            print(f"{i:>8} {rss:>8.1f} {rss - baseline:>10.1f} {(time.perf_counter() - started)/i*1000:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Micro-benchmark: infrastructure.utils timestamp codec vs. the strptime/strftime + pytz originals.
+
+Run from closed-auction-metrics/src:
+
+    python3 -m benchmarks.bench_timestamps
+"""
+
+import datetime
+import random
+import timeit
+from typing import List
+
+from infrastructure import utils
+
+N_TIMESTAMPS = 10_000 # roughly the bids of a heavily contested auction
+REPEATS = 5
+
+def legacy_toSQLTimestamp6Repr(aDatetime: datetime.datetime) -> str:
+    return aDatetime.strftime(utils.TIME_PARSE_FORMAT)
+
+def legacy_toDatetimeFromStr(aStrDatetime: str) -> datetime.datetime:
+    return utils.TIME_ZONE.localize(datetime.datetime.strptime(aStrDatetime,utils.TIME_PARSE_FORMAT))
+
+def generate_datetimes(n: int) -> List[datetime.datetime]:
+    rng = random.Random(51205)
+    start = utils.TIME_ZONE.localize(datetime.datetime(year=2022, month=11, day=23))
+    return [start + datetime.timedelta(microseconds=rng.randrange(10**12)) for _ in range(n)]
+
+def best_of(func) -> float:
+    return min(timeit.repeat(func, number=1, repeat=REPEATS))
+
+def report(label: str, legacy: float, new: float):
+    per_legacy, per_new = legacy/N_TIMESTAMPS*1e9, new/N_TIMESTAMPS*1e9
+    print(f"{label:<42} legacy {per_legacy:8.0f} ns   new {per_new:8.0f} ns   speedup x{legacy/new:5.1f}")
+
+def main():
+    datetimes = generate_datetimes(N_TIMESTAMPS)
+    strs = [legacy_toSQLTimestamp6Repr(dt) for dt in datetimes]
+    epoch_micros = utils.toEpochMicrosList(datetimes)
+
+    # the new codec must be a drop-in replacement
+    assert [utils.toSQLTimestamp6Repr(dt) for dt in datetimes] == strs
+    assert utils.toSQLTimestamp6Reprs(datetimes) == strs
+    assert utils.toDatetimesFromStrs(strs) == [legacy_toDatetimeFromStr(s) for s in strs] == datetimes
+    assert utils.toDatetimesFromEpochMicros(epoch_micros) == datetimes
+
+    print(f"{N_TIMESTAMPS} timestamps, best of {REPEATS} (per timestamp)")
+    legacy_parse = best_of(lambda: [legacy_toDatetimeFromStr(s) for s in strs])
+    report("parse (toDatetimeFromStr)", legacy_parse, best_of(lambda: [utils.toDatetimeFromStr(s) for s in strs]))
+    report("parse batch (toDatetimesFromStrs)", legacy_parse, best_of(lambda: utils.toDatetimesFromStrs(strs)))
+    report("decode batch (toDatetimesFromEpochMicros)", legacy_parse, best_of(lambda: utils.toDatetimesFromEpochMicros(epoch_micros)))
+    legacy_format = best_of(lambda: [legacy_toSQLTimestamp6Repr(dt) for dt in datetimes])
+    report("format (toSQLTimestamp6Repr)", legacy_format, best_of(lambda: [utils.toSQLTimestamp6Repr(dt) for dt in datetimes]))
+    report("format batch (toSQLTimestamp6Reprs)", legacy_format, best_of(lambda: utils.toSQLTimestamp6Reprs(datetimes)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark: cross-auction analytics over a window, vectorized vs. a python loop over ClosedAuctions.
+
+Generates stored auction documents (the layout MongoDbAuctionRepository writes) and computes the
+same distributions (see application/auction_analytics.py) two ways:
+
+- naive: decode every document into a ClosedAuction with Bid objects, then loop over the auctions
+  and their bids (winner, sorted bid times, per-bid checks, a Counter of bidders).
+- vectorized: load the projected fields into AuctionWindowColumns, then window_analytics().
+
+Both load and compute times are reported, and the results are checked against each other.
+
+Run from closed-auction-metrics/src:
+
+    python3 -m benchmarks.bench_window_analytics
+    python3 -m benchmarks.bench_window_analytics --auctions 10000
+"""
+
+import argparse
+import datetime
+import random
+import time
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from infrastructure import utils
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from domain.auction_window import AuctionWindowColumns
+from application.auction_analytics import window_analytics, DEFAULT_LAST_MINUTE_US, _distribution
+
+N_AUCTIONS = 100_000
+DURATION_US = 3_600_000_000
+
+def generate_documents(n: int) -> List[Dict]:
+    rng = random.Random(51205)
+    start = utils.toEpochMicros(utils.TIME_ZONE.localize(datetime.datetime(year=2022, month=11, day=23)))
+    documents = []
+    for i in range(n):
+        item_id = str(i)
+        start_us = start + rng.randrange(10**12)
+        n_bids = min(int(rng.lognormvariate(1.5, 1.0)), 1_000)
+        # bids bunch up towards the end of the auction
+        times_us = sorted(start_us + int(DURATION_US * (1 - rng.random()**3)) for _ in range(n_bids))
+        bids = [Bid(str(i*10_000 + j), item_id, f"user{rng.randrange(20_000)}", 3400 + 25*j, utils.toDatetimeFromEpochMicros(t), rng.random() > 0.1)
+                for j, t in enumerate(times_us)]
+        auction = ClosedAuction.generate_auction(bids, i, utils.toDatetimeFromEpochMicros(start_us), datetime.timedelta(microseconds=DURATION_US), None)
+        documents.append(auction.convert_to_dict_w_epoch_micros())
+    return documents
+
+def load_naive(documents: List[Dict]) -> List[ClosedAuction]:
+    """ClosedAuctions with Bid objects, the way auctions were decoded before the columnar layouts."""
+    from_us = utils.toDatetimeFromEpochMicros
+    return [ClosedAuction(d["item_id"], d["start_price_in_cents"], from_us(d["start_time_us"]), from_us(d["end_time_us"]), None, from_us(d["finalized_time_us"]),
+                          [Bid(b["bid_id"], b["item_id"], b["bidder_user_id"], b["amount_in_cents"], from_us(b["time_received_us"]), b["active"]) for b in d["bids"]], None)
+            for d in documents]
+
+def naive_analytics(auctions: List[ClosedAuction], last_minute_us: int=DEFAULT_LAST_MINUTE_US) -> Dict:
+    ratios : List[float] = []
+    time_to_first_bid : List[int] = []
+    interarrival : List[int] = []
+    bids_per_bidder : Counter = Counter()
+    num_bids = last_minute = 0
+    for auction in auctions:
+        winning_bid = auction.winning_bid()
+        if winning_bid is not None and auction._start_price_in_cents:
+            ratios.append(winning_bid._amount_in_cents / auction._start_price_in_cents)
+        end_us = utils.toEpochMicros(auction.get_end_time())
+        times = sorted(utils.toEpochMicros(bid._time_received) for bid in auction._bids)
+        if times:
+            time_to_first_bid.append(times[0] - utils.toEpochMicros(auction._start_time))
+            interarrival.extend(b - a for a, b in zip(times, times[1:]))
+        for bid in auction._bids:
+            num_bids += 1
+            bids_per_bidder[bid._bidder_user_id] += 1
+            if utils.toEpochMicros(bid._time_received) >= end_us - last_minute_us:
+                last_minute += 1
+    return {
+        'num_auctions': len(auctions),
+        'num_bids': num_bids,
+        'final_to_start_price_ratio': _distribution(np.array(ratios)),
+        'time_to_first_bid_us': _distribution(np.array(time_to_first_bid)),
+        'bid_interarrival_us': _distribution(np.array(interarrival)),
+        'last_minute_bid_share': last_minute / num_bids if num_bids else None,
+        'bids_per_bidder': _distribution(np.array(list(bids_per_bidder.values()))),
+    }
+
+def timed(f, *args):
+    t0 = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - t0
+
+def check_same(naive: Dict, vectorized: Dict):
+    for key, value in naive.items():
+        other = vectorized[key]
+        if isinstance(value, dict):
+            for stat, x in value.items():
+                assert x == other[stat] or np.isclose(x, other[stat]), (key, stat, x, other[stat])
+        else:
+            assert value == other or np.isclose(value, other), (key, value, other)
+
+def main():
+    parser = argparse.ArgumentParser(description="cross-auction analytics: vectorized vs per-object loop")
+    parser.add_argument("--auctions", type=int, default=N_AUCTIONS)
+    args = parser.parse_args()
+
+    print(f"generating {args.auctions} auction documents...")
+    documents = generate_documents(args.auctions)
+    print(f"{args.auctions} auctions, {sum(len(d['bids']) for d in documents)} bids")
+
+    auctions, naive_load = timed(load_naive, documents)
+    naive, naive_compute = timed(naive_analytics, auctions)
+    del auctions
+
+    window, vectorized_load = timed(AuctionWindowColumns.from_epoch_micros_documents, documents)
+    vectorized, vectorized_compute = timed(window_analytics, window)
+
+    check_same(naive, vectorized)
+    print(f"{'':<12} {'load [s]':>10} {'compute [s]':>12} {'total [s]':>10}")
+    print(f"{'naive':<12} {naive_load:>10.3f} {naive_compute:>12.3f} {naive_load + naive_compute:>10.3f}")
+    print(f"{'vectorized':<12} {vectorized_load:>10.3f} {vectorized_compute:>12.3f} {vectorized_load + vectorized_compute:>10.3f}")
+    print(f"compute speedup {naive_compute/vectorized_compute:.0f}x, end to end {(naive_load + naive_compute)/(vectorized_load + vectorized_compute):.1f}x; results match")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+from typing import Dict, Optional
+
+class AuctionMetrics():
+    """
+    values derived from a closed auction's bid history, computed once (see
+    ClosedAuction.metrics()) and persisted next to the auction, so summaries can report
+    them and queries can filter and sort on them without loading the bids.
+    """
+
+    # also the names of the (top-level) fields they are stored in
+    FIELDS = ("winner_user_id", "final_price_in_cents", "final_to_start_price_ratio", "num_bids", "num_unique_bidders",
+              "first_bid_latency_us", "bid_span_us", "cancelled")
+
+    __slots__ = ("_winner_user_id", "_final_price_in_cents", "_final_to_start_price_ratio", "_num_bids", "_num_unique_bidders",
+                 "_first_bid_latency_us", "_bid_span_us", "_cancelled")
+
+    def __init__(
+        self,
+        winner_user_id : Optional[str],
+        final_price_in_cents : Optional[int],
+        final_to_start_price_ratio : Optional[float],
+        num_bids : int,
+        num_unique_bidders : int,
+        first_bid_latency_us : Optional[int],
+        bid_span_us : Optional[int],
+        cancelled : bool) -> None:
+        """the winner's fields are None if nobody won; the bid times are None if there were no bids."""
+
+        self._winner_user_id = winner_user_id
+        self._final_price_in_cents = final_price_in_cents
+        self._final_to_start_price_ratio = final_to_start_price_ratio # None if unsold, or if the start price was 0
+        self._num_bids = num_bids
+        self._num_unique_bidders = num_unique_bidders
+        self._first_bid_latency_us = first_bid_latency_us # from the auction's start to its first bid
+        self._bid_span_us = bid_span_us # from the first bid to the last
+        self._cancelled = cancelled
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{field}={value}" for field, value in self.convert_to_dict().items())
+        return "AuctionMetrics(" + args + ")"
+
+    def convert_to_dict(self) -> Dict:
+        return {
+            'winner_user_id': self._winner_user_id,
+            'final_price_in_cents': self._final_price_in_cents,
+            'final_to_start_price_ratio': self._final_to_start_price_ratio,
+            'num_bids': self._num_bids,
+            'num_unique_bidders': self._num_unique_bidders,
+            'first_bid_latency_us': self._first_bid_latency_us,
+            'bid_span_us': self._bid_span_us,
+            'cancelled': self._cancelled,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> Optional[AuctionMetrics]:
+        """from a dict with the keys in FIELDS (e.g. a stored document), or None if it has none of them."""
+        if "num_bids" not in data: # stored before metrics were
+            return None
+        return AuctionMetrics(*(data.get(field) for field in AuctionMetrics.FIELDS))
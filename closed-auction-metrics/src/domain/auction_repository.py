@@ -1,77 +1,269 @@
 from abc import ABC, abstractmethod
+import bisect
+import heapq
+import statistics
 from domain.closed_auction import *
-from typing import Dict
+from domain.auction_rollups import *
+from domain.auction_window import AuctionWindowColumns
+from typing import Dict, Iterable, Iterator, Tuple
+
+# keyset of a closed auction, (end_time, item_id); the order auctions are paged in
+AuctionKey = Tuple[datetime.datetime, str]
+
+# max number of auctions in a page when the caller gives no limit (see MongoDbAuctionRepository.get_auctions())
+DEFAULT_AUCTIONS_LIMIT = 10
+
+# derived metrics (see AuctionMetrics) auctions can be ranked by, with get_auctions_ranked_by()
+RANKING_METRICS = ("final_price_in_cents", "final_to_start_price_ratio", "num_bids", "num_unique_bidders")
+
+class TransientWriteError(Exception):
+    """a write that failed for a reason that may go away (e.g. the database is unreachable); retrying it as is is safe."""
+
+class AuctionWriteError(Exception):
+    """
+    a batch write in which some auctions were rejected for good (e.g. a duplicate key, or a
+    document over the size limit); retrying them would fail again. every other auction of the
+    batch was stored.
+    """
+
+    def __init__(self, failed_item_ids: Iterable[str], message: str="") -> None:
+        self.failed_item_ids = set(failed_item_ids)
+        super().__init__(f"could not store auctions {sorted(self.failed_item_ids)}: {message}")
 
 class AuctionRepository(ABC):
 
     @abstractmethod
-    def get_auction(self, item_id: str) -> ClosedAuction:
+    def get_auction(self, item_id: str, include_bids: bool=True) -> ClosedAuction:
+        """include_bids=False loads a summary without the bid history (see ClosedAuction.has_bids())."""
+        pass
+
+    @abstractmethod
+    def get_auction_content_hash(self, item_id: str) -> Optional[str]:
+        """
+        the content hash of the stored auction (see ClosedAuction.content_hash()), without
+        loading the auction; None if there is no such auction or no hash was stored with it.
+        """
+        pass
+
+    @abstractmethod
+    def get_auctions(self, leftBound: datetime.datetime, rightBound: datetime.datetime,  limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        """
+        returns the (up to limit) most recently ended auctions in the time window, in
+        ascending order by (end_time, item_id). if before is given, only auctions whose
+        key sorts strictly before it are considered, which lets a caller walk a window
+        page by page from the most recent end backwards. include_bids=False loads summaries.
+        """
+        pass
+
+    @abstractmethod
+    def iter_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], include_bids: bool=True) -> Iterator[ClosedAuction]:
+        """
+        lazily yields every auction that ended in the time window, in ascending order by
+        (end_time, item_id), so callers never need to hold the whole window in memory.
+        """
+        pass
+
+    @abstractmethod
+    def get_auctions_by_bidder(self, bidder_user_id: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        """
+        like get_auctions(), restricted to the auctions the given user placed at least one bid on.
+        """
+        pass
+
+    @abstractmethod
+    def get_auctions_by_seller(self, seller_user_id: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        """
+        like get_auctions(), restricted to the auctions of the given seller.
+        """
+        pass
+
+    @abstractmethod
+    def get_auctions_ranked_by(self, metric: str, limit: Optional[int]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        """
+        returns the (up to limit) auctions with the highest value of the given derived metric
+        (one of RANKING_METRICS), highest first, ties broken by item_id (descending). auctions
+        without a value for it (e.g. the final price of an unsold auction) are left out.
+        """
         pass
 
     @abstractmethod
-    def get_auctions(self, leftBound: datetime.datetime, rightBound: datetime.datetime,  limit: Optional[int]=None) -> List[ClosedAuction]:
+    def aggregate_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], bucket_us: int, seller_user_id: Optional[str]=None) -> List[Dict]:
+        """
+        summarizes the auctions that ended in the time window (only the given seller's, if
+        seller_user_id is given), grouped into buckets of
+        bucket_us microseconds of end time (aligned to the unix epoch). returns one dict per
+        non-empty bucket, in ascending order: bucket_start_us, num_auctions, num_sold,
+        num_cancelled, num_bids, gmv_in_cents (sum of final prices) and
+        median_final_price_in_cents (None if nothing sold). computed from the stored
+        metrics (see AuctionMetrics), never from the bid histories.
+        """
+        pass
+
+    @abstractmethod
+    def get_auction_window_columns(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> AuctionWindowColumns:
+        """
+        loads every auction that ended in the time window in columnar form (see
+        AuctionWindowColumns), reading only the fields cross-auction analytics need.
+        """
+        pass
+
+    @abstractmethod
+    def get_rollups(self, granularity: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> List[Dict]:
+        """
+        returns the rollups of the given granularity (see ROLLUP_GRANULARITIES) whose buckets
+        overlap the time window, in ascending order: bucket_start_us plus the ROLLUP_COUNTS
+        and, if anything sold, min/max_final_price_in_cents. rollups are maintained as
+        auctions are saved; an auction is only added to them the first time it is saved.
+        """
         pass
 
     @abstractmethod
     def save_auction(self, auction: ClosedAuction):
         pass
 
+    def save_auctions(self, auctions: List[ClosedAuction]):
+        """
+        saves (adds or updates) several auctions; repositories override this to batch the writes.
+        raises TransientWriteError if the batch should be retried, and AuctionWriteError if only
+        some of the auctions could not be stored.
+        """
+        for auction in auctions:
+            self.save_auction(auction)
+
 
 class InMemoryAuctionRepository(AuctionRepository):
 
     def __init__(self) -> None:
         super().__init__()
         self._auctions: Dict[str,ClosedAuction] = dict() 
+        # every stored auction's (end_time, item_id), kept sorted, so a time window is found
+        # by bisection and a limited query touches only the auctions it returns
+        self._keys: List[AuctionKey] = []
+        # the same, per bidder, for the auctions each user bid on, and per seller
+        self._bidder_keys: Dict[str, List[AuctionKey]] = dict()
+        self._seller_keys: Dict[str, List[AuctionKey]] = dict()
+        self._rollups: Dict[RollupKey, Dict] = dict()
 
-    def get_auction(self, item_id: str) -> Optional[ClosedAuction]:
+    def get_auction(self, item_id: str, include_bids: bool=True) -> Optional[ClosedAuction]:
         if item_id in self._auctions:
-            return self._auctions[item_id]
+            auction = self._auctions[item_id]
+            return auction if include_bids else auction.without_bids()
         return None
 
-    def get_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None) -> List[ClosedAuction]:
-        # filter out the Transactions by the left and right date range specified
-        auction_list = self._auctions.values()
+    def get_auction_content_hash(self, item_id: str) -> Optional[str]:
+        auction = self._auctions.get(item_id)
+        return auction.content_hash() if auction else None
 
+    def get_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        return self._get_auctions_by_keys(self._keys, leftBound, rightBound, limit, before, include_bids)
 
-        if not leftBound and not rightBound:
-            auction_list_trimmed = auction_list
-        else:
-            auction_list_trimmed = []
-            for auction in auction_list:
-                finalization_datetime = auction.get_end_time()
-                # trim by a left and right bound
-                if leftBound and rightBound:
-                    if leftBound <= finalization_datetime <= rightBound:
-                        auction_list_trimmed.append(auction)
-                # trim by a left bound
-                elif leftBound:
-                    if leftBound <= finalization_datetime:
-                        auction_list_trimmed.append(auction)
-                # trim by a right bound
-                elif rightBound:
-                    if finalization_datetime <= rightBound:
-                        auction_list_trimmed.append(auction)
-            return auction_list_trimmed
-
-        _sort_auction_results(auction_list_trimmed)
+    def get_auctions_by_bidder(self, bidder_user_id: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        return self._get_auctions_by_keys(self._bidder_keys.get(bidder_user_id, []), leftBound, rightBound, limit, before, include_bids)
+
+    def get_auctions_by_seller(self, seller_user_id: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        return self._get_auctions_by_keys(self._seller_keys.get(seller_user_id, []), leftBound, rightBound, limit, before, include_bids)
+
+    def _get_auctions_by_keys(self, keys: List[AuctionKey], leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int], before: Optional[AuctionKey], include_bids: bool) -> List[ClosedAuction]:
+        # O(log n + k): bisect the window's bounds in the sorted keys, then slice off the last limit
+        lo, hi = 0, len(keys)
+        # a 1-tuple sorts before every key with the same end time
+        if leftBound:
+            lo = bisect.bisect_left(keys, (leftBound,))
+        if rightBound:
+            hi = bisect.bisect_left(keys, (rightBound + _ONE_MICROSECOND,)) # end times are inclusive
+
+        # resume after the page the caller has already seen
+        if before is not None:
+            hi = min(hi, bisect.bisect_left(keys, before))
+
+        if limit is not None:
+            lo = max(lo, hi - limit) # keep most recently ended closed-auctions until limit
+
+        auction_list_trimmed = [self._auctions[item_id] for _, item_id in keys[lo:hi]]
+
+        if not include_bids:
+            auction_list_trimmed = [auction.without_bids() for auction in auction_list_trimmed]
+        return auction_list_trimmed
 
+    def iter_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], include_bids: bool=True) -> Iterator[ClosedAuction]:
+        return iter(self.get_auctions(leftBound, rightBound, include_bids=include_bids))
+
+    def get_auctions_ranked_by(self, metric: str, limit: Optional[int]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        ranked = [(value, item_id) for item_id, auction in self._auctions.items() if (value := _metric_value(auction, metric)) is not None]
         if limit is not None:
-            return _limit_auction_results(auction_list_trimmed,limit,toSort=False)
+            ranked = heapq.nlargest(limit, ranked)
         else:
-            return auction_list_trimmed
+            ranked.sort(reverse=True)
+
+        auctions = [self._auctions[item_id] for _, item_id in ranked]
+        if not include_bids:
+            auctions = [auction.without_bids() for auction in auctions]
+        return auctions
+
+    def aggregate_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], bucket_us: int, seller_user_id: Optional[str]=None) -> List[Dict]:
+        buckets : Dict[int, List[ClosedAuction]] = dict()
+        auctions = self.get_auctions_by_seller(seller_user_id, leftBound, rightBound) if seller_user_id is not None else self.iter_auctions(leftBound, rightBound)
+        for auction in auctions:
+            end_time_us = utils.toEpochMicros(auction.get_end_time())
+            buckets.setdefault(end_time_us - end_time_us % bucket_us, []).append(auction)
+        return [_aggregate_bucket(bucket_start_us, auctions) for bucket_start_us, auctions in sorted(buckets.items())]
+
+    def get_auction_window_columns(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> AuctionWindowColumns:
+        return AuctionWindowColumns.from_auctions(self.iter_auctions(leftBound, rightBound))
+
+    def get_rollups(self, granularity: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> List[Dict]:
+        bucket_us = ROLLUP_GRANULARITIES[granularity]
+        lo = utils.toEpochMicros(leftBound) // bucket_us * bucket_us if leftBound else None
+        hi = utils.toEpochMicros(rightBound) if rightBound else None
+        return [{"bucket_start_us": bucket_start_us, **rollup} for (g, bucket_start_us), rollup in sorted(self._rollups.items())
+                if g == granularity and (lo is None or bucket_start_us >= lo) and (hi is None or bucket_start_us <= hi)]
 
     def save_auction(self, auction: ClosedAuction):
+        previous = self._auctions.get(auction._item_id)
+        if previous is not None: # an update; its end time (and bids) may have changed
+            previous_key = _auction_key(previous)
+            del self._keys[bisect.bisect_left(self._keys, previous_key)]
+            for bidder_user_id in _bidder_user_ids(previous):
+                bidder_keys = self._bidder_keys[bidder_user_id]
+                del bidder_keys[bisect.bisect_left(bidder_keys, previous_key)]
+            if previous._seller_user_id is not None:
+                seller_keys = self._seller_keys[previous._seller_user_id]
+                del seller_keys[bisect.bisect_left(seller_keys, previous_key)]
+        else: # re-deliveries of an auction are not counted again
+            for key, delta in rollup_deltas([auction]).items():
+                merge_rollup(self._rollups.setdefault(key, dict()), delta)
+        key = _auction_key(auction)
+        bisect.insort(self._keys, key)
+        for bidder_user_id in _bidder_user_ids(auction):
+            bisect.insort(self._bidder_keys.setdefault(bidder_user_id, []), key)
+        if auction._seller_user_id is not None:
+            bisect.insort(self._seller_keys.setdefault(auction._seller_user_id, []), key)
         self._auctions[auction._item_id] = auction # works for both add new and update
 
-def _sort_auction_results(closed_auctions: List[ClosedAuction]):
-    """sorts the closed auctions sorted from ending the farthest back in time to most recent (last idx)."""
-    # sort closed auctions in ascending order by time of finalization
-    closed_auctions.sort(key=lambda ca: ca.get_end_time())
-    
-def _limit_auction_results(closed_auctions: List[ClosedAuction], limit: int, toSort: bool=False) -> List[ClosedAuction]:
-    """Returns the most recently closed auctions up till limit into the past."""
-    if len(closed_auctions) > limit:
-        if toSort:
-            _sort_auction_results(closed_auctions)
-        closed_auctions = closed_auctions[len(closed_auctions)-limit:] # keep most recently ended closed-auctions until limit
-    return closed_auctions
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+def _metric_value(closed_auction: ClosedAuction, metric: str):
+    metrics = closed_auction.metrics()
+    return getattr(metrics, "_" + metric) if metrics is not None else None
+
+def _aggregate_bucket(bucket_start_us: int, auctions: List[ClosedAuction]) -> Dict:
+    metrics = [auction.metrics() for auction in auctions]
+    final_prices = [m._final_price_in_cents for m in metrics if m is not None and m._final_price_in_cents is not None]
+    return {
+        'bucket_start_us': bucket_start_us,
+        'num_auctions': len(auctions),
+        'num_sold': len(final_prices),
+        'num_cancelled': sum(1 for m in metrics if m is not None and m._cancelled),
+        'num_bids': sum(m._num_bids for m in metrics if m is not None),
+        'gmv_in_cents': sum(final_prices),
+        'median_final_price_in_cents': statistics.median(final_prices) if final_prices else None,
+    }
+
+def _bidder_user_ids(closed_auction: ClosedAuction) -> Iterable[str]:
+    """the distinct users that bid on the auction."""
+    if closed_auction._bid_columns is not None:
+        return closed_auction._bid_columns._bidder_user_ids
+    return {bid._bidder_user_id for bid in closed_auction._bid_list or []}
+
+def _auction_key(closed_auction: ClosedAuction) -> AuctionKey:
+    return (closed_auction.get_end_time(), closed_auction._item_id)
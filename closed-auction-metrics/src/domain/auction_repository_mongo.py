@@ -1,20 +1,49 @@
 
 from domain.closed_auction import *
 from domain.auction_repository import *
-from typing import Dict
+from typing import Dict, Iterator
+import time
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, IndexModel, ReplaceOne, UpdateOne
+from pymongo.cursor import Cursor
 from pymongo.database import Database, Collection
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 from pprint import pprint # to print bson like data prettier
 
 DATABASE_NAME = "closed_auction_metrics_db" # name of mongo db database for this service
 AUCTION_COLLECTION_NAME = "auctions" 
+ROLLUP_COLLECTION_NAME = "auction_rollups" # hourly/daily totals, maintained as auctions are saved (see auction_rollups.py)
+SCHEMA_VERSION = 4 # layout of auction documents; bump (and run `manage_mongo.py migrate`) when it changes
+OUTDATED_DOCUMENTS_QUERY = {"schema_version": {"$ne": SCHEMA_VERSION}} # what migrate_documents() rewrites (matches a missing version too)
+SUMMARY_PROJECTION = {"bids": 0} # summaries never ship (or decode) the bid history
+CONTENT_HASH_PROJECTION = {"_id": 0, "content_hash": 1}
+STREAM_BATCH_SIZE = 100 # documents per round trip when iterating a whole window (bounds memory while streaming)
+WINDOW_BATCH_SIZE = 1000 # documents per round trip when loading a window for analytics (projected, so small)
+# the fields AuctionWindowColumns reads; bid ids, amounts and flags never leave the server
+WINDOW_PROJECTION = {"_id": 0, "start_price_in_cents": 1, "start_time_us": 1, "end_time_us": 1, "final_price_in_cents": 1,
+                     "bids.time_received_us": 1, "bids.bidder_user_id": 1}
+
+# indexes backing the repository's query shapes (see _query_shapes()); add new ones here
+# when a new access path is introduced. index names are left to mongo's defaults so that
+# re-running ensure_indexes() against an existing deployment is a no-op.
+AUCTION_INDEXES : List[IndexModel] = [
+    IndexModel([("item_id", ASCENDING)], unique=True), # get_auction
+    IndexModel([("end_time_us", DESCENDING), ("item_id", DESCENDING)]), # get_auctions (range + keyset seek + sort + limit)
+    IndexModel([("bids.bidder_user_id", ASCENDING), ("end_time_us", DESCENDING), ("item_id", DESCENDING)]), # get_auctions_by_bidder (multikey; one entry per distinct bidder)
+    IndexModel([("seller_user_id", ASCENDING), ("end_time_us", DESCENDING), ("item_id", DESCENDING)]), # get_auctions_by_seller, aggregate_auctions(seller_user_id)
+    IndexModel([("schema_version", ASCENDING)]), # has_outdated_documents, migrate_documents
+] + [
+    IndexModel([(metric, DESCENDING), ("item_id", DESCENDING)]) for metric in RANKING_METRICS # get_auctions_ranked_by (sort + limit)
+]
+ROLLUP_INDEXES : List[IndexModel] = [
+    IndexModel([("granularity", ASCENDING), ("bucket_start_us", ASCENDING)]), # get_rollups
+]
 
 class MongoDbAuctionRepository(AuctionRepository):
 
     # (typical) MONGO_DB_CONNECTION_PATH = "mongodb://localhost:27017/"
 
-    def __init__(self, hostname: str, port: str= "27017") -> None:
+    def __init__(self, hostname: str, port: str= "27017", manage_indexes: bool=True) -> None:
 
         self.mongo_db_connection_url = f"mongodb://{hostname}:{port}/"
         
@@ -41,6 +70,18 @@ class MongoDbAuctionRepository(AuctionRepository):
             print(f"collection '{AUCTION_COLLECTION_NAME}' appears to already exist")
             auction_collection = self.my_db[AUCTION_COLLECTION_NAME]
 
+        if manage_indexes:
+            self.ensure_indexes()
+            try:
+                self.check_query_plans()
+            except OperationFailure as e: # diagnostics only; never block startup on them
+                print(f"WARNING: could not explain query shapes: {e}")
+            # get_auction() is the only read that decodes older layouts: range queries, sorts and
+            # aggregates key on end_time_us and the stored metrics, etags and chart keys on the
+            # stored content hash, so migrate before serving anything else
+            if self.has_outdated_documents():
+                print(f"WARNING: found documents stored in a layout older than schema version {SCHEMA_VERSION}; migrating them before serving")
+                self.migrate_documents()
 
     def _get_auction_collection(self) -> Collection:
         return self.my_db[AUCTION_COLLECTION_NAME]
@@ -49,104 +90,517 @@ class MongoDbAuctionRepository(AuctionRepository):
         serverStatusResult = self.client[DATABASE_NAME].command("serverStatus")
         pprint(serverStatusResult)
 
-    def get_auction(self, item_id: str) -> Optional[ClosedAuction]:
+    def _get_rollup_collection(self) -> Collection:
+        return self.my_db[ROLLUP_COLLECTION_NAME]
+
+    def ensure_indexes(self) -> List[str]:
+        """
+        idempotently creates the indexes in AUCTION_INDEXES on the auction collection (and
+        ROLLUP_INDEXES on the rollup collection). indexes that already exist are left alone.
+        returns the names of the indexes that were built by this call.
+        """
+        built : List[str] = []
+        for collection_name, indexes in ((AUCTION_COLLECTION_NAME, AUCTION_INDEXES), (ROLLUP_COLLECTION_NAME, ROLLUP_INDEXES)):
+            collection = self.my_db[collection_name]
+            existing = collection.index_information()
+            for index in indexes:
+                name = index.document["name"]
+                if name in existing:
+                    print(f"index '{name}' already exists on '{collection_name}'")
+                    continue
+                print(f"building index '{name}' on '{collection_name}'...")
+                t0 = time.perf_counter()
+                try:
+                    collection.create_indexes([index])
+                except OperationFailure as e:
+                    # e.g. the unique item_id index cannot be built while duplicate item_ids exist
+                    print(f"WARNING: failed to build index '{name}': {e}")
+                    continue
+                print(f"built index '{name}' in {time.perf_counter()-t0:.2f}s")
+                built.append(name)
+        return built
+
+    def report_index_builds(self) -> List[Dict]:
+        """
+        prints (and returns) the progress of any index builds currently running
+        against the auction collection (e.g. ones started by another instance).
+        """
+        namespace = f"{DATABASE_NAME}.{AUCTION_COLLECTION_NAME}"
+        pipeline = [
+            {"$currentOp": {"allUsers": True, "idleConnections": False}},
+            {"$match": {"ns": namespace, "command.createIndexes": {"$exists": True}}},
+        ]
+        ops = list(self.client.admin.aggregate(pipeline))
+        if not ops:
+            print(f"no index builds in progress on '{namespace}'")
+        for op in ops:
+            progress = op.get("progress", {})
+            done, total = progress.get("done"), progress.get("total")
+            pct = f" ({done}/{total}, {100*done/total:.1f}%)" if done is not None and total else ""
+            print(f"index build on '{namespace}': {op.get('msg', 'in progress')}{pct}")
+        return ops
+
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """
+        runs explain() on each of the repository's query shapes and returns the
+        stages of each winning plan. any shape whose plan contains a COLLSCAN is
+        flagged, since it will degrade linearly with the size of the collection.
+        """
+        plans : Dict[str, List[str]] = dict()
+        for shape, cursor in self._query_shapes().items():
+            winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            winning_plan = winning_plan.get("queryPlan", winning_plan) # slot-based engine nests the plan (mongo 5+)
+            stages = _plan_stages(winning_plan)
+            plans[shape] = stages
+            if "COLLSCAN" in stages:
+                print(f"WARNING: query shape '{shape}' uses a collection scan (plan: {' <- '.join(stages)})")
+            else:
+                print(f"query shape '{shape}' plan: {' <- '.join(stages)}")
+        return plans
+
+    def _query_shapes(self) -> Dict[str, Cursor]:
+        """returns one (unexecuted) cursor per query shape issued by this repository."""
+        example_time = utils.TIME_ZONE.localize(datetime.datetime(year=2022,month=1,day=1))
+        return {
+            "get_auction": self._find_auction_cursor("example-item-id"),
+            "save_auctions(pending rollups)": self._pending_rollups_cursor(["example-item-id"]),
+            "has_outdated_documents": self._outdated_documents_cursor(),
+            "get_auction_content_hash": self._find_auction_cursor("example-item-id", projection=CONTENT_HASH_PROJECTION),
+            "get_auctions(unbounded)": self._find_auctions_cursor(None, None, DEFAULT_AUCTIONS_LIMIT),
+            "get_auctions(range)": self._find_auctions_cursor(example_time, example_time + datetime.timedelta(days=1), DEFAULT_AUCTIONS_LIMIT),
+            "get_auctions(range, before)": self._find_auctions_cursor(example_time, example_time + datetime.timedelta(days=1), DEFAULT_AUCTIONS_LIMIT, (example_time, "example-item-id")),
+            "get_auctions_by_bidder(range, before)": self._find_auctions_cursor(example_time, example_time + datetime.timedelta(days=1), DEFAULT_AUCTIONS_LIMIT, (example_time, "example-item-id"), filter_doc={"bids.bidder_user_id": "example-user-id"}),
+            "get_auctions_by_seller(range, before)": self._find_auctions_cursor(example_time, example_time + datetime.timedelta(days=1), DEFAULT_AUCTIONS_LIMIT, (example_time, "example-item-id"), filter_doc={"seller_user_id": "example-user-id"}),
+            "iter_auctions(range)": self._iter_auctions_cursor(example_time, example_time + datetime.timedelta(days=1)),
+            **{f"get_auctions_ranked_by({metric})": self._ranked_auctions_cursor(metric, DEFAULT_AUCTIONS_LIMIT) for metric in RANKING_METRICS},
+            "get_auction_window_columns(range)": self._window_cursor(example_time, example_time + datetime.timedelta(days=1)),
+            "get_rollups(range)": self._rollups_cursor("hour", example_time, example_time + datetime.timedelta(days=1)),
+        }
+
+    def _find_auction_cursor(self, item_id: str, include_bids: bool=True, projection: Optional[Dict]=None) -> Cursor:
         query_doc = {
             "item_id": item_id
         }
-        auction_collection = self._get_auction_collection()
-        data = auction_collection.find_one(query_doc)
+        if projection is None and not include_bids:
+            projection = SUMMARY_PROJECTION
+        return self._get_auction_collection().find(query_doc, projection).limit(1)
+
+    def get_auction(self, item_id: str, include_bids: bool=True) -> Optional[ClosedAuction]:
+        data = next(self._find_auction_cursor(item_id, include_bids), None)
         return self._mongoDataToClosedAuction(data) if data else None
 
-    def get_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None) -> List[ClosedAuction]:
-        auction_collection = self._get_auction_collection()
+    def get_auction_content_hash(self, item_id: str) -> Optional[str]:
+        # the item_id index seek plus one small field; the auction itself is neither shipped nor decoded
+        data = next(self._find_auction_cursor(item_id, projection=CONTENT_HASH_PROJECTION), None)
+        return data.get("content_hash") if data else None # absent from documents written before schema version 4
 
-        if leftBound or rightBound:
-            if leftBound and rightBound:
-                time_param = {'$lte': rightBound, '$gte': leftBound}
-            elif leftBound:
-                time_param = {'$gte': leftBound}
-            else: # rightBound
-                time_param = {'$lte': rightBound}
-            query_doc = { "end_time": time_param }
-        else:
-            query_doc = {} # getting all auctions (up to default limit)...
+    def get_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        if not limit:
+            limit = DEFAULT_AUCTIONS_LIMIT
 
-        # retreive auctions
-        cursor = auction_collection.find(query_doc)
-        auctions : List[ClosedAuction] = []
-        for data in cursor:
-            closed_auction = self._mongoDataToClosedAuction(data)
-            auctions.append(closed_auction)
+        # let the server walk the (end_time, item_id) index from the most recent end (or from
+        # the cursor position) and stop after limit documents, rather than shipping the whole
+        # range to be sorted here. every page costs an index seek plus limit documents.
+        cursor = self._find_auctions_cursor(leftBound, rightBound, limit, before, include_bids)
+        auctions : List[ClosedAuction] = [self._mongoDataToClosedAuction(data) for data in cursor]
 
-        # order auctions by end time
-        _sort_auction_results(auctions)
+        # results come back most recent first; return them in ascending order by end time
+        auctions.reverse()
+        return auctions
 
-        # filter down number of results
+    def get_auctions_by_bidder(self, bidder_user_id: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
         if not limit:
-            limit = 10 # default max number of auctions returned
-        auction_list_trimmed = _limit_auction_results(auctions,limit,toSort=False)
+            limit = DEFAULT_AUCTIONS_LIMIT
 
-        return auction_list_trimmed
+        # a seek into the (bids.bidder_user_id, end_time_us, item_id) index: O(log n + limit), like get_auctions()
+        cursor = self._find_auctions_cursor(leftBound, rightBound, limit, before, include_bids, filter_doc={"bids.bidder_user_id": bidder_user_id})
+        auctions : List[ClosedAuction] = [self._mongoDataToClosedAuction(data) for data in cursor]
+        auctions.reverse()
+        return auctions
 
-    def save_auction(self, auction: ClosedAuction):
+    def get_auctions_by_seller(self, seller_user_id: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: Optional[int]=None, before: Optional[AuctionKey]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        if not limit:
+            limit = DEFAULT_AUCTIONS_LIMIT
+
+        cursor = self._find_auctions_cursor(leftBound, rightBound, limit, before, include_bids, filter_doc={"seller_user_id": seller_user_id})
+        auctions : List[ClosedAuction] = [self._mongoDataToClosedAuction(data) for data in cursor]
+        auctions.reverse()
+        return auctions
+
+    def iter_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], include_bids: bool=True) -> Iterator[ClosedAuction]:
+        for data in self._iter_auctions_cursor(leftBound, rightBound, include_bids):
+            yield self._mongoDataToClosedAuction(data)
+
+    def _iter_auctions_cursor(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], include_bids: bool=True) -> Cursor:
+        query_doc = _time_window_query_doc(leftBound, rightBound)
+        projection = None if include_bids else SUMMARY_PROJECTION
+        return self._get_auction_collection().find(query_doc, projection).sort([("end_time_us", ASCENDING), ("item_id", ASCENDING)]).batch_size(STREAM_BATCH_SIZE)
+
+    def _find_auctions_cursor(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], limit: int, before: Optional[AuctionKey]=None, include_bids: bool=True, filter_doc: Optional[Dict]=None) -> Cursor:
+        """filter_doc, if given, must be an equality on the leading field of an index that continues with (end_time_us, item_id)."""
         auction_collection = self._get_auction_collection()
-        document = auction.convert_to_dict_w_datetimes()
-        auction_collection.update_one({ '_id' : auction._item_id}, { '$set': document }, upsert=True)
 
-    def _mongoDataToClosedAuction(self, data: Dict) -> ClosedAuction:
+        query_doc = _time_window_query_doc(leftBound, rightBound)
+        if filter_doc:
+            query_doc = {**filter_doc, **query_doc}
 
-        data["dt_start_time"] = utils.toDatetimeFromStr(data["str_start_time"])
-        data["dt_end_time"] = utils.toDatetimeFromStr(data["str_end_time"])
+        if before is not None:
+            before_end_time, before_item_id = before
+            before_end_time_us = utils.toEpochMicros(before_end_time)
+            keyset_doc = {"$or": [
+                {"end_time_us": {"$lt": before_end_time_us}},
+                {"end_time_us": before_end_time_us, "item_id": {"$lt": before_item_id}},
+            ]}
+            query_doc = {"$and": [query_doc, keyset_doc]} if query_doc else keyset_doc
 
-        for bid in data["bids"]:
-            bid["dt_time_received"] = utils.toDatetimeFromStr(bid["str_time_received"])
+        projection = None if include_bids else SUMMARY_PROJECTION
+        return auction_collection.find(query_doc, projection).sort([("end_time_us", DESCENDING), ("item_id", DESCENDING)]).limit(limit)
 
-        if data["str_cancellation_time"]:
-            data["dt_cancellation_time"] = utils.toDatetimeFromStr(data["str_cancellation_time"])
-        else:
-            data["dt_cancellation_time"] = None
+    def get_auctions_ranked_by(self, metric: str, limit: Optional[int]=None, include_bids: bool=True) -> List[ClosedAuction]:
+        if not limit:
+            limit = DEFAULT_AUCTIONS_LIMIT
+        return [self._mongoDataToClosedAuction(data) for data in self._ranked_auctions_cursor(metric, limit, include_bids)]
+
+    def _ranked_auctions_cursor(self, metric: str, limit: int, include_bids: bool=True) -> Cursor:
+        # walks the (metric, item_id) index from its highest value; documents without the
+        # metric (unsold, or not yet migrated) are skipped by the index bounds
+        projection = None if include_bids else SUMMARY_PROJECTION
+        query_doc = {metric: {"$ne": None}}
+        return self._get_auction_collection().find(query_doc, projection).sort([(metric, DESCENDING), ("item_id", DESCENDING)]).limit(limit)
+
+    def aggregate_auctions(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], bucket_us: int, seller_user_id: Optional[str]=None) -> List[Dict]:
+        # the whole reduction runs on the server; one small document per bucket comes back
+        pipeline = _aggregate_auctions_pipeline(leftBound, rightBound, bucket_us, seller_user_id)
+        return list(self._get_auction_collection().aggregate(pipeline, allowDiskUse=True))
+
+    def get_auction_window_columns(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> AuctionWindowColumns:
+        return AuctionWindowColumns.from_epoch_micros_documents(self._window_cursor(leftBound, rightBound))
+
+    def _window_cursor(self, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> Cursor:
+        # documents in the layout from before epoch microseconds (see migrate_documents()) are left out
+        query_doc = _time_window_query_doc(leftBound, rightBound) or {"end_time_us": {"$exists": True}}
+        return self._get_auction_collection().find(query_doc, WINDOW_PROJECTION).batch_size(WINDOW_BATCH_SIZE)
+
+    def get_rollups(self, granularity: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> List[Dict]:
+        return list(self._rollups_cursor(granularity, leftBound, rightBound))
+
+    def _rollups_cursor(self, granularity: str, leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> Cursor:
+        bucket_us = ROLLUP_GRANULARITIES[granularity]
+        query_doc : Dict = {"granularity": granularity}
+        bucket_range : Dict = dict()
+        if leftBound:
+            bucket_range["$gte"] = utils.toEpochMicros(leftBound) // bucket_us * bucket_us # the bucket leftBound falls in
+        if rightBound:
+            bucket_range["$lte"] = utils.toEpochMicros(rightBound)
+        if bucket_range:
+            query_doc["bucket_start_us"] = bucket_range
+        return self._get_rollup_collection().find(query_doc, {"_id": 0, "granularity": 0}).sort([("bucket_start_us", ASCENDING)])
 
-        if data["str_finalized_time"]:
-            data["dt_finalized_time"] = utils.toDatetimeFromStr(data["str_finalized_time"])
-        else:
-            data["dt_finalized_time"] = None
+    def save_auction(self, auction: ClosedAuction):
+        self.save_auctions([auction])
+
+    def save_auctions(self, auctions: List[ClosedAuction]):
+        if not auctions:
+            return
+        # one round trip for the whole batch; unordered, since each upsert touches its own document.
+        # a document is inserted with rolled_up=False, and keeps its flag when it is saved again
+        requests = [UpdateOne({ '_id' : auction._item_id}, {"$set": self._closedAuctionToMongoData(auction), "$setOnInsert": {"rolled_up": False}}, upsert=True)
+                    for auction in auctions]
+        rejected : List[str] = []
+        message = ""
+        try:
+            self._get_auction_collection().bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if not write_errors: # every document was written, but the write concern was not met
+                raise TransientWriteError(repr(e)) from e
+            # unordered: every other document of the batch was written (and is rolled up below)
+            rejected = [auctions[error["index"]]._item_id for error in write_errors]
+            message = write_errors[0].get("errmsg", "")
+        except ConnectionFailure as e: # includes AutoReconnect and network timeouts
+            raise TransientWriteError(repr(e)) from e
+
+        try:
+            self._roll_up_pending([auction for auction in auctions if auction._item_id not in rejected])
+        except ConnectionFailure as e:
+            raise TransientWriteError(repr(e)) from e
+        if rejected:
+            raise AuctionWriteError(rejected, message)
+
+    def _pending_rollups_cursor(self, item_ids: List[str]) -> Cursor:
+        return self._get_auction_collection().find({"_id": {"$in": item_ids}, "rolled_up": False}, {"_id": 1})
+
+    def _roll_up_pending(self, auctions: List[ClosedAuction]):
+        """
+        adds the auctions whose documents are not rolled up yet to the rollups, then flags them.
+        whether an auction's first save added it, or a failed save left it pending, it is counted
+        once: a redelivered batch finds the auctions it already counted flagged, and those it did
+        not still pending. (a crash between the rollup write and the flag counts them twice.)
+        """
+        if not auctions:
+            return
+        pending_ids = [data["_id"] for data in self._pending_rollups_cursor([auction._item_id for auction in auctions])]
+        if not pending_ids:
+            return
+        pending = set(pending_ids)
+        self._update_rollups([auction for auction in auctions if auction._item_id in pending])
+        self._get_auction_collection().update_many({"_id": {"$in": pending_ids}, "rolled_up": False}, {"$set": {"rolled_up": True}})
+
+    def _update_rollups(self, new_auctions: List[ClosedAuction]):
+        """
+        adds auctions to the rollups: one $inc/$min/$max upsert per bucket they touch, in one
+        round trip. this runs right after (not atomically with) the auction write; if it fails,
+        the auctions stay pending (see _roll_up_pending()) and are added when they are saved again.
+        """
+        if not new_auctions:
+            return
+        requests = []
+        for (granularity, bucket_start_us), delta in rollup_deltas(new_auctions).items():
+            update_doc = {
+                "$inc": {field: delta[field] for field in ROLLUP_COUNTS},
+                "$setOnInsert": {"granularity": granularity, "bucket_start_us": bucket_start_us},
+            }
+            if "min_final_price_in_cents" in delta: # $min/$max against a missing field set it
+                update_doc["$min"] = {"min_final_price_in_cents": delta["min_final_price_in_cents"]}
+                update_doc["$max"] = {"max_final_price_in_cents": delta["max_final_price_in_cents"]}
+            requests.append(UpdateOne({"_id": rollup_id(granularity, bucket_start_us)}, update_doc, upsert=True))
+        self._get_rollup_collection().bulk_write(requests, ordered=False)
+
+    def rebuild_rollups(self) -> int:
+        """
+        regenerates every rollup from the auction collection (e.g. to count auctions saved before
+        rollups existed), with one aggregation per granularity. auctions still pending are flagged
+        first, since the rebuild counts them. auctions saved while this runs may be counted twice
+        or not at all; run it while ingest is paused. returns the number of rollups written.
+        """
+        self._get_auction_collection().update_many({"rolled_up": False}, {"$set": {"rolled_up": True}})
+        rollup_collection = self._get_rollup_collection()
+        written = 0
+        for granularity, bucket_us in ROLLUP_GRANULARITIES.items():
+            print(f"rebuilding {granularity} rollups in '{ROLLUP_COLLECTION_NAME}'...")
+            requests : List[ReplaceOne] = []
+            ids : List[str] = []
+            for rollup in self._get_auction_collection().aggregate(_rollup_pipeline(bucket_us), allowDiskUse=True):
+                bucket_start_us = rollup.pop("_id")
+                for field in ("min_final_price_in_cents", "max_final_price_in_cents"):
+                    if rollup[field] is None: # nothing sold; left out, as in the incremental updates
+                        del rollup[field]
+                document = {"_id": rollup_id(granularity, bucket_start_us), "granularity": granularity, "bucket_start_us": bucket_start_us, **rollup}
+                requests.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+                ids.append(document["_id"])
+            if requests:
+                rollup_collection.bulk_write(requests, ordered=False)
+            # buckets that no longer have any auctions
+            rollup_collection.delete_many({"granularity": granularity, "_id": {"$nin": ids}})
+            written += len(requests)
+        print(f"done; wrote {written} rollups")
+        return written
+
+    def _outdated_documents_cursor(self) -> Cursor:
+        # $ne is two ranges of the schema_version index (a missing version is indexed as null);
+        # once everything is migrated both are empty, so this costs a seek, not a collection scan
+        return self._get_auction_collection().find(OUTDATED_DOCUMENTS_QUERY, {"_id": 1}).limit(1)
+
+    def has_outdated_documents(self) -> bool:
+        """whether any document is still in a layout migrate_documents() would rewrite."""
+        return next(self._outdated_documents_cursor(), None) is not None
+
+    def migrate_documents(self, batch_size: int=500) -> int:
+        """
+        rewrites every document stored in an older layout (schema_version != SCHEMA_VERSION),
+        e.g. with string/date times instead of epoch microseconds, in the current layout.
+        documents are re-encoded through ClosedAuction and written back with one bulk_write
+        per batch. safe to re-run, and to run while the service is live; but until it is done,
+        only get_auction() reads older documents correctly (range queries, pages, streams and
+        aggregates key on end_time_us and the stored metrics; etags and chart keys on the
+        stored content hash), which is why the service runs it at startup if any are left.
+        returns the number of documents rewritten.
+        """
+        auction_collection = self._get_auction_collection()
+        query_doc = OUTDATED_DOCUMENTS_QUERY
+        print(f"migrating documents in '{AUCTION_COLLECTION_NAME}' to schema version {SCHEMA_VERSION}...")
+
+        migrated = 0
+        requests : List[ReplaceOne] = []
+        for data in auction_collection.find(query_doc).batch_size(batch_size):
+            _id = data["_id"]
+            try:
+                auction = self._mongoDataToClosedAuction(data)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"WARNING: skipping document _id={_id}; could not decode it: {e!r}")
+                continue
+            document = self._closedAuctionToMongoData(auction)
+            if "rolled_up" in data:
+                document["rolled_up"] = data["rolled_up"]
+            requests.append(ReplaceOne({"_id": _id}, document))
+            if len(requests) >= batch_size:
+                migrated += auction_collection.bulk_write(requests, ordered=False).modified_count
+                requests = []
+                print(f"migrated {migrated} documents...")
+        if requests:
+            migrated += auction_collection.bulk_write(requests, ordered=False).modified_count
+        print(f"done; migrated {migrated} documents")
+        return migrated
+
+    def _closedAuctionToMongoData(self, auction: ClosedAuction) -> Dict:
+        document = auction.convert_to_dict_w_epoch_micros()
+        document["content_hash"] = auction.content_hash() # validates http responses without loading the auction (etags)
+        document["schema_version"] = SCHEMA_VERSION
+        return document
 
-        if data["str_finalized_time"]:
-            data["dt_finalized_time"] = utils.toDatetimeFromStr(data["str_finalized_time"])
-        else:
-            data["dt_finalized_time"] = None
+    def _mongoDataToClosedAuction(self, data: Dict) -> ClosedAuction:
+
+        if "end_time_us" not in data: # written before times were stored as epoch microseconds
+            data = _legacy_to_epoch_micros_document(data)
+
+        bids: Optional[BidColumns] = None # not projected for summaries
+        if "bids" in data:
+            # columnar; Bid objects (and their datetimes) are only created if something asks for them
+            bids = BidColumns.from_epoch_micros_dicts(data["bids"])
 
         winning_bid = None
-        if "winning_bid" in data.keys() and data["winning_bid"] is not None:
+        if data.get("winning_bid") is not None:
             bid_data = data["winning_bid"]
-            # bid_data["dt_time_received"] = utils.toDatetimeFromStr(data["str_time_received"])
-            winning_bid = Bid(bid_data["bid_id"],bid_data["item_id"],bid_data["bidder_user_id"],bid_data["amount_in_cents"],bid_data["time_received"],bid_data["active"])
-
-        bids: List[Bid] = []
-        for bid in data["bids"]:
-            bids.append(Bid(bid["bid_id"],bid["item_id"],bid["bidder_user_id"],bid["amount_in_cents"],bid["dt_time_received"],bid["active"]))
+            winning_bid = Bid(bid_data["bid_id"],bid_data["item_id"],bid_data["bidder_user_id"],bid_data["amount_in_cents"],utils.toDatetimeFromEpochMicros(bid_data["time_received_us"]),bid_data["active"])
 
         item_id : str = data["item_id"]
         start_price_in_cents : int = data["start_price_in_cents"]
-        start_time : datetime.datetime = data["dt_start_time"]
-        end_time  : datetime.datetime = data["dt_end_time"]
-        cancellation_time  : Optional[datetime.datetime] = data["dt_cancellation_time"] if data["dt_cancellation_time"] else None
-        finalized_time  : datetime.datetime = data["dt_finalized_time"]
-
-        new_closed_auction = ClosedAuction(item_id,start_price_in_cents,start_time,end_time,cancellation_time,finalized_time,bids, winning_bid)
-        return new_closed_auction
+        start_time : datetime.datetime = utils.toDatetimeFromEpochMicros(data["start_time_us"])
+        end_time  : datetime.datetime = utils.toDatetimeFromEpochMicros(data["end_time_us"])
+        cancellation_time  : Optional[datetime.datetime] = utils.toDatetimeFromEpochMicros(data["cancellation_time_us"]) if data["cancellation_time_us"] is not None else None
+        finalized_time  : datetime.datetime = utils.toDatetimeFromEpochMicros(data["finalized_time_us"]) if data["finalized_time_us"] is not None else None
 
+        metrics = AuctionMetrics.from_dict(data) # None for documents written before schema version 3; derived from the bids instead
 
+        new_closed_auction = ClosedAuction(item_id,start_price_in_cents,start_time,end_time,cancellation_time,finalized_time,bids, winning_bid, metrics, data.get("seller_user_id"), data.get("content_hash"))
+        return new_closed_auction
 
-def _sort_auction_results(closed_auctions: List[ClosedAuction]):
-    """sorts the closed auctions sorted from ending the farthest back in time to most recent (last idx)."""
-    # sort closed auctions in ascending order by time of finalization
-    closed_auctions.sort(key=lambda ca: ca.get_end_time())
-    
-def _limit_auction_results(closed_auctions: List[ClosedAuction], limit: int, toSort: bool=False) -> List[ClosedAuction]:
-    """Returns the most recently closed auctions up till limit into the past."""
-    if len(closed_auctions) > limit:
-        if toSort:
-            _sort_auction_results(closed_auctions)
-        closed_auctions = closed_auctions[len(closed_auctions)-limit:] # keep most recently ended closed-auctions until limit
-    return closed_auctions
+def _time_window_query_doc(leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime]) -> Dict:
+    if leftBound or rightBound:
+        if leftBound and rightBound:
+            time_param = {'$lte': utils.toEpochMicros(rightBound), '$gte': utils.toEpochMicros(leftBound)}
+        elif leftBound:
+            time_param = {'$gte': utils.toEpochMicros(leftBound)}
+        else: # rightBound
+            time_param = {'$lte': utils.toEpochMicros(rightBound)}
+        return { "end_time_us": time_param }
+    return {} # getting all auctions (up to default limit)...
+
+def _aggregate_auctions_pipeline(leftBound: Optional[datetime.datetime], rightBound: Optional[datetime.datetime], bucket_us: int, seller_user_id: Optional[str]=None) -> List[Dict]:
+    """
+    the pipeline behind aggregate_auctions(). buckets are computed with integer arithmetic on
+    end_time_us ($dateTrunc needs mongo 5). there is no $median before mongo 7, so auctions are
+    first counted per (bucket, final price); only those pairs are sorted, and each bucket's
+    median is read off the cumulative counts of its price histogram. the server still reads
+    every auction in the window, but sorts and holds one entry per distinct price, not per auction.
+    """
+    match_doc = _time_window_query_doc(leftBound, rightBound)
+    if seller_user_id is not None:
+        match_doc["seller_user_id"] = seller_user_id
+    # ranks (0-based) of the two middle prices of a bucket with $$n sold auctions; equal when $$n is odd
+    low_rank = {"$floor": {"$divide": [{"$subtract": ["$$n", 1]}, 2]}}
+    high_rank = {"$floor": {"$divide": ["$$n", 2]}}
+    return [
+        {"$match": match_doc}, # uses the end_time_us (or seller_user_id, end_time_us) index
+        {"$group": {
+            "_id": {
+                "bucket_start_us": {"$subtract": ["$end_time_us", {"$mod": ["$end_time_us", bucket_us]}]},
+                # unsold auctions have no final price (null, or missing if not yet migrated)
+                "final_price_in_cents": {"$ifNull": ["$final_price_in_cents", None]},
+            },
+            "count": {"$sum": 1},
+            "num_cancelled": {"$sum": {"$cond": [{"$eq": ["$cancelled", True]}, 1, 0]}},
+            "num_bids": {"$sum": "$num_bids"},
+        }},
+        {"$sort": {"_id.bucket_start_us": ASCENDING, "_id.final_price_in_cents": ASCENDING}},
+        {"$group": {
+            "_id": "$_id.bucket_start_us",
+            "num_auctions": {"$sum": "$count"},
+            "num_sold": {"$sum": {"$cond": [{"$eq": ["$_id.final_price_in_cents", None]}, 0, "$count"]}},
+            "num_cancelled": {"$sum": "$num_cancelled"},
+            "num_bids": {"$sum": "$num_bids"},
+            "gmv_in_cents": {"$sum": {"$multiply": ["$_id.final_price_in_cents", "$count"]}}, # null for unsold, which $sum skips
+            "prices": {"$push": {"price": "$_id.final_price_in_cents", "count": "$count"}}, # ascending; $push keeps the sort order
+        }},
+        {"$project": {
+            "_id": 0,
+            "bucket_start_us": "$_id",
+            "num_auctions": 1,
+            "num_sold": 1,
+            "num_cancelled": 1,
+            "num_bids": 1,
+            "gmv_in_cents": 1,
+            "median_final_price_in_cents": {"$let": {
+                "vars": {"n": "$num_sold"},
+                "in": {"$cond": [{"$eq": ["$$n", 0]}, None, {"$let": {
+                    # walk the histogram once, noting the prices whose cumulative counts first pass each middle rank
+                    "vars": {"middle": {"$reduce": {
+                        "input": {"$filter": {"input": "$prices", "cond": {"$ne": ["$$this.price", None]}}},
+                        "initialValue": {"seen": 0, "low": None, "high": None},
+                        "in": {
+                            "seen": {"$add": ["$$value.seen", "$$this.count"]},
+                            "low": {"$cond": [{"$and": [{"$eq": ["$$value.low", None]}, {"$gt": [{"$add": ["$$value.seen", "$$this.count"]}, low_rank]}]}, "$$this.price", "$$value.low"]},
+                            "high": {"$cond": [{"$and": [{"$eq": ["$$value.high", None]}, {"$gt": [{"$add": ["$$value.seen", "$$this.count"]}, high_rank]}]}, "$$this.price", "$$value.high"]},
+                        },
+                    }}},
+                    "in": {"$avg": ["$$middle.low", "$$middle.high"]},
+                }}]},
+            }},
+        }},
+        {"$sort": {"bucket_start_us": ASCENDING}},
+    ]
+
+def _rollup_pipeline(bucket_us: int) -> List[Dict]:
+    """the pipeline behind rebuild_rollups(): the ROLLUP_COUNTS and min/max final price of every bucket."""
+    sold = {"$cond": [{"$eq": [{"$ifNull": ["$final_price_in_cents", None]}, None]}, 0, 1]}
+    return [
+        {"$project": {
+            "_id": 0,
+            "bucket_start_us": {"$subtract": ["$end_time_us", {"$mod": ["$end_time_us", bucket_us]}]},
+            "final_price_in_cents": 1,
+            "num_bids": 1,
+            "cancelled": 1,
+        }},
+        {"$group": {
+            "_id": "$bucket_start_us",
+            "num_auctions": {"$sum": 1},
+            "num_sold": {"$sum": sold},
+            "num_cancelled": {"$sum": {"$cond": [{"$eq": ["$cancelled", True]}, 1, 0]}},
+            "num_bids": {"$sum": "$num_bids"},
+            "gmv_in_cents": {"$sum": "$final_price_in_cents"},
+            "min_final_price_in_cents": {"$min": "$final_price_in_cents"}, # nulls are ignored
+            "max_final_price_in_cents": {"$max": "$final_price_in_cents"},
+        }},
+    ]
+
+def _legacy_time_us(data: Dict, key: str) -> Optional[int]:
+    """
+    reads a time out of a document written before times were stored as epoch microseconds:
+    either a full-precision "str_<key>" string written by this service, a string in <key>
+    (seed data loaded with mongoimport) or, failing those, a millisecond-precision date.
+    """
+    value = data.get("str_" + key) or data.get(key)
+    if isinstance(value, str):
+        return utils.toEpochMicros(utils.toDatetimeFromStr(value)) if value else None
+    if isinstance(value, datetime.datetime):
+        return utils.toEpochMicros(value)
+    return None
+
+def _legacy_to_epoch_micros_document(data: Dict) -> Dict:
+    document = dict(data)
+    for key in ("start_time", "end_time", "cancellation_time", "finalized_time"):
+        document[key + "_us"] = _legacy_time_us(data, key)
+    if "bids" in data:
+        document["bids"] = [dict(bid, time_received_us=_legacy_time_us(bid, "time_received")) for bid in data["bids"]]
+    if data.get("winning_bid") is not None:
+        document["winning_bid"] = dict(data["winning_bid"], time_received_us=_legacy_time_us(data["winning_bid"], "time_received"))
+    return document
+
+def _plan_stages(plan: Dict) -> List[str]:
+    """flattens an explain() plan tree into its list of stage names (outermost first)."""
+    stages = [plan["stage"]]
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        stages += _plan_stages(input_stage)
+    return stages
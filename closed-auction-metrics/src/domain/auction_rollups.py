@@ -0,0 +1,56 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from domain.closed_auction import ClosedAuction
+from domain.auction_metrics import AuctionMetrics
+from infrastructure import utils
+
+# granularities rollups are kept at, as bucket sizes in microseconds of end time (aligned to the unix epoch, i.e. UTC)
+ROLLUP_GRANULARITIES = {"hour": 3_600_000_000, "day": 86_400_000_000}
+
+# (granularity, bucket_start_us)
+RollupKey = Tuple[str, int]
+
+# additive fields of a rollup; min/max_final_price_in_cents are only present once something in the bucket sold
+ROLLUP_COUNTS = ("num_auctions", "num_sold", "num_cancelled", "num_bids", "gmv_in_cents")
+
+def rollup_id(granularity: str, bucket_start_us: int) -> str:
+    return f"{granularity}:{bucket_start_us}"
+
+def rollup_deltas(auctions: Iterable[ClosedAuction]) -> Dict[RollupKey, Dict]:
+    """
+    folds auctions into what they add to each rollup bucket they fall in (one per
+    granularity), so a batch of auctions costs one update per bucket rather than per auction.
+    """
+    deltas : Dict[RollupKey, Dict] = dict()
+    for auction in auctions:
+        metrics = auction.metrics()
+        end_time_us = utils.toEpochMicros(auction.get_end_time())
+        for granularity, bucket_us in ROLLUP_GRANULARITIES.items():
+            key = (granularity, end_time_us - end_time_us % bucket_us)
+            delta = deltas.get(key)
+            if delta is None:
+                delta = deltas[key] = dict.fromkeys(ROLLUP_COUNTS, 0)
+            add_to_rollup(delta, metrics)
+    return deltas
+
+def add_to_rollup(rollup: Dict, metrics: Optional[AuctionMetrics]):
+    """adds one auction (by its derived metrics) to a rollup."""
+    rollup["num_auctions"] += 1
+    if metrics is None: # a summary without metrics; counted, but nothing more is known
+        return
+    rollup["num_cancelled"] += metrics._cancelled
+    rollup["num_bids"] += metrics._num_bids
+    final_price = metrics._final_price_in_cents
+    if final_price is not None:
+        rollup["num_sold"] += 1
+        rollup["gmv_in_cents"] += final_price
+        rollup["min_final_price_in_cents"] = min(rollup.get("min_final_price_in_cents", final_price), final_price)
+        rollup["max_final_price_in_cents"] = max(rollup.get("max_final_price_in_cents", final_price), final_price)
+
+def merge_rollup(rollup: Dict, delta: Dict):
+    """adds a delta (see rollup_deltas()) to a rollup, the way the $inc/$min/$max upsert does."""
+    for field in ROLLUP_COUNTS:
+        rollup[field] = rollup.get(field, 0) + delta[field]
+    if "min_final_price_in_cents" in delta:
+        rollup["min_final_price_in_cents"] = min(rollup.get("min_final_price_in_cents", delta["min_final_price_in_cents"]), delta["min_final_price_in_cents"])
+        rollup["max_final_price_in_cents"] = max(rollup.get("max_final_price_in_cents", delta["max_final_price_in_cents"]), delta["max_final_price_in_cents"])
@@ -0,0 +1,103 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from domain.closed_auction import ClosedAuction
+from infrastructure import utils
+
+# what AuctionWindowColumns needs of one auction:
+# (start_price_in_cents, start_time_us, end_time_us, final_price_in_cents, bid times_received_us, bid bidder_user_ids)
+AuctionRow = Tuple[int, int, int, Optional[int], Sequence[int], Sequence[str]]
+
+class AuctionWindowColumns():
+    """
+    the auctions of a time window in columnar form, for analytics across many auctions:
+    one array entry per auction for its scalars, and the bids of every auction flattened
+    into shared arrays (auction i's bids are at bid_offsets[i]:bid_offsets[i+1]), with
+    bidder ids interned across the whole window. holds only what analytics read; the
+    repository loads it with a projection, never as ClosedAuction objects.
+    """
+
+    __slots__ = ("_start_prices_in_cents", "_start_times_us", "_end_times_us", "_final_prices_in_cents",
+                 "_bid_offsets", "_bid_times_received_us", "_bid_bidder_codes", "_bidder_user_ids")
+
+    def __init__(
+        self,
+        start_prices_in_cents : np.ndarray,
+        start_times_us : np.ndarray,
+        end_times_us : np.ndarray,
+        final_prices_in_cents : np.ndarray,
+        bid_offsets : np.ndarray,
+        bid_times_received_us : np.ndarray,
+        bid_bidder_codes : np.ndarray,
+        bidder_user_ids : List[str]) -> None:
+
+        self._start_prices_in_cents = start_prices_in_cents
+        self._start_times_us = start_times_us
+        self._end_times_us = end_times_us
+        self._final_prices_in_cents = final_prices_in_cents # float; nan where unsold
+        self._bid_offsets = bid_offsets # len(auctions) + 1
+        self._bid_times_received_us = bid_times_received_us
+        self._bid_bidder_codes = bid_bidder_codes # index into bidder_user_ids per bid
+        self._bidder_user_ids = bidder_user_ids
+
+    @staticmethod
+    def from_rows(rows: Iterable[AuctionRow]) -> AuctionWindowColumns:
+        start_prices, start_times, end_times, final_prices = [], [], [], []
+        offsets = [0]
+        bid_times : List[int] = []
+        bidder_codes : List[int] = []
+        bidders : Dict[str, int] = dict()
+        for start_price, start_time_us, end_time_us, final_price, times_us, bidder_user_ids in rows:
+            start_prices.append(start_price)
+            start_times.append(start_time_us)
+            end_times.append(end_time_us)
+            final_prices.append(final_price if final_price is not None else np.nan)
+            bid_times.extend(times_us)
+            bidder_codes.extend(bidders.setdefault(bidder, len(bidders)) for bidder in bidder_user_ids)
+            offsets.append(len(bid_times))
+
+        return AuctionWindowColumns(
+            np.array(start_prices, dtype=np.int64),
+            np.array(start_times, dtype=np.int64),
+            np.array(end_times, dtype=np.int64),
+            np.array(final_prices, dtype=np.float64),
+            np.array(offsets, dtype=np.int64),
+            np.array(bid_times, dtype=np.int64),
+            np.array(bidder_codes, dtype=np.int32),
+            list(bidders))
+
+    @staticmethod
+    def from_auctions(auctions: Iterable[ClosedAuction]) -> AuctionWindowColumns:
+        return AuctionWindowColumns.from_rows(_auction_row(auction) for auction in auctions)
+
+    @staticmethod
+    def from_epoch_micros_documents(documents: Iterable[Dict]) -> AuctionWindowColumns:
+        """from (projections of) documents shaped like ClosedAuction.convert_to_dict_w_epoch_micros()."""
+        return AuctionWindowColumns.from_rows(_document_row(document) for document in documents)
+
+    def __len__(self) -> int:
+        return len(self._start_times_us)
+
+    def num_bids(self) -> int:
+        return len(self._bid_times_received_us)
+
+    def bid_auction_indices(self) -> np.ndarray:
+        """index of the auction of every bid."""
+        return np.repeat(np.arange(len(self)), np.diff(self._bid_offsets))
+
+def _auction_row(auction: ClosedAuction) -> AuctionRow:
+    metrics = auction.metrics()
+    times_us, _ = auction._bid_history_arrays() # empty for a summary
+    if auction._bid_columns is not None:
+        bidder_user_ids = auction._bid_columns.bidder_user_ids()
+    else:
+        bidder_user_ids = [bid._bidder_user_id for bid in auction._bid_list or []]
+    return (auction._start_price_in_cents, utils.toEpochMicros(auction._start_time), utils.toEpochMicros(auction.get_end_time()),
+            metrics._final_price_in_cents if metrics is not None else None, times_us.tolist(), bidder_user_ids)
+
+def _document_row(document: Dict) -> AuctionRow:
+    bids = document.get("bids", [])
+    return (document["start_price_in_cents"], document["start_time_us"], document["end_time_us"], document.get("final_price_in_cents"),
+            [bid["time_received_us"] for bid in bids], [bid["bidder_user_id"] for bid in bids])
@@ -4,6 +4,9 @@ from infrastructure import utils
 
 class Bid():
 
+    # no per-instance __dict__: auctions can carry thousands of bids
+    __slots__ = ("_bid_id", "_item_id", "_bidder_user_id", "_amount_in_cents", "_time_received", "_active")
+
     def __init__(
         self,
         bid_id : str,
@@ -60,6 +63,23 @@ class Bid():
             'str_time_received': utils.toSQLTimestamp6Repr(self._time_received),
             'active': self._active,
         }
+
+
+    def convert_to_dict_w_epoch_micros(self) -> dict:
+        """
+        returns a json-like representation of the internal contents
+        of a Bid. time is kept as integer microseconds since the epoch
+        (the representation it is persisted in).
+        """
+        
+        return {
+            'bid_id': self._bid_id,
+            'item_id': self._item_id,
+            'bidder_user_id': self._bidder_user_id,
+            'amount_in_cents': self._amount_in_cents,
+            'time_received_us': utils.toEpochMicros(self._time_received),
+            'active': self._active,
+        }
         
 
     @staticmethod    
@@ -0,0 +1,140 @@
+from __future__ import annotations
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from domain.bid import *
+from infrastructure import utils
+
+class BidColumns():
+    """
+    columnar (struct of arrays) representation of an auction's bid history: parallel numpy
+    arrays of epoch-microsecond times, amounts in cents and active flags, plus bid ids and
+    interned item/bidder ids. built once per auction; Bid objects are only created on demand
+    (see bid(), to_bids()). metrics over the whole history are vectorized.
+    """
+
+    __slots__ = ("_bid_ids", "_item_ids", "_item_id_codes", "_bidder_user_ids", "_bidder_user_id_codes", "_amounts_in_cents", "_times_received_us", "_active")
+
+    def __init__(
+        self,
+        bid_ids : List[str],
+        item_ids : Tuple[List[str], np.ndarray],
+        bidder_user_ids : Tuple[List[str], np.ndarray],
+        amounts_in_cents : np.ndarray,
+        times_received_us : np.ndarray,
+        active : np.ndarray) -> None:
+
+        self._bid_ids = bid_ids
+        self._item_ids, self._item_id_codes = item_ids # (distinct values, index into them per bid)
+        self._bidder_user_ids, self._bidder_user_id_codes = bidder_user_ids
+        self._amounts_in_cents = amounts_in_cents
+        self._times_received_us = times_received_us
+        self._active = active
+
+    @staticmethod
+    def from_bids(bids: List[Bid]) -> BidColumns:
+        n = len(bids)
+        return BidColumns(
+            [bid._bid_id for bid in bids],
+            _intern(bid._item_id for bid in bids),
+            _intern(bid._bidder_user_id for bid in bids),
+            np.fromiter((bid._amount_in_cents for bid in bids), dtype=np.int64, count=n),
+            np.fromiter((utils.toEpochMicros(bid._time_received) for bid in bids), dtype=np.int64, count=n),
+            np.fromiter((bid._active for bid in bids), dtype=np.bool_, count=n))
+
+    @staticmethod
+    def from_epoch_micros_dicts(bid_dicts: List[Dict]) -> BidColumns:
+        """from dicts shaped like Bid.convert_to_dict_w_epoch_micros() (e.g. stored documents); creates no datetimes."""
+        n = len(bid_dicts)
+        return BidColumns(
+            [bid["bid_id"] for bid in bid_dicts],
+            _intern(bid["item_id"] for bid in bid_dicts),
+            _intern(bid["bidder_user_id"] for bid in bid_dicts),
+            np.fromiter((bid["amount_in_cents"] for bid in bid_dicts), dtype=np.int64, count=n),
+            np.fromiter((bid["time_received_us"] for bid in bid_dicts), dtype=np.int64, count=n),
+            np.fromiter((bid["active"] for bid in bid_dicts), dtype=np.bool_, count=n))
+
+    def __len__(self) -> int:
+        return len(self._bid_ids)
+
+    def times_received_us(self) -> np.ndarray:
+        return self._times_received_us
+
+    def amounts_in_cents(self) -> np.ndarray:
+        return self._amounts_in_cents
+
+    def bid(self, i: int) -> Bid:
+        return Bid(self._bid_ids[i], self._item_ids[self._item_id_codes[i]], self._bidder_user_ids[self._bidder_user_id_codes[i]],
+                   int(self._amounts_in_cents[i]), utils.toDatetimeFromEpochMicros(int(self._times_received_us[i])), bool(self._active[i]))
+
+    def to_bids(self, indices: Optional[Iterable[int]]=None) -> List[Bid]:
+        """the bids (or those at indices, in that order) as Bid objects."""
+        indices = range(len(self)) if indices is None else [int(i) for i in indices]
+        times = utils.toDatetimesFromEpochMicros(self._times_received_us[i].item() for i in indices)
+        item_ids, bidder_user_ids = self._item_ids, self._bidder_user_ids
+        return [Bid(self._bid_ids[i], item_ids[self._item_id_codes[i]], bidder_user_ids[self._bidder_user_id_codes[i]],
+                    self._amounts_in_cents[i].item(), time, self._active[i].item()) for i, time in zip(indices, times)]
+
+    def max_bid_index(self) -> Optional[int]:
+        """index of the highest bid (the first one, on ties), or None if there are none."""
+        return int(np.argmax(self._amounts_in_cents)) if len(self) else None
+
+    def last_active_bid_index(self) -> Optional[int]:
+        """index of the most recently received active bid (the last one in list order, on ties), or None."""
+        if not self._active.any():
+            return None
+        order = np.argsort(self._times_received_us, kind="stable")
+        active_in_time_order = np.flatnonzero(self._active[order])
+        return int(order[active_in_time_order[-1]])
+
+    def bidder_user_ids(self) -> List[str]:
+        """the bidder of every bid."""
+        bidder_user_ids = self._bidder_user_ids
+        return [bidder_user_ids[code] for code in self._bidder_user_id_codes.tolist()]
+
+    def num_bidders(self) -> int:
+        """number of distinct bidders."""
+        return len(self._bidder_user_ids)
+
+    def intervals_us(self) -> np.ndarray:
+        """microseconds between consecutive bids, in time order."""
+        return np.diff(np.sort(self._times_received_us))
+
+    def convert_to_dicts(self) -> List[Dict]:
+        """[bid.convert_to_dict() for bid in to_bids()], without creating the Bid objects."""
+        times = utils.toSQLTimestamp6Reprs(utils.toDatetimesFromEpochMicros(self._times_received_us.tolist()))
+        return [{
+            'bid_id': bid_id,
+            'item_id': self._item_ids[item_code],
+            'bidder_user_id': self._bidder_user_ids[bidder_code],
+            'amount_in_cents': amount,
+            'time_received': time,
+            'active': active,
+        } for bid_id, item_code, bidder_code, amount, time, active in zip(self._bid_ids, self._item_id_codes.tolist(), self._bidder_user_id_codes.tolist(),
+                                                                             self._amounts_in_cents.tolist(), times, self._active.tolist())]
+
+    def convert_to_epoch_micros_dicts(self) -> List[Dict]:
+        """[bid.convert_to_dict_w_epoch_micros() for bid in to_bids()], without creating the Bid objects."""
+        return [{
+            'bid_id': bid_id,
+            'item_id': self._item_ids[item_code],
+            'bidder_user_id': self._bidder_user_ids[bidder_code],
+            'amount_in_cents': amount,
+            'time_received_us': time_us,
+            'active': active,
+        } for bid_id, item_code, bidder_code, amount, time_us, active in zip(self._bid_ids, self._item_id_codes.tolist(), self._bidder_user_id_codes.tolist(),
+                                                                                self._amounts_in_cents.tolist(), self._times_received_us.tolist(), self._active.tolist())]
+
+    def nbytes(self) -> int:
+        """approximate memory held by the columns (arrays, plus the id strings)."""
+        arrays = (self._item_id_codes, self._bidder_user_id_codes, self._amounts_in_cents, self._times_received_us, self._active)
+        strings = self._bid_ids + self._item_ids + self._bidder_user_ids
+        return sum(array.nbytes for array in arrays) + sum(sys.getsizeof(s) for s in strings) + 8*len(strings)
+
+def _intern(values: Iterable[str]) -> Tuple[List[str], np.ndarray]:
+    """(distinct values in first-seen order, int32 index into them for every value)."""
+    distinct : Dict[str, int] = dict()
+    codes = [distinct.setdefault(value, len(distinct)) for value in values]
+    return list(distinct), np.array(codes, dtype=np.int32)
@@ -1,18 +1,30 @@
 from __future__ import annotations
 import base64
 import datetime
+import hashlib
+import json
 from io import BytesIO
-from typing import List, Optional, Dict, Tuple
+from typing import List, Optional, Dict, Tuple, Union
 
 from matplotlib.figure import Figure
 from domain.bid import *
+from domain.bid_columns import BidColumns
+from domain.auction_metrics import AuctionMetrics
 from infrastructure import utils
+from infrastructure.downsample import lttbIndices
 
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+DEFAULT_CHART_MAX_POINTS = 2000 # bids drawn per bid history chart/series; longer histories are downsampled
 
 class ClosedAuction(object):
 
+    # no per-instance __dict__ (repositories, caches and range queries hold many auctions)
+    __slots__ = ("_item_id", "_start_price_in_cents", "_start_time", "_end_time", "_cancellation_time", "_finalized_time",
+                 "_bid_list", "_bid_columns", "_winning_bid", "_metrics", "_seller_user_id", "_content_hash")
+
     def __init__(
         self,
         item_id : str,
@@ -21,9 +33,18 @@ class ClosedAuction(object):
         end_time : datetime.datetime,
         cancellation_time: Optional[datetime.datetime],
         finalized_time : datetime.datetime,
-        bids: List[Bid],
+        bids: Optional[Union[List[Bid], BidColumns]],
         winning_bid: Optional[Bid],
+        metrics: Optional[AuctionMetrics]=None,
+        seller_user_id: Optional[str]=None,
+        content_hash: Optional[str]=None,
         ) -> None:
+        """
+        bids may be given as a list of Bid objects or in columnar form (see BidColumns).
+        metrics, if given, are the ones previously derived from the bids (see metrics()).
+        seller_user_id is None for auctions stored before the seller was kept.
+        content_hash, if given, is the one previously computed from the full auction (see content_hash()).
+        """
 
         self._item_id = item_id
         self._start_price_in_cents = start_price_in_cents
@@ -31,8 +52,41 @@ class ClosedAuction(object):
         self._end_time = end_time
         self._cancellation_time = cancellation_time
         self._finalized_time = finalized_time
-        self._bids = bids
+        # None for both when loaded as a summary (without its bid history)
+        self._bid_list : Optional[List[Bid]] = None if isinstance(bids, BidColumns) else bids
+        self._bid_columns : Optional[BidColumns] = bids if isinstance(bids, BidColumns) else None
         self._winning_bid = winning_bid
+        self._metrics = metrics
+        self._seller_user_id = seller_user_id
+        self._content_hash = content_hash
+
+    @property
+    def _bids(self) -> Optional[List[Bid]]:
+        """the bids as Bid objects; for a columnar auction, created (once) on first use."""
+        if self._bid_list is None and self._bid_columns is not None:
+            self._bid_list = self._bid_columns.to_bids()
+        return self._bid_list
+
+    def bid_columns(self) -> Optional[BidColumns]:
+        """the bids in columnar form (built once, on first use), or None for a summary."""
+        if self._bid_columns is None and self._bid_list is not None:
+            self._bid_columns = BidColumns.from_bids(self._bid_list)
+        return self._bid_columns
+
+    def compact_bids(self):
+        """keeps only the columnar form of the bids, dropping the Bid objects (e.g. before caching the auction)."""
+        if self.bid_columns() is not None:
+            self._bid_list = None
+
+    def num_bids(self) -> Optional[int]:
+        if self._bid_list is not None:
+            return len(self._bid_list)
+        return len(self._bid_columns) if self._bid_columns is not None else None
+
+    def bid_intervals_us(self) -> np.ndarray:
+        """microseconds between consecutive bids (in time order)."""
+        columns = self.bid_columns()
+        return columns.intervals_us() if columns is not None else np.empty(0, dtype=np.int64)
 
     @staticmethod
     def create_from_data(data_dict : Dict) -> ClosedAuction:
@@ -45,59 +99,107 @@ class ClosedAuction(object):
             return self.infer_winning_bid()
 
     def infer_winning_bid(self) -> Optional[Bid]:
-        if len(self._bids) == 0 or self._cancellation_time is not None:
+        if not self.num_bids() or self._cancellation_time is not None:
             return None
-        
-        self._bids.sort(key=lambda x: x._time_received)
 
-        idx = len(self._bids) - 1 # last idx
-        while not self._bids[idx]._active:
-            idx-=1
-            if idx < 0:
-                return None
+        if self._bid_list is None: # columnar; no need to create every Bid
+            idx = self._bid_columns.last_active_bid_index()
+            return self._bid_columns.bid(idx) if idx is not None else None
 
-        return self._bids[idx]
+        # the most recently received active bid (the last one in list order, on ties); a
+        # single pass that leaves the bids in the order they were received in
+        winner = None
+        for bid in self._bid_list:
+            if bid._active and (winner is None or bid._time_received >= winner._time_received):
+                winner = bid
+        return winner
 
-    def __repr__(self) -> str:
+    def metrics(self) -> Optional[AuctionMetrics]:
+        """
+        the values derived from the bid history (winner, final price, bid counts, bid timing),
+        computed once, on first use. None for a summary loaded without them.
+        """
+        if self._metrics is None and self.has_bids():
+            self._metrics = self._compute_metrics()
+        return self._metrics
+
+    def _compute_metrics(self) -> AuctionMetrics:
         winning_bid = self.winning_bid()
-        win_price = winning_bid._amount_in_cents/100 if winning_bid is not None else 0
-        winning_bid_user_id : str = winning_bid._bidder_user_id if winning_bid is not None else "N/A"
+        final_price = winning_bid._amount_in_cents if winning_bid is not None else None
+        ratio = final_price/self._start_price_in_cents if final_price is not None and self._start_price_in_cents else None
+
+        times_us, _ = self._bid_history_arrays()
+        if self._bid_columns is not None:
+            num_unique_bidders = self._bid_columns.num_bidders()
+        else:
+            num_unique_bidders = len({bid._bidder_user_id for bid in self._bid_list})
+        first_bid_latency_us, bid_span_us = None, None
+        if len(times_us):
+            first_us, last_us = int(times_us.min()), int(times_us.max())
+            first_bid_latency_us = first_us - utils.toEpochMicros(self._start_time)
+            bid_span_us = last_us - first_us
+
+        return AuctionMetrics(winning_bid._bidder_user_id if winning_bid is not None else None, final_price, ratio,
+                              len(times_us), num_unique_bidders, first_bid_latency_us, bid_span_us, self._cancellation_time is not None)
+
+    def __repr__(self) -> str:
+        metrics = self.metrics()
+        if metrics is not None: # no need to look for the winner again
+            win_price, winning_bid_user_id = metrics._final_price_in_cents, metrics._winner_user_id
+        else:
+            winning_bid = self.winning_bid()
+            win_price = winning_bid._amount_in_cents if winning_bid is not None else None
+            winning_bid_user_id = winning_bid._bidder_user_id if winning_bid is not None else None
         args = f"itemID={self._item_id}, "
         args += "start_price=${:.2f}, ".format(self._start_price_in_cents/100)
-        args += "win_price=${:.2f}, ".format(win_price) if winning_bid is not None else "win_price=N/A, "
-        args += f"winner_user_id={winning_bid_user_id}, "
+        args += "win_price=${:.2f}, ".format(win_price/100) if win_price is not None else "win_price=N/A, "
+        args += f"winner_user_id={winning_bid_user_id if winning_bid_user_id is not None else 'N/A'}, "
         args += f"time_start={self._start_time}, "
         args += f"time_cancel={self._cancellation_time}, "
         args += f"time_end={self._end_time}, "
         args += f"time_finalized={self._finalized_time}, "
-        args += f"num_bids={len(self._bids)}, "
+        num_bids = self.num_bids()
+        if num_bids is None and metrics is not None: # a summary; its bids were counted when it was saved
+            num_bids = metrics._num_bids
+        args += f"num_bids={num_bids if num_bids is not None else 'N/A'}, "
         return "ClosedAuction(" + args + ")" 
 
+    def has_bids(self) -> bool:
+        """False if this auction was loaded as a summary, without its bid history."""
+        return self._bid_list is not None or self._bid_columns is not None
+
+    def without_bids(self) -> ClosedAuction:
+        """returns a summary copy of this auction that does not carry its bid history."""
+        return ClosedAuction(self._item_id,self._start_price_in_cents,self._start_time,self._end_time,self._cancellation_time,self._finalized_time,None,self._winning_bid,self.metrics(),self._seller_user_id,self.content_hash())
+
     def get_finalized_time(self) -> datetime.datetime :
         return self._finalized_time
 
     def get_end_time(self) -> datetime.datetime :
         return self._end_time
 
-    def show_bid_history(self, toSave: bool=False) -> Figure:
-
-        times = [bid._time_received for bid in self._bids]
-        for time in times:
-            print(time)
-        amounts = [bid._amount_in_cents/100 for bid in self._bids]
-
-        fig, ax = plt.subplots()
+    def show_bid_history(self, toSave: bool=False, max_points: Optional[int]=DEFAULT_CHART_MAX_POINTS) -> Figure:
+        """plots the bid history; histories longer than max_points bids are downsampled (see _bid_history_indices())."""
+
+        times_us, amounts_in_cents = self._bid_history_arrays()
+        indices = _bid_history_indices(times_us, amounts_in_cents, max_points)
+        if indices is None:
+            indices = np.arange(len(times_us))
+        times = utils.toDatetimesFromEpochMicros(times_us[indices].tolist())
+        amounts = (amounts_in_cents[indices]/100).tolist()
+
+        # a standalone Figure on its own Agg canvas, not pyplot's global figure manager: nothing
+        # keeps a reference to it once the caller drops it, and concurrent renders share no state
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
         ax.step(times, amounts, where='post', label='post')
         ax.plot(times, amounts, 'o--', color='grey', alpha=0.3)
         ax.grid()
 
-        max_bid : Bid = None
-        for bid in self._bids:
-            if not max_bid or bid._amount_in_cents > max_bid._amount_in_cents:
-                max_bid = bid
-            
-        highest_bid_offer_amount = max_bid._amount_in_cents/100 if max_bid else None
-        highest_bid_offer_amount_time = max_bid._time_received if max_bid else None
+        max_bid = int(np.argmax(amounts_in_cents)) if len(amounts_in_cents) else None # first occurrence on ties
+        highest_bid_offer_amount = amounts_in_cents[max_bid]/100 if max_bid is not None else None
+        highest_bid_offer_amount_time = utils.toDatetimeFromEpochMicros(int(times_us[max_bid])) if max_bid is not None else None
         ax.axvline(x = self._start_time, color = 'g', label = 'axvline - full height', ymin = 0, ymax = self._start_price_in_cents/100*1.25, linestyle = 'dashed')
         if self._cancellation_time:
             ax.axvline(x = self._cancellation_time, color = 'r', label = 'axvline - full height',ymin = 0, ymax = self._start_price_in_cents/100*1.25 , linestyle = 'dashed')
@@ -107,25 +209,70 @@ class ClosedAuction(object):
         ax.set_ylabel('bid offer amount [$]')
         ax.set_title(f'Auction for item "{self._item_id}"')
 
-        if max_bid:
+        if max_bid is not None:
             _annot_max(highest_bid_offer_amount_time,highest_bid_offer_amount,ax)
 
         ax.tick_params(axis='x', labelrotation = 45)
 
         if toSave:
-            plt.savefig(f'bid_history_itemid{self._item_id}.png',bbox_inches="tight")
+            fig.savefig(f'bid_history_itemid{self._item_id}.png',bbox_inches="tight")
 
         return fig
 
+    def bid_history_series(self, max_points: Optional[int]=DEFAULT_CHART_MAX_POINTS) -> Dict:
+        """
+        returns the data show_bid_history() plots, for clients that draw the chart themselves:
+        bid times (epoch microseconds) and amounts as parallel arrays (a step function, held
+        until the next bid), the highest bid (first one, on ties) and the start, cancellation
+        and end markers. histories longer than max_points bids are downsampled the same way
+        as the chart; num_bids is always the full count.
+        """
+        times, amounts = self._bid_history_arrays()
+
+        max_bid = None
+        if len(amounts):
+            i = int(np.argmax(amounts)) # first occurrence, like show_bid_history()
+            max_bid = {'time_us': int(times[i]), 'amount_in_cents': int(amounts[i])}
+
+        num_bids = len(times)
+        indices = _bid_history_indices(times, amounts, max_points)
+        if indices is not None:
+            times, amounts = times[indices], amounts[indices]
+
+        return {
+            'item_id': self._item_id,
+            'num_bids': num_bids,
+            'step': 'post',
+            'times_us': times.tolist(),
+            'amounts_in_cents': amounts.tolist(),
+            'max_bid': max_bid,
+            'start_price_in_cents': self._start_price_in_cents,
+            'markers': {
+                'start_time_us': utils.toEpochMicros(self._start_time),
+                'cancellation_time_us': utils.toEpochMicros(self._cancellation_time) if self._cancellation_time else None,
+                'end_time_us': utils.toEpochMicros(self._end_time),
+            },
+        }
+
+    def _bid_history_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(bid times as epoch microseconds, bid amounts in cents), in bid order."""
+        if self._bid_columns is not None:
+            return self._bid_columns.times_received_us(), self._bid_columns.amounts_in_cents()
+        bids = self._bid_list if self._bid_list is not None else []
+        times = np.fromiter((utils.toEpochMicros(bid._time_received) for bid in bids), dtype=np.int64, count=len(bids))
+        amounts = np.fromiter((bid._amount_in_cents for bid in bids), dtype=np.int64, count=len(bids))
+        return times, amounts
+
+    def render_bid_history_png(self, max_points: Optional[int]=DEFAULT_CHART_MAX_POINTS) -> bytes:
+        fig = self.show_bid_history(max_points=max_points)
+        tmpfile = BytesIO()
+        fig.savefig(tmpfile, format='png', bbox_inches="tight")
+        return tmpfile.getvalue()
+
     def generate_bid_history_as_html(self) -> Tuple[str, bool]:
 
         try: 
-            fig = self.show_bid_history(True)
-            tmpfile = BytesIO()
-            fig.savefig(tmpfile, format='png', bbox_inches="tight")
-            encoded = base64.b64encode(tmpfile.getvalue()).decode('utf-8')
-
-            html = '<img src=\'data:image/png;base64,{}\'>'.format(encoded)
+            html = bid_history_png_as_html(self.render_bid_history_png())
 
             return html, False
 
@@ -139,22 +286,40 @@ class ClosedAuction(object):
 
 
 
+    def content_hash(self) -> str:
+        """
+        sha256 (hex) of the auction's contents, including its bids. a closed auction never
+        changes, so this identifies anything derived from it (e.g. a rendered chart or an http
+        response). computed once; a summary carries the hash of the auction it was made from.
+        """
+        if self._content_hash is None:
+            canonical = json.dumps(self.convert_to_dict(), sort_keys=True, separators=(",", ":"))
+            self._content_hash = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        return self._content_hash
+
     def convert_to_dict(self) -> Dict:
         """
         returns a json-like representation of the internal contents
-        of a ClosedAuction.
+        of a ClosedAuction. 'bids' is omitted for summaries (see has_bids()).
         """
 
-        return {
+        data = {
             'item_id': self._item_id,
+            'seller_user_id': self._seller_user_id,
             'start_price_in_cents': self._start_price_in_cents,
             'start_time': utils.toSQLTimestamp6Repr(self._start_time),
             'end_time': utils.toSQLTimestamp6Repr(self._end_time),
             'cancellation_time': utils.toSQLTimestamp6Repr(self._cancellation_time) if self._cancellation_time else "",
             'finalized_time': utils.toSQLTimestamp6Repr(self._finalized_time),
-            'bids': [bid.convert_to_dict() for bid in self._bids],
-            'winning_bid': self._winning_bid.convert_to_dict() if self._winning_bid else None,
         }
+        if self._bid_list is not None:
+            data['bids'] = [bid.convert_to_dict() for bid in self._bid_list]
+        elif self._bid_columns is not None:
+            data['bids'] = self._bid_columns.convert_to_dicts()
+        data['winning_bid'] = self._winning_bid.convert_to_dict() if self._winning_bid else None
+        metrics = self.metrics()
+        data['metrics'] = metrics.convert_to_dict() if metrics is not None else None
+        return data
 
     def convert_to_dict_w_datetimes(self) -> Dict:
         """
@@ -164,6 +329,7 @@ class ClosedAuction(object):
 
         return {
             'item_id': self._item_id,
+            'seller_user_id': self._seller_user_id,
             'start_price_in_cents': self._start_price_in_cents,
             'start_time': self._start_time,
             'end_time': self._end_time,
@@ -177,6 +343,30 @@ class ClosedAuction(object):
             'winning_bid': self._winning_bid.convert_to_dict_w_datetimes() if self._winning_bid else None,
         }
 
+    def convert_to_dict_w_epoch_micros(self) -> Dict:
+        """
+        returns a json-like representation of the internal contents
+        of a ClosedAuction. keeps times as integer microseconds since
+        the epoch (the representation it is persisted in). the derived
+        metrics (see metrics()) are top-level fields, so they can be indexed.
+        """
+
+        data = {
+            'item_id': self._item_id,
+            'seller_user_id': self._seller_user_id,
+            'start_price_in_cents': self._start_price_in_cents,
+            'start_time_us': utils.toEpochMicros(self._start_time),
+            'end_time_us': utils.toEpochMicros(self._end_time),
+            'cancellation_time_us': utils.toEpochMicros(self._cancellation_time) if self._cancellation_time else None,
+            'finalized_time_us': utils.toEpochMicros(self._finalized_time) if self._finalized_time else None,
+            'bids': self._bid_columns.convert_to_epoch_micros_dicts() if self._bid_list is None else [bid.convert_to_dict_w_epoch_micros() for bid in self._bid_list],
+            'winning_bid': self._winning_bid.convert_to_dict_w_epoch_micros() if self._winning_bid else None,
+        }
+        metrics = self.metrics()
+        if metrics is not None:
+            data.update(metrics.convert_to_dict())
+        return data
+
     @staticmethod
     def generate_auction(bids: List[Bid],  itemid: int, time_start: datetime.datetime, duration: datetime.timedelta, winning_bid: Optional[Bid]) -> ClosedAuction:
         
@@ -186,14 +376,29 @@ class ClosedAuction(object):
         time_finalized = time_end + datetime.timedelta(minutes=1)
         return ClosedAuction(item_id,start_price_in_cents,time_start,time_end,None,time_finalized,bids,winning_bid)
 
-def _annot_max(xmax,ymax, ax=None):
+def _annot_max(xmax,ymax, ax: Axes):
 
     text= "time={}, ${:.2f}".format(xmax, ymax)
-    if not ax:
-        ax=plt.gca()
     bbox_props = dict(boxstyle="square,pad=0.3", fc="w", ec="k", lw=0.72)
     arrowprops=dict(arrowstyle="->",connectionstyle="angle,angleA=0,angleB=45")
     kw = dict(xycoords='data',textcoords="axes fraction",
             arrowprops=arrowprops, bbox=bbox_props, ha="right", va="top")
     ax.annotate(text, xy=(xmax, ymax), xytext=(0.8,0.8), **kw)
 
+
+def _bid_history_indices(times_us: np.ndarray, amounts_in_cents: np.ndarray, max_points: Optional[int]) -> Optional[np.ndarray]:
+    """
+    indices of the bids to draw when there are more than max_points of them (None means draw
+    them all): an lttb downsample of the history in time order that always keeps the highest
+    bid, so the chart's shape and its max annotation survive.
+    """
+    if not max_points or len(times_us) <= max_points:
+        return None
+    order = np.argsort(times_us, kind="stable")
+    highest = int(np.argmax(amounts_in_cents))
+    keep = np.flatnonzero(order == highest)
+    return order[lttbIndices(times_us[order], amounts_in_cents[order], max_points, keep=keep)]
+
+def bid_history_png_as_html(png: bytes) -> str:
+    encoded = base64.b64encode(png).decode('utf-8')
+    return '<img src=\'data:image/png;base64,{}\'>'.format(encoded)
@@ -0,0 +1,26 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+class RenderStore(ABC):
+    """persistent store of rendered charts (png bytes), keyed by a render key (see RenderCache)."""
+
+    @abstractmethod
+    def get_render(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def save_render(self, key: str, item_id: str, png: bytes):
+        pass
+
+
+class InMemoryRenderStore(RenderStore):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._renders: Dict[str,bytes] = dict()
+
+    def get_render(self, key: str) -> Optional[bytes]:
+        return self._renders.get(key)
+
+    def save_render(self, key: str, item_id: str, png: bytes):
+        self._renders[key] = png
@@ -0,0 +1,32 @@
+from domain.render_store import *
+import datetime
+
+from pymongo.database import Database, Collection
+
+RENDER_COLLECTION_NAME = "rendered_charts"
+
+class MongoDbRenderStore(RenderStore):
+    """
+    keeps rendered charts in their own collection, next to the auctions. takes the
+    database of an existing MongoDbAuctionRepository so both share one connection pool.
+    """
+
+    def __init__(self, database: Database) -> None:
+        self.my_db = database
+
+    def _get_render_collection(self) -> Collection:
+        return self.my_db[RENDER_COLLECTION_NAME]
+
+    def get_render(self, key: str) -> Optional[bytes]:
+        document = self._get_render_collection().find_one({"_id": key}, {"png": 1})
+        return bytes(document["png"]) if document else None
+
+    def save_render(self, key: str, item_id: str, png: bytes):
+        document = {
+            "_id": key,
+            "item_id": item_id,
+            "png": png,
+            "rendered_at": datetime.datetime.now(datetime.timezone.utc),
+        }
+        # renders of the same key are interchangeable; the last write wins
+        self._get_render_collection().replace_one({"_id": key}, document, upsert=True)
@@ -20,3 +20,35 @@ class TestBid:
     def test_display(cls):
         print(cls.auction)
 
+
+class TestBidHistorySeries:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        amounts = [3500, 4000, 4000, 3900]
+        bids = [Bid(str(i), "200", "bidder", amount, cls.start + datetime.timedelta(seconds=i), True) for i, amount in enumerate(amounts)]
+        cls.auction = ClosedAuction.generate_auction(bids, 200, cls.start, datetime.timedelta(minutes=30), None)
+
+    def test_series(cls):
+        start_us = 1647475200130002
+        series = cls.auction.bid_history_series()
+        assert series['times_us'] == [start_us, start_us + 1_000_000, start_us + 2_000_000, start_us + 3_000_000]
+        assert series['amounts_in_cents'] == [3500, 4000, 4000, 3900]
+        assert series['max_bid'] == {'time_us': start_us + 1_000_000, 'amount_in_cents': 4000}
+        assert series['markers'] == {'start_time_us': start_us, 'cancellation_time_us': None, 'end_time_us': start_us + 30*60*1_000_000}
+        json.dumps(series) # plain python types only
+
+    def test_series_without_bids(cls):
+        series = ClosedAuction.generate_auction([], 201, cls.start, datetime.timedelta(minutes=30), None).bid_history_series()
+        assert series['times_us'] == [] and series['amounts_in_cents'] == []
+        assert series['max_bid'] is None
+
+    def test_long_series_is_downsampled_keeping_the_highest_bid(cls):
+        amounts = [3500 + (i*7919) % 5000 for i in range(5000)]
+        bids = [Bid(str(i), "202", "bidder", amount, cls.start + datetime.timedelta(seconds=i), True) for i, amount in enumerate(amounts)]
+        series = ClosedAuction.generate_auction(bids, 202, cls.start, datetime.timedelta(hours=2), None).bid_history_series(max_points=100)
+        assert series['num_bids'] == 5000
+        assert len(series['times_us']) <= 101
+        assert max(series['amounts_in_cents']) == series['max_bid']['amount_in_cents'] == max(amounts)
+        assert series['times_us'] == sorted(series['times_us'])
@@ -0,0 +1,156 @@
+from typing import List
+import pytest
+import random
+import datetime
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from domain.auction_repository import InMemoryAuctionRepository
+
+class TestInMemoryAuctionRepository:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        cls.repo = InMemoryAuctionRepository()
+        # 25 auctions; every 3 consecutive item ids share an end time to exercise the item_id tie-break
+        for i in range(25):
+            duration = datetime.timedelta(minutes=30*(i//3))
+            cls.repo.save_auction(ClosedAuction.generate_auction([Bid.generate_basic_bid(i,1000+i)],1000+i,cls.start,duration,None))
+
+    def test_limit_returns_most_recent_in_ascending_order(cls):
+        auctions = cls.repo.get_auctions(cls.start, cls.start + datetime.timedelta(days=1), limit=4)
+        assert [auction._item_id for auction in auctions] == ["1021", "1022", "1023", "1024"]
+
+    def test_paging_visits_every_auction_once(cls):
+        left, right = cls.start, cls.start + datetime.timedelta(hours=3)
+        expected = [auction._item_id for auction in cls.repo.get_auctions(left, right)]
+
+        seen : List[str] = []
+        before = None
+        while True:
+            page = cls.repo.get_auctions(left, right, limit=4, before=before)
+            if not page:
+                break
+            seen = [auction._item_id for auction in page] + seen
+            before = (page[0].get_end_time(), page[0]._item_id)
+
+        assert seen == expected
+        assert len(expected) == 21 # end times 0h..3h inclusive
+
+    def test_window_bounds_are_inclusive(cls):
+        auctions = cls.repo.get_auctions(cls.start + datetime.timedelta(minutes=30), cls.start + datetime.timedelta(minutes=60))
+        assert [auction._item_id for auction in auctions] == ["1003", "1004", "1005", "1006", "1007", "1008"]
+
+    def test_matches_a_full_scan_after_resaves(cls):
+        rng = random.Random(51205)
+        repo = InMemoryAuctionRepository()
+        for i in range(300):
+            duration = datetime.timedelta(minutes=rng.randrange(100))
+            repo.save_auction(ClosedAuction.generate_auction([],rng.randrange(200),cls.start,duration,None)) # some item ids are re-saved with a new end time
+
+        def full_scan(left, right, limit, before):
+            auctions = sorted((auction for auction in repo._auctions.values() if left <= auction.get_end_time() <= right), key=lambda a: (a.get_end_time(), a._item_id))
+            if before is not None:
+                auctions = [auction for auction in auctions if (auction.get_end_time(), auction._item_id) < before]
+            return auctions[-limit:] if limit else auctions
+
+        assert len(repo._keys) == len(repo._auctions)
+        for _ in range(50):
+            left = cls.start + datetime.timedelta(minutes=rng.randrange(100))
+            right = left + datetime.timedelta(minutes=rng.randrange(50))
+            limit = rng.choice([None, 1, 5])
+            before = rng.choice([None, (left + datetime.timedelta(minutes=10), "150")])
+            expected = [auction._item_id for auction in full_scan(left, right, limit, before)]
+            assert [auction._item_id for auction in repo.get_auctions(left, right, limit=limit, before=before)] == expected
+
+    def test_ranked_by_a_metric(cls):
+        # every basic bid is $40, so ties are broken by item_id (descending)
+        auctions = cls.repo.get_auctions_ranked_by("final_price_in_cents", limit=3, include_bids=False)
+        assert [auction._item_id for auction in auctions] == ["1024", "1023", "1022"]
+        assert not auctions[0].has_bids() and auctions[0].metrics()._num_bids == 1
+        assert len(cls.repo.get_auctions_ranked_by("num_bids")) == 25
+
+    def test_aggregate_per_hour(cls):
+        aggregates = cls.repo.aggregate_auctions(cls.start, cls.start + datetime.timedelta(minutes=90), 3_600_000_000)
+        # end times 0:00, 0:30, 1:00 and 1:30 (plus 130002us), 3 auctions each
+        assert [aggregate["num_auctions"] for aggregate in aggregates] == [6, 6]
+        assert aggregates[0] == {
+            'bucket_start_us': aggregates[0]['bucket_start_us'],
+            'num_auctions': 6,
+            'num_sold': 6,
+            'num_cancelled': 0,
+            'num_bids': 6,
+            'gmv_in_cents': 6*4000,
+            'median_final_price_in_cents': 4000,
+        }
+        assert aggregates[1]['bucket_start_us'] - aggregates[0]['bucket_start_us'] == 3_600_000_000
+
+    def test_rollups_count_each_auction_once(cls):
+        repo = InMemoryAuctionRepository()
+        auctions = [ClosedAuction.generate_auction([Bid.generate_basic_bid(i,i)] if i % 2 else [],i,cls.start,datetime.timedelta(minutes=20*i),None) for i in range(6)]
+        for auction in auctions + auctions[:3]: # the first three are delivered twice
+            repo.save_auction(auction)
+
+        hourly = repo.get_rollups("hour", None, None)
+        assert [rollup["num_auctions"] for rollup in hourly] == [3, 3] # end times 0:00..1:40
+        assert hourly[0]["num_sold"] == 1 and hourly[0]["gmv_in_cents"] == 4000 and hourly[0]["max_final_price_in_cents"] == 4000
+        daily = repo.get_rollups("day", cls.start + datetime.timedelta(hours=1), None) # the bucket the left bound falls in is included
+        assert len(daily) == 1 and daily[0]["num_auctions"] == 6 and daily[0]["num_bids"] == 3
+
+    def test_auctions_by_bidder(cls):
+        repo = InMemoryAuctionRepository()
+        def bid(i, item_id, bidder):
+            return Bid(str(i), str(item_id), bidder, 4000+i, cls.start, True)
+        for i in range(10): # "even" bids on the even items, "all" on every one
+            bids = [bid(2*i, i, "all")] + ([bid(2*i+1, i, "even")] if i % 2 == 0 else [])
+            repo.save_auction(ClosedAuction.generate_auction(bids, i, cls.start, datetime.timedelta(minutes=i), None))
+
+        assert [auction._item_id for auction in repo.get_auctions_by_bidder("even", None, None)] == ["0", "2", "4", "6", "8"]
+        page = repo.get_auctions_by_bidder("all", None, None, limit=3)
+        assert [auction._item_id for auction in page] == ["7", "8", "9"]
+        before = (page[0].get_end_time(), page[0]._item_id)
+        assert [auction._item_id for auction in repo.get_auctions_by_bidder("all", None, None, limit=3, before=before)] == ["4", "5", "6"]
+
+        # a re-save with other bids moves the auction between bidders
+        repo.save_auction(ClosedAuction.generate_auction([bid(99, 4, "all")], 4, cls.start, datetime.timedelta(minutes=4), None))
+        assert [auction._item_id for auction in repo.get_auctions_by_bidder("even", None, None)] == ["0", "2", "6", "8"]
+        assert repo.get_auctions_by_bidder("nobody", None, None) == []
+
+    def test_auctions_by_seller(cls):
+        repo = InMemoryAuctionRepository()
+        def auction(i, seller, bids):
+            end = cls.start + datetime.timedelta(minutes=i)
+            return ClosedAuction(str(i), 3400, cls.start, end, None, end, bids, None, seller_user_id=seller)
+        for i in range(6): # "a" sells the even items (and sells item 0 only), "b" the odd ones
+            bids = [Bid(str(i), str(i), "bidder", 5000, cls.start, True)] if i in (0, 1, 3) else []
+            repo.save_auction(auction(i, "a" if i % 2 == 0 else "b", bids))
+        repo.save_auction(auction(6, None, [])) # stored before sellers were recorded
+
+        assert [a._item_id for a in repo.get_auctions_by_seller("a", None, None)] == ["0", "2", "4"]
+        page = repo.get_auctions_by_seller("b", None, None, limit=2)
+        assert [a._item_id for a in page] == ["3", "5"]
+        assert [a._item_id for a in repo.get_auctions_by_seller("b", None, None, before=(page[0].get_end_time(), page[0]._item_id))] == ["1"]
+
+        [a_stats] = repo.aggregate_auctions(None, None, 86_400_000_000, seller_user_id="a")
+        [b_stats] = repo.aggregate_auctions(None, None, 86_400_000_000, seller_user_id="b")
+        assert (a_stats["num_auctions"], a_stats["num_sold"]) == (3, 1)
+        assert (b_stats["num_auctions"], b_stats["num_sold"], b_stats["gmv_in_cents"]) == (3, 2, 10000)
+
+        # a re-save moves the auction to its new seller
+        repo.save_auction(auction(4, "b", []))
+        assert [a._item_id for a in repo.get_auctions_by_seller("a", None, None)] == ["0", "2"]
+        assert repo.get_auctions_by_seller("nobody", None, None) == []
+
+    def test_content_hash(cls):
+        repo = InMemoryAuctionRepository()
+        bids = [Bid("1", "7", "a", 4000, cls.start, True), Bid("2", "7", "b", 4100, cls.start, True)]
+        auction = ClosedAuction.generate_auction(bids, 7, cls.start, datetime.timedelta(minutes=1), None)
+        repo.save_auction(auction)
+
+        content_hash = repo.get_auction_content_hash("7")
+        assert content_hash == auction.content_hash()
+        # a summary carries the hash of the whole auction, not of its own (bid-less) contents
+        assert repo.get_auction("7", include_bids=False).content_hash() == content_hash
+        assert repo.get_auction_content_hash("8") is None
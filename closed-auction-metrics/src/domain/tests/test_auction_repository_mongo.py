@@ -0,0 +1,247 @@
+from typing import Any, Dict, List, Optional
+import pytest
+import datetime
+import math
+import random
+from pymongo.errors import AutoReconnect, BulkWriteError
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from domain.auction_repository import AuctionWriteError, TransientWriteError, InMemoryAuctionRepository
+from domain.auction_repository_mongo import MongoDbAuctionRepository
+
+class FakeAuctionCollection:
+    """the part of a pymongo Collection that save_auctions() uses, over a dict of documents by _id."""
+
+    def __init__(self, rejected_ids: List[str]=()) -> None:
+        self.documents : Dict[str, Dict] = dict()
+        self._rejected_ids = rejected_ids # writes to these fail, like a duplicate key
+
+    def bulk_write(self, requests, ordered=True):
+        write_errors = []
+        for i, request in enumerate(requests):
+            _id = request._filter["_id"]
+            if _id in self._rejected_ids:
+                write_errors.append({"index": i, "code": 11000, "errmsg": "E11000 duplicate key error"})
+                continue
+            if _id not in self.documents:
+                self.documents[_id] = {"_id": _id, **request._doc["$setOnInsert"]}
+            self.documents[_id].update(request._doc["$set"])
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors})
+
+    def _matching(self, query_doc: Dict) -> List[Dict]:
+        ids = query_doc["_id"]["$in"]
+        return [document for _id, document in self.documents.items() if _id in ids and document.get("rolled_up") == query_doc["rolled_up"]]
+
+    def find(self, query_doc: Dict, projection: Dict):
+        return [{"_id": document["_id"]} for document in self._matching(query_doc)]
+
+    def update_many(self, query_doc: Dict, update_doc: Dict):
+        for document in self._matching(query_doc):
+            document.update(update_doc["$set"])
+
+    def aggregate(self, pipeline: List[Dict], allowDiskUse: bool=False) -> List[Dict]:
+        """runs the stages (and expression operators) of _aggregate_auctions_pipeline() the way mongo does."""
+        documents = list(self.documents.values())
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                documents = [document for document in documents if _matches(document, spec)]
+            elif name == "$group":
+                documents = _group(documents, spec)
+            elif name == "$sort":
+                for path, direction in reversed(list(spec.items())): # stable sorts, least significant key first
+                    documents.sort(key=lambda document: _sort_key(_get_path(document, path)), reverse=direction < 0)
+            elif name == "$project":
+                documents = [_project(document, spec) for document in documents]
+            else:
+                raise NotImplementedError(name)
+        return documents
+
+def _get_path(document: Dict, path: str) -> Any:
+    value = document
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def _sort_key(value: Any):
+    return (value is not None, value if value is not None else 0) # null (or missing) sorts first, as in mongo
+
+def _matches(document: Dict, query_doc: Dict) -> bool:
+    for path, condition in query_doc.items():
+        value = _get_path(document, path)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if value is None or not {"$gte": value >= operand, "$lte": value <= operand, "$gt": value > operand, "$lt": value < operand}[operator]:
+                return False
+    return True
+
+def _evaluate(expression: Any, document: Dict, variables: Dict[str, Any]) -> Any:
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, path = expression[2:].partition(".")
+        return _get_path(variables[name], path) if path else variables[name]
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_path(document, expression[1:])
+    if isinstance(expression, list):
+        return [_evaluate(item, document, variables) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if not (len(expression) == 1 and next(iter(expression)).startswith("$")): # an object literal
+        return {key: _evaluate(value, document, variables) for key, value in expression.items()}
+    (operator, operand), = expression.items()
+    if operator == "$let":
+        return _evaluate(operand["in"], document, {**variables, **{name: _evaluate(value, document, variables) for name, value in operand["vars"].items()}})
+    if operator == "$cond":
+        condition, then, otherwise = operand
+        return _evaluate(then if _evaluate(condition, document, variables) else otherwise, document, variables)
+    if operator == "$filter":
+        return [item for item in _evaluate(operand["input"], document, variables) if _evaluate(operand["cond"], document, {**variables, "this": item})]
+    if operator == "$reduce":
+        value = _evaluate(operand["initialValue"], document, variables)
+        for item in _evaluate(operand["input"], document, variables):
+            value = _evaluate(operand["in"], document, {**variables, "this": item, "value": value})
+        return value
+    args = _evaluate(operand, document, variables)
+    numbers = [arg for arg in args if arg is not None] if isinstance(args, list) else None
+    if operator in ("$subtract", "$mod", "$multiply", "$add", "$divide") and len(numbers) < len(args):
+        return None # arithmetic on null is null
+    return {
+        "$eq": lambda: args[0] == args[1],
+        "$ne": lambda: args[0] != args[1],
+        "$gt": lambda: _sort_key(args[0]) > _sort_key(args[1]),
+        "$and": lambda: all(args),
+        "$ifNull": lambda: args[0] if args[0] is not None else args[1],
+        "$subtract": lambda: args[0] - args[1],
+        "$mod": lambda: math.fmod(args[0], args[1]) if isinstance(args[0], float) else args[0] % args[1],
+        "$multiply": lambda: math.prod(args),
+        "$add": lambda: sum(args),
+        "$divide": lambda: args[0] / args[1],
+        "$floor": lambda: math.floor(args),
+        "$avg": lambda: sum(numbers) / len(numbers) if numbers else None,
+    }[operator]()
+
+def _group(documents: List[Dict], spec: Dict) -> List[Dict]:
+    groups : Dict[Any, Dict] = dict()
+    for document in documents: # groups (and $push) keep the order documents arrive in
+        _id = _evaluate(spec["_id"], document, {})
+        key = tuple(sorted(_id.items())) if isinstance(_id, dict) else _id
+        group = groups.setdefault(key, {"_id": _id})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, operand), = accumulator.items()
+            value = _evaluate(operand, document, {})
+            if operator == "$sum":
+                group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0) # non-numbers are skipped
+            elif operator == "$push":
+                group.setdefault(field, []).append(value)
+            else:
+                raise NotImplementedError(operator)
+    return list(groups.values())
+
+def _project(document: Dict, spec: Dict) -> Dict:
+    projected = {"_id": document["_id"]} if spec.get("_id", 1) else dict()
+    for field, expression in spec.items():
+        if field == "_id":
+            continue
+        projected[field] = document.get(field) if expression == 1 else _evaluate(expression, document, {})
+    return projected
+
+class TestMongoDbAuctionRepositoryRollups:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+
+    def repository(cls, collection: FakeAuctionCollection, failing_rollup_writes: int=0) -> MongoDbAuctionRepository:
+        """a repository over collection (no server), recording the item ids it adds to the rollups."""
+        repo = MongoDbAuctionRepository.__new__(MongoDbAuctionRepository)
+        repo._get_auction_collection = lambda: collection
+        repo.rolled_up = []
+        def update_rollups(auctions: List[ClosedAuction]):
+            if len(repo.rolled_up) < failing_rollup_writes:
+                repo.rolled_up.append(None)
+                raise AutoReconnect("connection reset")
+            repo.rolled_up.extend(auction._item_id for auction in auctions)
+        repo._update_rollups = update_rollups
+        return repo
+
+    def auctions(cls, *item_ids: int) -> List[ClosedAuction]:
+        return [ClosedAuction.generate_auction([Bid.generate_basic_bid(item_id, item_id)], item_id, cls.start, datetime.timedelta(minutes=1), None) for item_id in item_ids]
+
+    def test_failed_rollup_write_is_counted_on_redelivery(cls):
+        collection = FakeAuctionCollection()
+        repo = cls.repository(collection, failing_rollup_writes=1)
+        with pytest.raises(TransientWriteError): # the auctions are stored, their rollup update is lost
+            repo.save_auctions(cls.auctions(1, 2))
+        assert [document["rolled_up"] for document in collection.documents.values()] == [False, False]
+
+        repo.save_auctions(cls.auctions(1, 2)) # redelivery; no longer upserts, but still pending
+        assert repo.rolled_up == [None, "1", "2"]
+        repo.save_auctions(cls.auctions(2, 3)) # and never counted again
+        assert repo.rolled_up == [None, "1", "2", "3"]
+        assert all(document["rolled_up"] for document in collection.documents.values())
+
+    def test_rejected_auctions_leave_the_rest_of_the_batch_counted(cls):
+        repo = cls.repository(FakeAuctionCollection(rejected_ids=["5"]))
+        with pytest.raises(AuctionWriteError) as error:
+            repo.save_auctions(cls.auctions(4, 5, 6))
+        assert error.value.failed_item_ids == {"5"}
+        assert repo.rolled_up == ["4", "6"]
+
+class TestMongoDbAuctionRepositoryAggregates:
+    """runs _aggregate_auctions_pipeline() over FakeAuctionCollection and compares it with InMemoryAuctionRepository."""
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        cls.hour_us = 3_600_000_000
+
+    def repositories(cls, auctions: List[ClosedAuction]):
+        collection = FakeAuctionCollection()
+        repo = MongoDbAuctionRepository.__new__(MongoDbAuctionRepository)
+        repo._get_auction_collection = lambda: collection
+        repo._update_rollups = lambda auctions: None
+        repo.save_auctions(auctions)
+        in_memory = InMemoryAuctionRepository()
+        in_memory.save_auctions(auctions)
+        return repo, in_memory
+
+    def auction(cls, item_id: int, hour: int, final_price_in_cents: Optional[int], seller_user_id: str="asclark109") -> ClosedAuction:
+        """an auction ending in the given hour; unsold (no bids) if final_price_in_cents is None."""
+        end = cls.start + datetime.timedelta(hours=hour, minutes=item_id % 50)
+        bids = [Bid(str(item_id), str(item_id), "katharine2", final_price_in_cents, end, True)] if final_price_in_cents is not None else []
+        return ClosedAuction(str(item_id), 1000, cls.start, end, None, end, bids, None, seller_user_id=seller_user_id)
+
+    def test_median(cls):
+        prices_by_hour = {
+            0: [300, 100, 200],                 # odd count
+            1: [900, 500, 700, 500],            # even count, with a repeated price
+            2: [400, 400, 400, None, None],     # one repeated price, and unsold auctions
+            3: [None, None],                    # nothing sold
+            4: [250],
+            5: [800, None, 100, 100, 800, 100, 800], # even count; both middle prices are repeated
+        }
+        auctions = [cls.auction(10*hour + i, hour, price) for hour, prices in prices_by_hour.items() for i, price in enumerate(prices)]
+        repo, in_memory = cls.repositories(auctions)
+
+        buckets = repo.aggregate_auctions(None, None, cls.hour_us)
+        assert buckets == in_memory.aggregate_auctions(None, None, cls.hour_us)
+        assert [bucket["median_final_price_in_cents"] for bucket in buckets] == [200, 600, 400, None, 250, 450]
+        assert [bucket["num_sold"] for bucket in buckets] == [3, 4, 3, 0, 1, 6]
+        assert [bucket["num_auctions"] for bucket in buckets] == [3, 4, 5, 2, 1, 7]
+        assert buckets[1]["gmv_in_cents"] == 2600
+
+    def test_matches_in_memory(cls):
+        rng = random.Random(7)
+        auctions = [cls.auction(i, rng.randrange(6), rng.choice([None, 100*rng.randrange(1, 9)]), seller_user_id=f"s{rng.randrange(3)}") for i in range(300)]
+        repo, in_memory = cls.repositories(auctions)
+        left, right = cls.start + datetime.timedelta(hours=1), cls.start + datetime.timedelta(hours=4)
+        for bucket_us in (cls.hour_us // 6, cls.hour_us, 24*cls.hour_us):
+            for seller_user_id in (None, "s1"):
+                assert repo.aggregate_auctions(left, right, bucket_us, seller_user_id) == in_memory.aggregate_auctions(left, right, bucket_us, seller_user_id)
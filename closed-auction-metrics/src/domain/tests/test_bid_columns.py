@@ -0,0 +1,74 @@
+from typing import List
+import pytest
+import datetime
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.bid_columns import BidColumns
+from domain.closed_auction import ClosedAuction
+from domain.auction_metrics import AuctionMetrics
+
+class TestBidColumns:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        # out of time order, with a tie on the highest amount and an inactive last bid
+        seconds = [5, 1, 9, 3, 12]
+        amounts = [4000, 3500, 4500, 4500, 5000]
+        active = [True, True, True, True, False]
+        cls.bids = [Bid(str(100+i), "200", f"bidder{i%2}", amount, cls.start + datetime.timedelta(seconds=second), is_active) for i, (second, amount, is_active) in enumerate(zip(seconds, amounts, active))]
+
+    def auctions(cls) -> List[ClosedAuction]:
+        """the same auction, backed by a list of Bids and by BidColumns"""
+        return [ClosedAuction.generate_auction(bids, 200, cls.start, datetime.timedelta(minutes=30), None) for bids in (list(cls.bids), BidColumns.from_bids(cls.bids))]
+
+    def test_round_trip(cls):
+        columns = BidColumns.from_bids(cls.bids)
+        assert [bid.convert_to_dict() for bid in columns.to_bids()] == [bid.convert_to_dict() for bid in cls.bids]
+        assert columns.bid(2).convert_to_dict() == cls.bids[2].convert_to_dict()
+        assert columns.convert_to_dicts() == [bid.convert_to_dict() for bid in cls.bids]
+        assert columns.convert_to_epoch_micros_dicts() == [bid.convert_to_dict_w_epoch_micros() for bid in cls.bids]
+        assert BidColumns.from_epoch_micros_dicts(columns.convert_to_epoch_micros_dicts()).convert_to_dicts() == columns.convert_to_dicts()
+
+    def test_columnar_auction_matches_list_backed(cls):
+        listed, columnar = cls.auctions()
+        assert columnar._bid_list is None
+        assert columnar.convert_to_dict() == listed.convert_to_dict()
+        assert columnar.convert_to_dict_w_epoch_micros() == listed.convert_to_dict_w_epoch_micros()
+        assert columnar.content_hash() == listed.content_hash()
+        assert columnar.bid_history_series() == listed.bid_history_series()
+        assert columnar.infer_winning_bid().convert_to_dict() == listed.infer_winning_bid().convert_to_dict()
+        assert columnar._bid_list is None # none of the above needed Bid objects
+        assert repr(columnar) == repr(listed)
+
+    def test_metrics(cls):
+        columns = BidColumns.from_bids(cls.bids)
+        assert columns.max_bid_index() == 4
+        assert columns.last_active_bid_index() == 2 # bid at 9s; the one at 12s is inactive
+        assert columns.intervals_us().tolist() == [2_000_000, 2_000_000, 4_000_000, 3_000_000]
+
+    def test_compact_bids(cls):
+        listed, _ = cls.auctions()
+        before = listed.convert_to_dict()
+        listed.compact_bids()
+        assert listed._bid_list is None and listed.num_bids() == 5
+        assert listed.convert_to_dict() == before
+
+    def test_auction_metrics(cls):
+        listed, columnar = cls.auctions()
+        order = [bid._bid_id for bid in listed._bid_list]
+        metrics = listed.metrics()
+        assert [bid._bid_id for bid in listed._bid_list] == order # inferring the winner no longer re-sorts the bids
+        assert metrics.convert_to_dict() == columnar.metrics().convert_to_dict() == {
+            'winner_user_id': 'bidder0', # bid at 9s; the one at 12s is inactive
+            'final_price_in_cents': 4500,
+            'final_to_start_price_ratio': 4500/3400,
+            'num_bids': 5,
+            'num_unique_bidders': 2,
+            'first_bid_latency_us': 1_000_000,
+            'bid_span_us': 11_000_000,
+            'cancelled': False,
+        }
+        assert listed.without_bids().metrics() is metrics
+        assert AuctionMetrics.from_dict(listed.convert_to_dict_w_epoch_micros()).convert_to_dict() == metrics.convert_to_dict()
@@ -0,0 +1,37 @@
+import numpy as np
+from typing import Iterable
+
+def lttbIndices(x: np.ndarray, y: np.ndarray, threshold: int, keep: Iterable[int]=()) -> np.ndarray:
+    """
+    largest-triangle-three-buckets downsampling: returns the (sorted) indices of at most
+    threshold points of the series (x, y) that keep its visual shape, plus any indices in
+    keep (e.g. the maximum). the first and last points are always kept. x must be sorted.
+    series with no more than threshold points (or thresholds below 3) are returned whole.
+
+    the buckets are visited in order (each choice depends on the previous one), but the
+    work inside a bucket is vectorized, so the cost is O(len(x)) numpy work plus O(threshold)
+    python iterations.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64) - float(x[0]) # relative, so epoch microseconds keep their precision
+    y = np.asarray(y, dtype=np.float64)
+
+    # threshold-2 buckets over the points between the first and the last
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return np.union1d(selected, np.fromiter(keep, dtype=np.int64))
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Generic, Optional, TypeVar
+
+K = TypeVar("K")
+
+class BytesLRUCache(Generic[K]):
+    """
+    thread-safe least-recently-used cache of bytes values, bounded by the total size of
+    the values (rather than by the number of entries). a value larger than max_bytes is
+    never cached.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._entries : "OrderedDict[K, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: K, value: bytes):
+        if len(value) > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self._max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,47 @@
+import threading
+import time
+from typing import Callable, Tuple
+
+class ThroughputMeter:
+    """
+    thread-safe count of processed items. every report_interval_s seconds (checked on record())
+    it prints the rate over the last interval and since the meter started, e.g.
+
+        [consumer] 1200 msgs in 10.0s (120.0 msg/s); 5400 total (108.0 msg/s overall)
+    """
+
+    def __init__(self, name: str, unit: str="msgs", report_interval_s: float=10.0, clock: Callable[[], float]=time.monotonic) -> None:
+        self._name = name
+        self._unit = unit
+        self._report_interval_s = report_interval_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._started = clock()
+        self._total = 0
+        self._interval_start = self._started
+        self._interval_count = 0
+
+    def record(self, count: int=1):
+        with self._lock:
+            self._total += count
+            self._interval_count += count
+            now = self._clock()
+            if now - self._interval_start < self._report_interval_s:
+                return
+            report = self._format_report(now)
+            self._interval_start = now
+            self._interval_count = 0
+        print(report)
+
+    def rates(self) -> Tuple[int, float]:
+        """returns (total items, items per second since the meter started)."""
+        with self._lock:
+            elapsed = self._clock() - self._started
+            return self._total, (self._total/elapsed if elapsed > 0 else 0.0)
+
+    def _format_report(self, now: float) -> str:
+        interval = now - self._interval_start
+        elapsed = now - self._started
+        unit_rate = f"{self._unit[:-1] if self._unit.endswith('s') else self._unit}/s"
+        return (f"[{self._name}] {self._interval_count} {self._unit} in {interval:.1f}s ({self._interval_count/interval:.1f} {unit_rate}); "
+                f"{self._total} total ({self._total/elapsed:.1f} {unit_rate} overall)")
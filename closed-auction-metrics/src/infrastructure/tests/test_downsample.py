@@ -0,0 +1,28 @@
+import pytest
+import numpy as np
+from infrastructure.downsample import lttbIndices
+
+class TestLTTB:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        rng = np.random.default_rng(51205)
+        cls.x = np.cumsum(rng.integers(1, 10**6, size=10_000)) + 1_669_000_000_000_000 # epoch microseconds
+        cls.y = rng.integers(100, 10**6, size=10_000)
+
+    def test_short_series_are_kept_whole(cls):
+        assert lttbIndices(cls.x[:10], cls.y[:10], 10).tolist() == list(range(10))
+        assert lttbIndices(cls.x, cls.y, 2).tolist() == list(range(10_000))
+
+    def test_budget_endpoints_and_kept_points(cls):
+        peak = int(np.argmax(cls.y))
+        indices = lttbIndices(cls.x, cls.y, 500, keep=[peak, 1234])
+        assert len(indices) <= 502
+        assert indices[0] == 0 and indices[-1] == 9_999
+        assert peak in indices and 1234 in indices
+        assert (np.diff(indices) > 0).all()
+
+    def test_keeps_a_spike(cls):
+        y = np.zeros(1_000)
+        y[437] = 1.0
+        assert 437 in lttbIndices(np.arange(1_000), y, 20)
@@ -0,0 +1,24 @@
+import pytest
+from infrastructure.lru import BytesLRUCache
+
+class TestBytesLRUCache:
+
+    def test_evicts_least_recently_used_by_size(cls):
+        cache : BytesLRUCache[str] = BytesLRUCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        assert cache.get("a") == b"aaaa" # "b" is now the least recently used
+        cache.put("c", b"cccc")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.get("c") == b"cccc"
+        assert cache.stats() == {"entries": 2, "bytes": 8, "max_bytes": 10, "hits": 3, "misses": 1, "evictions": 1}
+
+    def test_replacing_and_oversized_values(cls):
+        cache : BytesLRUCache[str] = BytesLRUCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("a", b"aaaaaa")
+        cache.put("big", b"x"*11)
+        assert cache.get("big") is None
+        assert cache.stats()["bytes"] == 6
@@ -0,0 +1,36 @@
+import pytest
+from infrastructure.metrics import ThroughputMeter
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestThroughputMeter:
+
+    def test_reports_once_per_interval(cls, capsys):
+        clock = FakeClock()
+        meter = ThroughputMeter("consumer", report_interval_s=10.0, clock=clock)
+        meter.record(5)
+        clock.now += 4
+        meter.record(15)
+        assert capsys.readouterr().out == ""
+
+        clock.now += 6
+        meter.record(30)
+        assert capsys.readouterr().out == "[consumer] 50 msgs in 10.0s (5.0 msg/s); 50 total (5.0 msg/s overall)\n"
+
+        clock.now += 5
+        meter.record(10)
+        assert capsys.readouterr().out == ""
+
+    def test_rates(cls):
+        clock = FakeClock()
+        meter = ThroughputMeter("consumer", clock=clock)
+        assert meter.rates() == (0, 0.0)
+        meter.record(30)
+        clock.now += 3
+        assert meter.rates() == (30, 10.0)
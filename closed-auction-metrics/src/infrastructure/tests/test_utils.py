@@ -0,0 +1,40 @@
+import pytest
+import datetime
+from infrastructure import utils
+from infrastructure.utils import TIME_ZONE
+
+class TestTimestampCodec:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.times = [
+            TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 )),
+            TIME_ZONE.localize(datetime.datetime(year = 2022, month=11, day=23, hour=1, minute=41, second=13,microsecond=0 )),
+            TIME_ZONE.localize(datetime.datetime(year = 1500, month=1, day=1)),
+        ]
+
+    def test_matches_strftime_and_strptime(cls):
+        for time in cls.times:
+            str_time = utils.toSQLTimestamp6Repr(time)
+            assert str_time == time.strftime(utils.TIME_PARSE_FORMAT)
+            parsed = utils.toDatetimeFromStr(str_time)
+            assert parsed == TIME_ZONE.localize(datetime.datetime.strptime(str_time,utils.TIME_PARSE_FORMAT))
+            assert parsed.tzinfo is TIME_ZONE
+
+    def test_batch_round_trip(cls):
+        assert utils.toDatetimesFromStrs(utils.toSQLTimestamp6Reprs(cls.times)) == cls.times
+
+    def test_non_canonical_and_malformed_strings(cls):
+        # fewer fractional digits still parse (via strptime), offsets and garbage do not
+        assert utils.toDatetimeFromStr("2022-03-17 00:00:00.5") == TIME_ZONE.localize(datetime.datetime(year=2022,month=3,day=17,microsecond=500000))
+        for bad in ["2022-03-17T00:00:00.130002", "2022-03-17 00:00:00.1+0500", "2022-13-17 00:00:00.130002", "05/04/2022"]:
+            with pytest.raises(ValueError):
+                utils.toDatetimeFromStr(bad)
+
+    def test_epoch_micros_round_trip(cls):
+        for time in cls.times:
+            assert utils.toDatetimeFromEpochMicros(utils.toEpochMicros(time)) == time
+        assert utils.toEpochMicros(TIME_ZONE.localize(datetime.datetime(year=1970,month=1,day=1,microsecond=1))) == 1
+        # naive datetimes (as returned by pymongo) are treated as utc
+        assert utils.toEpochMicros(datetime.datetime(year=1970,month=1,day=1,second=1)) == 1_000_000
+        assert utils.toDatetimesFromEpochMicros(utils.toEpochMicrosList(cls.times)) == cls.times
@@ -1,11 +1,88 @@
 import pytz
+import base64
+import binascii
 import datetime
+import json
+from typing import Iterable, List, Tuple
 
 TIME_ZONE = pytz.timezone("UTC")
 TIME_PARSE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
 
+# every timestamp this service exchanges is a fixed-width UTC string in TIME_PARSE_FORMAT
+# (e.g. "2022-11-23 01:41:13.629971"), and every bid carries one, so the codec below
+# avoids strptime/strftime (which re-interpret the format string on every call) and
+# pytz's localize(). pytz's UTC is a fixed-offset tzinfo, so attaching it directly gives
+# the same result as TIME_ZONE.localize(). see benchmarks/bench_timestamps.py.
+_SQL_TIMESTAMP6_LEN = 26
+_fromisoformat = datetime.datetime.fromisoformat
+
 def toSQLTimestamp6Repr(aDatetime: datetime.datetime) -> str:
-    return aDatetime.strftime(TIME_PARSE_FORMAT)
+    # isoformat() always zero-pads the year and microseconds; drop any utc offset suffix
+    return aDatetime.isoformat(" ", "microseconds")[:_SQL_TIMESTAMP6_LEN]
 
 def toDatetimeFromStr(aStrDatetime: str) -> datetime.datetime:
+    if _isSQLTimestamp6(aStrDatetime):
+        return _fromisoformat(aStrDatetime).replace(tzinfo=TIME_ZONE)
+    # anything not in the canonical fixed-width layout (e.g. fewer fractional digits)
     return TIME_ZONE.localize(datetime.datetime.strptime(aStrDatetime,TIME_PARSE_FORMAT))
+
+def _isSQLTimestamp6(s: str) -> bool:
+    # the all-digit fraction rules out utc offset suffixes, which fromisoformat would honor
+    return len(s) == _SQL_TIMESTAMP6_LEN and s[10] == " " and s[19] == "." and s[20:].isdigit()
+
+def toSQLTimestamp6Reprs(datetimes: Iterable[datetime.datetime]) -> List[str]:
+    """batch version of toSQLTimestamp6Repr() (e.g. for every bid of an auction)."""
+    n = _SQL_TIMESTAMP6_LEN
+    return [aDatetime.isoformat(" ", "microseconds")[:n] for aDatetime in datetimes]
+
+def toDatetimesFromStrs(strDatetimes: Iterable[str]) -> List[datetime.datetime]:
+    """batch version of toDatetimeFromStr() (e.g. for every bid of an auction)."""
+    n, utc, fromisoformat = _SQL_TIMESTAMP6_LEN, TIME_ZONE, _fromisoformat
+    return [
+        fromisoformat(s).replace(tzinfo=utc) if len(s) == n and s[10] == " " and s[19] == "." and s[20:].isdigit() else toDatetimeFromStr(s)
+        for s in strDatetimes
+    ]
+
+# persisted times are int64 microseconds since the unix epoch (UTC): exact at microsecond
+# precision (mongo dates only keep milliseconds), orderable/indexable as plain integers,
+# and decoded with integer arithmetic instead of string parsing.
+_EPOCH = TIME_ZONE.localize(datetime.datetime(year=1970, month=1, day=1))
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+_timedelta = datetime.timedelta
+
+def toEpochMicros(aDatetime: datetime.datetime) -> int:
+    """naive datetimes are taken to already be in UTC (as pymongo returns them)."""
+    if aDatetime.tzinfo is None:
+        aDatetime = aDatetime.replace(tzinfo=TIME_ZONE)
+    return (aDatetime - _EPOCH) // _ONE_MICROSECOND
+
+def toDatetimeFromEpochMicros(epochMicros: int) -> datetime.datetime:
+    return _EPOCH + _timedelta(microseconds=epochMicros)
+
+def toEpochMicrosList(datetimes: Iterable[datetime.datetime]) -> List[int]:
+    """batch version of toEpochMicros() (e.g. for every bid of an auction)."""
+    return [toEpochMicros(aDatetime) for aDatetime in datetimes]
+
+def toDatetimesFromEpochMicros(epochMicrosList: Iterable[int]) -> List[datetime.datetime]:
+    """batch version of toDatetimeFromEpochMicros() (e.g. for every bid of an auction)."""
+    epoch, timedelta = _EPOCH, _timedelta
+    return [epoch + timedelta(microseconds=epochMicros) for epochMicros in epochMicrosList]
+
+def encodePageCursor(end_time: datetime.datetime, item_id: str) -> str:
+    """
+    returns an opaque, url-safe continuation token for the keyset (end_time, item_id)
+    of the last closed auction a client has seen.
+    """
+    payload = json.dumps([toSQLTimestamp6Repr(end_time), item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decodePageCursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    """inverse of encodePageCursor(); raises ValueError if the token is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        str_end_time, item_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f"malformed page cursor: {cursor!r}") from e
+    if not isinstance(str_end_time, str) or not isinstance(item_id, str):
+        raise ValueError(f"malformed page cursor: {cursor!r}")
+    return toDatetimeFromStr(str_end_time), item_id
@@ -0,0 +1,54 @@
+"""Command line utility for managing this service's mongo database (indexes, query plans, migrations, rollups).
+
+Run from within the closed-auction-metrics container (or anywhere the mongo host resolves), e.g.
+
+    python3 manage_mongo.py ensure-indexes
+    python3 manage_mongo.py index-status
+    python3 manage_mongo.py explain --host localhost
+    python3 manage_mongo.py migrate --batch-size 1000
+    python3 manage_mongo.py rebuild-rollups
+"""
+
+import argparse
+
+from domain.auction_repository_mongo import MongoDbAuctionRepository
+
+CAM_MONGO_CONTAINER_HOSTNAME = "cam-mongo-server"
+
+def ensure_indexes(repo: MongoDbAuctionRepository, args: argparse.Namespace):
+    repo.ensure_indexes()
+
+def index_status(repo: MongoDbAuctionRepository, args: argparse.Namespace):
+    repo.report_index_builds()
+
+def explain(repo: MongoDbAuctionRepository, args: argparse.Namespace):
+    plans = repo.check_query_plans()
+    if any("COLLSCAN" in stages for stages in plans.values()):
+        raise SystemExit(1) # lets CI / deploy scripts catch a missing index
+
+def migrate(repo: MongoDbAuctionRepository, args: argparse.Namespace):
+    repo.migrate_documents(batch_size=args.batch_size)
+
+def rebuild_rollups(repo: MongoDbAuctionRepository, args: argparse.Namespace):
+    repo.rebuild_rollups()
+
+def main():
+    parser = argparse.ArgumentParser(description="manage the closed-auction-metrics mongo database")
+    parser.add_argument("--host", default=CAM_MONGO_CONTAINER_HOSTNAME, help="mongo hostname")
+    parser.add_argument("--port", default="27017", help="mongo port")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("ensure-indexes", help="create any missing indexes (idempotent)").set_defaults(func=ensure_indexes)
+    subparsers.add_parser("index-status", help="report progress of running index builds").set_defaults(func=index_status)
+    subparsers.add_parser("explain", help="flag collection scans in the repository's query shapes").set_defaults(func=explain)
+    migrate_parser = subparsers.add_parser("migrate", help="rewrite documents stored in an older layout (idempotent)")
+    migrate_parser.add_argument("--batch-size", type=int, default=500, help="documents per bulk write")
+    migrate_parser.set_defaults(func=migrate)
+    subparsers.add_parser("rebuild-rollups", help="regenerate the hourly/daily rollups from the auctions").set_defaults(func=rebuild_rollups)
+
+    args = parser.parse_args()
+    repo = MongoDbAuctionRepository(args.host, args.port, manage_indexes=False)
+    args.func(repo, args)
+
+if __name__ == "__main__":
+    main()
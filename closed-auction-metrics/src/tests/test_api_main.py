@@ -0,0 +1,137 @@
+import pytest
+import asyncio
+import datetime
+import json
+from typing import List
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from infrastructure.utils import TIME_ZONE
+
+from domain.bid import Bid
+from domain.closed_auction import ClosedAuction
+from domain.auction_repository import InMemoryAuctionRepository
+from application.closed_auction_metrics_service import ClosedAuctionMetricsService
+from application.tests.test_auction_consumer import auction_message
+import api_main
+from api_main import RESTAPI, VERSION, _check_modes, _drop_messages_from_closed_channels, _store_batch_async, attachRabbitMQConsumer
+
+class TestConditionalRequests:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        start = TIME_ZONE.localize(datetime.datetime(year = 2022, month=3, day=17, hour=0, minute=0, second=0,microsecond=130002 ))
+        repo = InMemoryAuctionRepository()
+        repo.save_auction(ClosedAuction.generate_auction([Bid.generate_basic_bid(i,7) for i in range(3)],7,start,datetime.timedelta(minutes=5),None))
+        app = FastAPI()
+        app.include_router(RESTAPI(ClosedAuctionMetricsService(repo)).router)
+        cls.client = TestClient(app)
+
+    @pytest.mark.parametrize("path", ["/closedauctions/7", "/closedauctions/7/visualization", "/closedauctions/7/series"])
+    def test_matching_etag_is_not_modified(cls, path):
+        response = cls.client.get(f"/api/{VERSION}{path}")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        for if_none_match in (etag, f"W/{etag}", f'"other", {etag}'):
+            revalidated = cls.client.get(f"/api/{VERSION}{path}", headers={"If-None-Match": if_none_match})
+            assert revalidated.status_code == 304
+            assert revalidated.headers["ETag"] == etag
+            assert revalidated.content == b""
+
+    def test_stale_etag_gets_the_body(cls):
+        response = cls.client.get(f"/api/{VERSION}/closedauctions/7", headers={"If-None-Match": '"stale"'})
+        assert response.status_code == 200
+        assert "7" in response.json()
+
+class TestRunModes:
+
+    def test_supported_combinations(cls):
+        for run_mode, consumer_mode in (("asyncio", "batched"), ("processes", "batched"), ("processes", "pooled")):
+            _check_modes(run_mode, consumer_mode)
+
+    def test_pooled_consumer_needs_the_processes_run_mode(cls):
+        # the asyncio run mode always starts the batched aio-pika consumer; refuse rather than ignore the setting
+        with pytest.raises(ValueError, match="pooled"):
+            _check_modes("asyncio", "pooled")
+
+    def test_unknown_modes(cls):
+        with pytest.raises(ValueError, match="CAM_RUN_MODE"):
+            _check_modes("threads", "batched")
+        with pytest.raises(ValueError, match="CAM_CONSUMER_MODE"):
+            _check_modes("processes", "parallel")
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.is_closed = False
+
+class FakeMessage:
+    """the part of an aio-pika incoming message the consumer uses; records how it was settled."""
+
+    def __init__(self, channel: FakeChannel, delivery_tag: int, body: bytes) -> None:
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        self.body = body
+        self.settled : List[str] = []
+
+    async def ack(self, multiple: bool=False):
+        self.settled.append("ack")
+
+    async def nack(self, requeue: bool=True):
+        self.settled.append("requeue" if requeue else "dead-letter")
+
+class TestAsyncConsumer:
+
+    def setup_class(cls):
+        """this code runs before this whole test module runs"""
+        cls.repo = InMemoryAuctionRepository()
+        cls.service = ClosedAuctionMetricsService(cls.repo)
+
+    def test_reopened_channel_drops_buffered_messages_of_the_old_one(cls):
+        old, new = FakeChannel(), FakeChannel()
+        buffered = [FakeMessage(old, 1, auction_message("30")), FakeMessage(old, 2, auction_message("31")), FakeMessage(new, 1, auction_message("32"))]
+        messages : asyncio.Queue = asyncio.Queue()
+        for message in buffered:
+            messages.put_nowait(message)
+        old.is_closed = True # the connection was lost; connect_robust opened new
+        _drop_messages_from_closed_channels(messages)
+        assert [messages.get_nowait() for _ in range(messages.qsize())] == buffered[2:]
+
+    def test_messages_of_a_closed_channel_are_neither_stored_nor_settled(cls):
+        old, new = FakeChannel(), FakeChannel()
+        stale = FakeMessage(old, 7, auction_message("40"))
+        live = [FakeMessage(new, 7, auction_message("41")), FakeMessage(new, 8, auction_message("42"))]
+        old.is_closed = True
+        asyncio.run(_store_batch_async([stale] + live, cls.service))
+        assert cls.repo.get_auction("40") is None and stale.settled == [] # the broker redelivers it
+        assert cls.repo.get_auction("41") is not None and live[-1].settled == ["ack"]
+
+    def test_channel_closed_during_the_write(cls):
+        channel = FakeChannel()
+        class ClosingService(ClosedAuctionMetricsService):
+            def save_closed_auctions(self, auctions):
+                channel.is_closed = True # e.g. the broker restarted meanwhile
+                return super().save_closed_auctions(auctions)
+        batch = [FakeMessage(channel, 1, auction_message("50"))]
+        asyncio.run(_store_batch_async(batch, ClosingService(InMemoryAuctionRepository())))
+        assert batch[0].settled == [] # its tag would be unknown on the new channel
+
+class TestConsumerLifespan:
+
+    def test_consumer_runs_for_the_lifespan_of_the_app(cls, monkeypatch):
+        events : List[str] = []
+        async def run_rabbitmq_consumer(c_a_m_service):
+            events.append("started")
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                events.append("cancelled")
+                raise
+        monkeypatch.setattr(api_main, "run_rabbitmq_consumer", run_rabbitmq_consumer)
+
+        app = FastAPI()
+        app.include_router(RESTAPI(ClosedAuctionMetricsService(InMemoryAuctionRepository())).router)
+        attachRabbitMQConsumer(app, None)
+        with TestClient(app) as client: # runs the lifespan around the requests
+            assert client.get("/").status_code == 200
+            assert events == ["started"]
+        assert events == ["started", "cancelled"]